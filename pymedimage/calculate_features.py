@@ -13,6 +13,25 @@ from pymedimage.quantization import QMODE_STAT, QMODE_FIXEDHU
 # initialize module logger
 logger = logging.getLogger(__name__)
 
+# arguments that hold a neighborhood size, which calculation functions marked with features.sweeps accept as a
+# list of sizes calculated in a single sweep (features.image_firstorder: radius, features.image_haar: sadd), see
+# calculateRadiusSweep
+SWEEP_ARGS = ('radius', 'sadd')
+
+def getSweepArg(local_feature_def):
+    """name of the argument of local_feature_def that holds a list of sizes to sweep, or None
+
+    Raises:
+        ValueError: if the calculation function does not accept a list of sizes for that argument
+    """
+    for arg in SWEEP_ARGS:
+        if isinstance(local_feature_def.args.get(arg, None), (list, tuple)):
+            if arg not in getattr(local_feature_def.calculation_function, 'sweep_args', ()):
+                raise ValueError('feature "{!s}": {!s} does not accept a list of sizes for "{!s}"'.format(
+                    local_feature_def.label, local_feature_def.calculation_function.__name__, arg))
+            return arg
+    return None
+
 def checkCalculated(doi, local_feature_def):
     # check if already calculated
     p_doi_features = doi.getFeaturesPath()
@@ -86,6 +105,76 @@ def calculateFeature(doi, local_feature_def, loadprecalculated=False):
     else:
         return (0, feature_vol)
 
+def calculateRadiusSweep(doi, local_feature_def, radii, arg='radius', save=True, loadprecalculated=False):
+    """calculate a feature at several neighborhood sizes in a single call of its calculation function
+
+    The calculation function must accept a list for arg and return one feature volume per entry (e.g.
+    features.image_firstorder with radius, features.image_haar with sadd, as marked by features.sweeps), sharing
+    its intermediate tables between the sizes. Each result is labeled and stored as the single size definition
+    with arg set to that size, so checkCalculated() finds it as if it were calculated on its own.
+
+    MultiprocessManager_CalculateFeatures runs a sweep for every LocalFeatureDefinition with a list of sizes in
+    one of SWEEP_ARGS, e.g. after local_feature_def.addArg('radius', [1, 2, 3]).
+
+    Args:
+        doi (str): string identifier unique to each patient/doi
+        local_feature_def (LocalFeatureDefinition): information for feature calculation
+        radii (list): values of arg to calculate
+
+    Optional Args:
+        arg (str): name of the argument of the calculation function that is swept
+        save (bool): store the calculated feature volumes with saveFeature()
+
+    Returns:
+        list: (status code, feature volume) of each radius, with the status codes of calculateFeature()
+    """
+    # load dicom data
+    vol = doi.getImageVolume()
+    if vol is None:
+        return [(1, None) for r in radii]
+
+    # force stat based GLCM quantization if not CT image
+    local_feature_def = quantization.enforceGLCMQuantizationMode(local_feature_def, vol.modality)
+
+    featdefs = []
+    results = [None]*len(radii)
+    pending = []
+    for i, r in enumerate(radii):
+        featdef = local_feature_def.copy()
+        featdef.addArg(arg, r)
+        featdefs.append(featdef)
+        if checkCalculated(doi, featdef) and not featdef.recalculate:
+            logger.debug('Feature already calculated for {!s}={!s}. skipping'.format(arg, r))
+            if loadprecalculated:
+                loaded_feature_vol = loadPrecalculated(doi, featdef)
+            else: loaded_feature_vol = None
+            results[i] = (10, loaded_feature_vol)
+        else:
+            pending.append(i)
+    if not pending:
+        return results
+
+    try:
+        roi = doi.getROI()
+    except Exception as e:
+        logger.debug('failed to load ROI for doi: {!s}, calculating without ROI: {!s}'.format(doi, e))
+        roi = None
+
+    # compute all pending sizes at once
+    logger.debug('calculating "{!s}" for {!s}={!s} for doi: {!s}'.format(
+        local_feature_def.label, arg, [radii[i] for i in pending], doi))
+    args = featdefs[pending[0]].args.copy()
+    args[arg] = [radii[i] for i in pending]
+    feature_vols = local_feature_def.calculation_function(vol, roi, **args)
+    for i, feature_vol in zip(pending, feature_vols):
+        featdef = featdefs[i]
+        recalculated = featdef.recalculate and checkCalculated(doi, featdef)
+        feature_vol.feature_label = featdef.generateFeatureLabel()
+        if save:
+            saveFeature(doi, featdef, feature_vol)
+        results[i] = ((11 if recalculated else 0), feature_vol)
+    return results
+
 def calculateCompositeFeature(doi, composite_feature_def, saveintermediate=False, loadprecalculated=False):
     # try to load image volume
     vol = doi.getImageVolume()
@@ -137,7 +226,13 @@ class MultiprocessManager_CalculateFeatures(MultiprocessManagerBase):
         time_start = time.time()
         try:
             cls = local_feature_def.__class__.__name__
-            if ('LocalFeatureDefinition' in cls):
+            sweep_arg = getSweepArg(local_feature_def) if ('LocalFeatureDefinition' in cls) else None
+            if sweep_arg:
+                # every size is stored by calculateRadiusSweep, report the sweep as calculated if any size was
+                results = calculateRadiusSweep(doi, local_feature_def, local_feature_def.args[sweep_arg], sweep_arg)
+                calculated = [code for code, feature_vol in results if code != 10]
+                result_code = max(calculated) if calculated else 10
+            elif ('LocalFeatureDefinition' in cls):
                 result_code, feature_vol = calculateFeature(doi, local_feature_def)
                 if feature_vol:
                     saveFeature(doi, local_feature_def, feature_vol)
@@ -4,7 +4,8 @@ Contains class definitions for inheritence in dataset specific implementations
 """
 import os
 import logging
-from collections import OrderedDict, MutableSequence
+from collections import OrderedDict
+from collections.abc import MutableSequence
 from abc import ABCMeta, abstractmethod
 
 # initialize module logger
@@ -6,12 +6,19 @@ Utility functions for calculating common image features
 import logging
 import math
 import time
+import inspect
+import functools
+import collections
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
 import scipy.ndimage
 import scipy.stats
 import pywt
 from pymedimage.rttypes import MaskableVolume, FrameOfReference
 from pymedimage.misc import g_indents, indent, timer
+from pymedimage import quantization, features_glcm, features_glrlm, features_firstorder
+from pymedimage import features_morphology, features_haar, features_shared, features_tiled
+from pymedimage.multiprocess_manager import default_workers
 
 # initialize module logger
 logger = logging.getLogger(__name__)
@@ -20,192 +27,730 @@ logger = logging.getLogger(__name__)
 l3 = g_indents[3]
 l4 = g_indents[4]
 
-def image_iterator(processing_function, image_volume, radius=2, roi=None):
+# upper bound on the bytes of patch data materialized at once by the block-batched patch engine
+BLOCK_BYTES = 2**23
+
+def batched(processing_function):
+    """decorator marking processing_function as a block-wise plugin for image_iterator
+
+    batched plugins are called once per block with all N patches stacked along the first axis, e.g. an ndarray
+    of shape (N, pz, py, px), and must return N results rather than being called once per patch. glcm statistics
+    are marked the same way when they accept a (N, L, L) block of matrices.
+    """
+    processing_function.batched = True
+    return processing_function
+
+def sweeps(*args):
+    """decorator marking the arguments of a feature function that accept a list of neighborhood sizes, which are
+    all calculated in one call and returned as a list (see calculate_features.calculateRadiusSweep)
+    """
+    def mark_sweep_args(feature_function):
+        feature_function.sweep_args = args
+        return feature_function
+    return mark_sweep_args
+
+def tile_halo(halo_function):
+    """decorator declaring how far a feature function reads around each voxel when that exceeds its radius, as
+    halo_function(radius, **feature_args) -> voxels (see features_tiled.feature_halo)
+    """
+    def mark_tile_halo(feature_function):
+        feature_function.tile_halo = halo_function
+        return feature_function
+    return mark_tile_halo
+
+def _evaluate_block(processing_function, patches):
+    """apply processing_function to a block of patches of shape (N, pz, py, px), returning N results"""
+    if getattr(processing_function, 'batched', False):
+        return processing_function(patches)
+    results = np.empty(patches.shape[0])
+    for i, patch in enumerate(patches):
+        results[i] = processing_function(patch)
+    return results
+
+def _unpack_image(image_volume):
+    """get 3d ndarray of voxel intensities from a MaskableVolume or a 2d/3d np.ndarray
+
+    Returns:
+        (array, is_volume) or (None, None) for unsupported types
+    """
+    # This is an ugly way of type-checking but cant get isinstance to see both as the same
+    if (MaskableVolume.__name__ in str(type(image_volume))):
+        return image_volume.data.reshape(image_volume.frameofreference.size[::-1]), True
+    elif isinstance(image_volume, np.ndarray):
+        if image_volume.ndim == 2:
+            return image_volume.reshape((1, *image_volume.shape)), False
+        return image_volume, False
+    logger.info('invalid image type supplied ({:s}). Please specify an image of type BaseVolume \
+        or type np.ndarray'.format(str(type(image_volume))))
+    return None, None
+
+def _calculation_bounds(image_volume, shape, roi=None):
+    """index bounds (start, stop) in (z, y, x) order of the voxels to evaluate
+
+    restricted to the bounding box of roi when it is supplied. roi may also be a tuple of (z, y, x) index
+    slices, as passed for the tiles of features_tiled.tiled_feature
+    """
+    if (roi is None):
+        return (0, 0, 0), tuple(shape)
+    if isinstance(roi, tuple):
+        return tuple(s.start for s in roi), tuple(s.stop for s in roi)
+
+    # get max extents of the mask/ROI to speed up calculation only within ROI cubic volume
+    extents = roi.getROIExtents()
+    cstart, rstart, dstart = image_volume.frameofreference.getIndices(extents.start)
+    cstop, rstop, dstop = np.subtract(image_volume.frameofreference.getIndices(extents.end()), 1)
+    logger.info(indent('calculation subset volume x=({xstart:d}->{xstop:d}), '
+                                           'y=({ystart:d}->{ystop:d}), '
+                                           'z=({zstart:d}->{zstop:d})'.format(zstart=dstart,
+                                                                              zstop=dstop,
+                                                                              ystart=rstart,
+                                                                              ystop=rstop,
+                                                                              xstart=cstart,
+                                                                              xstop=cstop ), l4))
+    return (int(dstart), int(rstart), int(cstart)), (int(dstop), int(rstop), int(cstop))
+
+def _package_feature(feature_array, image_volume, roi=None, stride=None):
+    """wrap a feature array of the calculation subset shape to match the type of image_volume
+
+    feature arrays evaluated on a coarse lattice with the given (z, y, x) stride get a FrameOfReference with
+    correspondingly scaled spacing
+    """
+    if isinstance(image_volume, np.ndarray):
+        if image_volume.ndim == 2:
+            # need to reshape ndarray if input was 2d
+            return feature_array.reshape(feature_array.shape[1:])
+        return feature_array
+
+    if (roi is not None or stride is not None):
+        spacing = image_volume.frameofreference.spacing
+        if isinstance(roi, tuple):
+            # index slices, see _calculation_bounds
+            start = tuple(np.add(image_volume.frameofreference.start,
+                                 np.multiply([s.start for s in roi[::-1]], spacing)))
+        else:
+            start = roi.getROIExtents().start if roi is not None else image_volume.frameofreference.start
+        if stride is not None:
+            spacing = tuple(float(x*s) for x, s in zip(spacing, stride[::-1]))
+        d_subset, r_subset, c_subset = feature_array.shape
+        feature_frameofreference = FrameOfReference((start),
+                                                    (spacing),
+                                                    (c_subset, r_subset, d_subset))
+        return MaskableVolume().fromArray(feature_array, feature_frameofreference)
+    return MaskableVolume().fromArray(feature_array, image_volume.frameofreference)
+
+def _stride(stride):
+    """(sz, sy, sx) steps of the evaluation lattice from None, a single step or a tuple"""
+    if stride is None:
+        return (1, 1, 1)
+    if np.isscalar(stride):
+        stride = (stride, )*3
+    stride = tuple(int(s) for s in stride)
+    if len(stride) != 3 or min(stride) < 1:
+        raise ValueError('stride must be a positive integer or (sz, sy, sx), not {!s}'.format(stride))
+    return stride
+
+def _lattice_shape(start, stop, stride):
+    """number of lattice points of every stride-th voxel from start along each axis of [start, stop)"""
+    return tuple(int(np.ceil((e-b) / s)) for b, e, s in zip(start, stop, stride))
+
+def _interpolate_lattice(lattice_array, shape, stride):
+    """separable linear interpolation of values at every stride-th voxel back to all voxels of shape
+
+    voxels beyond the last lattice point along an axis take its value
+    """
+    result = lattice_array
+    for axis, (n, s) in enumerate(zip(shape, stride)):
+        if s == 1:
+            continue
+        position = np.arange(n) / s
+        lo = np.minimum(np.floor(position).astype(int), result.shape[axis]-1)
+        hi = np.minimum(lo+1, result.shape[axis]-1)
+        weight = (position - lo).reshape([-1 if a == axis else 1 for a in range(result.ndim)])
+        result = np.take(result, lo, axis) * (1-weight) + np.take(result, hi, axis) * weight
+    return result
+
+def _get_z_radius(depth, radius, mode=None):
+    """z_radius controls 2d neighborhood vs 3d neighborhood for 2d vs 3d images
+
+    mode='2d' uses in-plane neighborhoods for 3d images as well, so that every axial slice is evaluated
+    independently (e.g. for thick-slice volumes)
+    """
+    if mode not in (None, '2d', '3d'):
+        raise ValueError('mode must be one of [None, "2d", "3d"], not "{!s}"'.format(mode))
+    if depth == 1 or mode == '2d':  # 2D image or independent slices
+        logger.debug(indent('Computing 2D feature with radius: {:d}'.format(radius), l3))
+        return 0
+    else:  # 3D image
+        logger.debug(indent('Computing 3D feature with radius: {:d}'.format(radius), l3))
+        return radius
+
+def _patch_view(array, radius, z_radius, start=None, stop=None, pad_value=0):
+    """pad array with zeros (or pad_value) once and return a strided (d, r, c, pz, py, px) view of every voxel's
+    patch
+
+    the view aliases the padded copy so no patch data is materialized until it is indexed. When the bounds
+    [start, stop) are given, only the region and the halo its patches need are copied and the view is indexed
+    relative to start
+    """
+    if start is None:
+        start = (0, 0, 0)
+    if stop is None:
+        stop = array.shape
+    halo = (z_radius, radius, radius)
+    lo = [max(0, b-h) for b, h in zip(start, halo)]
+    hi = [min(n, e+h) for e, h, n in zip(stop, halo, array.shape)]
+    region = array[tuple(slice(l, u) for l, u in zip(lo, hi))]
+    padded = np.pad(region.astype(np.float64, copy=False),
+                    [(h-(b-l), e+h-u) for b, e, l, u, h in zip(start, stop, lo, hi, halo)],
+                    mode='constant', constant_values=pad_value)
+    return np.lib.stride_tricks.sliding_window_view(padded, (2*z_radius+1, 2*radius+1, 2*radius+1))
+
+def _block_voxels(patch_shape):
+    """number of patches that fit in a single block of at most BLOCK_BYTES"""
+    return max(1, int(BLOCK_BYTES // (np.prod(patch_shape) * np.dtype(np.float64).itemsize)))
+
+def _box_index_blocks(start, stop, block_voxels, stride=(1, 1, 1)):
+    """generate (zz, yy, xx) index arrays covering the box [start, stop) in depth-row major order
+
+    with a stride only every stride-th voxel from start is covered along each axis
+
+    Yields:
+        (block_slice, (zz, yy, xx)) where block_slice addresses the flattened box (or lattice)
+    """
+    shape = _lattice_shape(start, stop, stride)
+    total = int(np.prod(shape))
+    for block_start in range(0, total, block_voxels):
+        block_stop = min(total, block_start + block_voxels)
+        zz, yy, xx = np.unravel_index(np.arange(block_start, block_stop), shape)
+        yield slice(block_start, block_stop), (zz*stride[0]+start[0], yy*stride[1]+start[1], xx*stride[2]+start[2])
+
+def _roi_mask(image_volume, shape, roi):
+    """dense boolean mask of roi with the (z, y, x) shape of image_volume
+
+    roi may be an ROI or an ndarray mask of the same size as the image, as accepted by
+    data_handling.create_pruned_vector
+    """
+    if isinstance(roi, np.ndarray):
+        return np.asarray(roi != 0).reshape(shape)
+    if isinstance(image_volume, np.ndarray):
+        raise TypeError('an ndarray mask must be supplied as roi for sparse evaluation of ndarray images')
+    return np.asarray(roi.makeDenseMask(image_volume.frameofreference).data != 0).reshape(shape)
+
+def _point_indices(points, shape):
+    """flat voxel indices of an (N, 3) array of (z, y, x) voxel indices within shape"""
+    points = np.asarray(points)
+    if points.ndim != 2 or points.shape[1] != 3:
+        raise ValueError('points must be an (N, 3) array of (z, y, x) voxel indices, not of shape {!s}'.format(
+            points.shape))
+    voxels = np.round(points).astype(np.int64)
+    if not np.array_equal(voxels, points):
+        raise ValueError('points must be integer voxel indices, see feature_points for positions in mm')
+    # raises ValueError for points outside of the image
+    return np.ravel_multi_index(tuple(voxels.T), shape)
+
+def _sparse_index_blocks(indices, shape, block_voxels, origin=(0, 0, 0)):
+    """generate (zz, yy, xx) index arrays of the flat voxel indices, relative to origin
+
+    Yields:
+        (block_slice, (zz, yy, xx)) where block_slice addresses the index list
+    """
+    for block_start in range(0, len(indices), block_voxels):
+        block_stop = min(len(indices), block_start + block_voxels)
+        voxels = np.unravel_index(indices[block_start:block_stop], shape)
+        yield slice(block_start, block_stop), tuple(v - o for v, o in zip(voxels, origin))
+
+def _mask_region(mask):
+    """(z, y, x) index slices of the bounding box of mask, or of its first voxel if it is empty"""
+    if not np.any(mask):
+        return (slice(0, 1), )*3
+    return tuple(slice(int(np.min(v)), int(np.max(v))+1) for v in np.nonzero(mask))
+
+def _fill_outside_mask(result, image_volume, mask, region, fill_value):
+    """expand the features of a region into full size feature volumes with fill_value outside of mask"""
+    if isinstance(result, list):
+        return [_fill_outside_mask(r, image_volume, mask, region, fill_value) for r in result]
+    feature_array = np.full(mask.shape, fill_value, dtype=np.float64)
+    feature_array[region] = np.where(mask[region], _unpack_image(result)[0], fill_value)
+    return _package_feature(feature_array, image_volume)
+
+def body_masked(feature_function):
+    """decorator restricting the ROI-less evaluation of a local feature to the body mask of the image
+
+    The feature function takes the arguments body_threshold and fill_value. Unless an roi or points are
+    supplied, only the bounding box of the voxels above body_threshold (see features_morphology.body_mask) is
+    evaluated, each voxel still reading its neighborhood from the full volume, and the voxels outside of the
+    mask are set to fill_value afterwards, so that stride, processes, incremental glcm etc. work as without the
+    mask. With sparse evaluation the mask is the roi of sparse instead. The default 'auto' masks CT BaseVolumes
+    only (see features_morphology.resolve_body_threshold), None always evaluates the whole volume. The lattice of
+    coarse evaluation and the tiles of tiled mode are never masked
+    """
+    signature = inspect.signature(feature_function)
+
+    @functools.wraps(feature_function)
+    def masked_feature(*args, **kwargs):
+        bound = signature.bind(*args, **kwargs)
+        bound.apply_defaults()
+        arguments = bound.arguments
+        if arguments.get('output') is not None:
+            # tiled mode rejects an explicit threshold itself
+            return feature_function(*bound.args, **bound.kwargs)
+        image_volume, body_threshold = arguments['image_volume'], arguments['body_threshold']
+        threshold = None
+        if arguments.get('roi') is None and arguments.get('points') is None:
+            threshold = features_morphology.resolve_body_threshold(image_volume, body_threshold)
+        if threshold is not None and arguments.get('coarse') and arguments.get('stride') is not None:
+            if body_threshold != 'auto':
+                raise ValueError('the body mask does not support coarse evaluation')
+            threshold = None
+        arguments['body_threshold'] = None
+        if threshold is None:
+            return feature_function(*bound.args, **bound.kwargs)
+
+        array = _unpack_image(image_volume)[0]
+        if array is None:
+            return None
+        mask = np.asarray(features_morphology.body_mask(image_volume, threshold)).reshape(array.shape)
+        if arguments.get('sparse'):
+            arguments['roi'] = mask
+            return feature_function(*bound.args, **bound.kwargs)
+        arguments['roi'] = region = _mask_region(mask)
+        return _fill_outside_mask(feature_function(*bound.args, **bound.kwargs), image_volume, mask, region,
+                                  arguments['fill_value'])
+    return masked_feature
+
+def _tiled_feature(feature_function, image_volume, output, tiles, radius, restrictions, **feature_args):
+    """evaluate feature_function tile by tile into output, see features_tiled.tiled_feature
+
+    Tiles evaluate every voxel, so all arguments in the dict restrictions, which would restrict the evaluated
+    voxels or collect results across the volume, must be unset. The body mask isn't applied to the tiles
+    """
+    for name, value in restrictions.items():
+        if value is not None and value is not False:
+            raise ValueError('tiled evaluation computes every voxel and does not support {!s}'.format(name))
+    if MaskableVolume.__name__ in str(type(image_volume)):
+        image_volume = _unpack_image(image_volume)[0]
+    return features_tiled.tiled_feature(feature_function, image_volume, output, radius,
+                                        tile_shape=(tiles or features_tiled.TILE_SHAPE), body_threshold=None,
+                                        **feature_args)
+
+def _ordered_map(function, iterable, workers=1):
+    """map function over iterable in a pool of worker threads, yielding the results in order
+
+    At most 2*workers items are in flight so that lazily generated work (e.g. block indices) is never
+    materialized all at once. The vectorized numpy kernels release the GIL, so threads run them in parallel.
+    """
+    if workers <= 1:
+        yield from map(function, iterable)
+        return
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        pending = collections.deque()
+        for item in iterable:
+            pending.append(executor.submit(function, item))
+            if len(pending) >= 2*workers:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+def _map_slabs(compute_region, array, start, stop, workers=1, processes=None, leading_shape=()):
+    """evaluate compute_region(array, slab_start, slab_stop) on slabs of the region [start, stop) in parallel
+
+    The region is split along z (or y for single slice regions) into one slab per worker. Each call computes its
+    slab from the full input array, reading the halo it needs itself, and the results are stitched back in
+    order so the outcome does not depend on the number of workers.
+
+    When processes is given, the slabs are computed by a pool of processes sharing array and the result through
+    shared memory instead (see features_shared.map_slabs), and leading_shape must give the shape of the leading
+    (per-output) axes of the results of compute_region.
+
+    Returns:
+        ndarray of shape (*leading_shape, *region shape)
+    """
+    if processes:
+        return features_shared.map_slabs(compute_region, array, start, stop, leading_shape, processes)
+    axis, slabs = features_shared.slabs(start, stop, workers)
+    if len(slabs) == 1:
+        return compute_region(array, *slabs[0])
+    results = list(_ordered_map(lambda bounds: compute_region(array, *bounds), slabs, workers))
+    return np.concatenate(results, axis=axis-3)
+
+def _function_list(processing_function):
+    """normalize processing_function to a list of functions
+
+    Returns:
+        (functions, total number of outputs, True if multiple result volumes should be returned)
+    """
+    if isinstance(processing_function, (list, tuple)):
+        functions = list(processing_function)
+    else:
+        functions = [processing_function]
+    noutputs = sum(getattr(f, 'noutputs', 1) for f in functions)
+    return functions, noutputs, (isinstance(processing_function, (list, tuple)) or noutputs > 1)
+
+def _evaluate_functions(functions, patches):
+    """evaluate every function on the same block of patches
+
+    Returns:
+        ndarray of shape (total outputs, N)
+    """
+    n = patches.shape[0]
+    return np.concatenate([np.reshape(_evaluate_block(f, patches), (n, -1)).T for f in functions], axis=0)
+
+# constant-patch lookup of _homogeneous_patches: mask and level of the voxels of the region starting at origin,
+# the distinct levels of the constant patches and the function values of a patch of each level
+_Homogeneous = collections.namedtuple('_Homogeneous', ['constant', 'level', 'origin', 'levels', 'values'])
+
+def _homogeneous_patches(functions, noutputs, array, radius, z_radius, start, stop, pad_value=0):
+    """find the voxels of the region [start, stop) of an integer valued array whose zero-padded (or pad_value
+    padded) neighborhood holds a single value, and evaluate the functions once on a constant patch of each such
+    value
+
+    A neighborhood is constant when its local variance is zero, n*sum(x^2) == sum(x)^2, with both box sums taken
+    exactly in int64 from summed-volume tables of z-slabs of the region.
+
+    Returns:
+        _Homogeneous
+    """
+    halo = (z_radius, radius, radius)
+    patch_shape = tuple(2*h+1 for h in halo)
+    n = int(np.prod(patch_shape))
+    extent = tuple(int(e-b) for b, e in zip(start, stop))
+    constant = np.empty(extent, dtype=bool)
+    level = np.empty(extent, dtype=array.dtype)
+    # bound the int64 temporaries of each slab
+    nplanes = max(1, int(BLOCK_BYTES // (6*8*(extent[1]+2*radius)*(extent[2]+2*radius))))
+    for z in range(0, extent[0], nplanes):
+        slab_start = (start[0]+z, start[1], start[2])
+        slab_stop = (min(stop[0], slab_start[0]+nplanes), stop[1], stop[2])
+        lo, hi = np.subtract(slab_start, halo), np.add(slab_stop, halo)
+        region = array[tuple(slice(max(0, l), min(s, h)) for l, h, s in zip(lo, hi, array.shape))]
+        pad = [(max(0, -l), max(0, h-s)) for l, h, s in zip(lo, hi, array.shape)]
+        region = np.pad(region.astype(np.int64), pad, mode='constant', constant_values=pad_value)
+        sums = [features_haar.block_sums(features_haar.summed_volume_table(x), halo,
+                                         np.add(halo, np.subtract(slab_stop, slab_start)), np.negative(halo),
+                                         patch_shape)
+                for x in (region, region*region)]
+        constant[z:z+nplanes] = (n*sums[1] == sums[0]*sums[0])
+        level[z:z+nplanes] = sums[0] // n
+    levels = np.unique(level[constant])
+    if len(levels):
+        # same dtype as the patches of _patch_view
+        level_patches = np.empty((len(levels), *patch_shape))
+        level_patches[...] = levels.reshape((-1, 1, 1, 1))
+        values = _evaluate_functions(functions, level_patches)
+    else:
+        values = np.empty((noutputs, 0))
+    return _Homogeneous(constant, level, tuple(start), levels, values)
+
+def _unique_patches(patches):
+    """bytewise distinct patches of a block of patches
+
+    Returns:
+        (ndarray of the distinct patches, inverse indices reconstructing the block from them)
+    """
+    flat = np.ascontiguousarray(patches).reshape((patches.shape[0], -1))
+    # each patch packed into one opaque row compares (and sorts) as its raw bytes
+    rows = flat.view(np.dtype((np.void, flat.dtype.itemsize*flat.shape[1]))).ravel()
+    _, index, inverse = np.unique(rows, return_index=True, return_inverse=True)
+    return patches[index], inverse.ravel()
+
+def _evaluate_voxels(functions, patches, voxels, homogeneous=None, patches_origin=(0, 0, 0), memo=False):
+    """evaluate every function on the patches of the (zz, yy, xx) voxels, see _evaluate_functions
+
+    Voxels with constant patches in homogeneous (see _homogeneous_patches) take the values of their level without
+    being evaluated. patches_origin is the voxel of patches[0, 0, 0] within the image. With memo the functions
+    only evaluate the distinct patches of the block and their results are scattered back to all voxels.
+
+    Returns:
+        (ndarray of shape (total outputs, N), number of patches evaluated by the functions)
+    """
+    def evaluate(voxels):
+        block = patches[voxels]
+        if memo:
+            unique, inverse = _unique_patches(block)
+            return _evaluate_functions(functions, unique)[:, inverse], len(unique)
+        return _evaluate_functions(functions, block), len(block)
+
+    if homogeneous is None:
+        return evaluate(voxels)
+    local = tuple(v + p - o for v, p, o in zip(voxels, patches_origin, homogeneous.origin))
+    constant = homogeneous.constant[local]
+    if not np.any(constant):
+        return evaluate(voxels)
+    results = np.empty((homogeneous.values.shape[0], len(constant)))
+    results[:, constant] = homogeneous.values[:, np.searchsorted(homogeneous.levels,
+                                                                 homogeneous.level[local][constant])]
+    varying = ~constant
+    nevaluated = 0
+    if np.any(varying):
+        results[:, varying], nevaluated = evaluate(tuple(v[varying] for v in voxels))
+    return results, nevaluated
+
+@body_masked
+def image_iterator(processing_function, image_volume, radius=2, roi=None, sparse=None, workers=None,
+                   processes=None, stride=None, coarse=False, points=None, homogeneous=False, memo=False,
+                   report=None, body_threshold='auto', fill_value=-1, mode=None, pad_value=0, output=None,
+                   tiles=None):
     """compute the pixel-wise feature of an image over a region defined by neighborhood
 
+    The volume is zero-padded once and the patches of cache-sized blocks of voxels are extracted together
+    through a strided view. Plugins marked with @batched receive each block as a single ndarray of shape
+    (N, pz, py, px), all other plugins are applied to the patches of the block one at a time.
+
     Args:
         processing_function -- function that should be applied to at each voxel location with neighborhood
                                 context. Function signature should match:
-                                    fxn()
+                                    fxn(patch_vals) -> float
+                                or, if decorated with @batched:
+                                    fxn(patch_block) -> ndarray of shape (N,)
+                                batched functions that set the attribute "noutputs" return (N, noutputs) and
+                                produce one feature volume per output
                             -- list<callables> that will all be evaluated at each patch location, results will
                                 be stored to separate result MaskableVolume objects
         image -- a flattened array of pixel intensities of type imslice or a matrix shaped numpy ndarray
         radius -- describes neighborood size in each dimension. radius of 4 would be a 9x9x9
+    Optional Args:
+        roi -- ROI (or ndarray mask for sparse evaluation); by default all voxels within its bounding box are
+               evaluated
+        sparse -- evaluate only the voxels inside the dense mask of roi:
+                    'indices': return (values, indices) where indices are the flat voxel indices of the mask in
+                               the order of data_handling.create_pruned_vector and values has shape (N,), or
+                               (noutputs, N) for multiple outputs
+                    'volume':  return the values expanded into a full size feature volume, fill_value outside the
+                               mask as by data_handling.expand_pruned_vector
+        workers -- number of threads evaluating blocks in parallel, see multiprocess_manager.default_workers()
+        processes -- evaluate z-slabs in this many worker processes that share the volume and the result through
+                     shared memory (see features_shared.map_slabs) rather than in threads. Sparse evaluation
+                     always uses threads
+        stride -- (sz, sy, sx) steps (or a single step for all axes) of a coarse lattice of voxels, starting at the
+                  first voxel of the calculation bounds, at which the feature is evaluated. The results are
+                  interpolated back to every voxel (trilinear, constant beyond the last lattice point)
+        coarse -- return the features on the stride lattice itself, with the voxel spacing of the feature
+                  FrameOfReference scaled by stride
+        points -- (N, 3) array of (z, y, x) voxel indices. Only these voxels are evaluated (in threads, ignoring
+                  roi) and an ndarray of shape (N, noutputs) is returned instead of feature volumes, see
+                  feature_points
+        homogeneous -- find the voxels whose patch holds a single value from a box-filter local variance mask
+                       first, and assign them the values of a constant patch of that value instead of
+                       evaluating their patches. Requires an integer valued volume (e.g. a quantized volume), as
+                       used by glcm and glrlm
+        memo -- evaluate only the distinct patches of each block (compared bytewise, e.g. identical quantized
+                patches) and scatter their results to all of their voxels
+        report -- dict that receives the number of evaluated voxels ('voxels'), of voxels assigned from
+                  homogeneous patches ('homogeneous') and of patches evaluated by the functions ('evaluated').
+                  With memo, 1 - evaluated/(voxels - homogeneous) is the hit rate of the memo
+        body_threshold -- without an roi, only evaluate the bounding box of the body mask of the image
+                          (intensities above body_threshold, see features_morphology.body_mask, memoized on
+                          BaseVolumes) and set the voxels outside of the mask to fill_value, or use the mask as
+                          the roi of sparse evaluation, see body_masked. The default 'auto' masks CT BaseVolumes
+                          at features_morphology.BODY_THRESHOLD HU and evaluates ndarrays and other modalities
+                          everywhere, None always evaluates the whole volume
+        fill_value -- value of the voxels outside the mask of sparse='volume' evaluation or of the body mask, -1
+                      by default as in data_handling.expand_pruned_vector so that they differ from zero valued
+                      features
+        mode -- '2d' treats the volume as a batch of independent axial slices with (1, 2r+1, 2r+1) patches,
+                which are still evaluated together in blocks spanning all slices. By default ('3d') the
+                neighborhood of 3d volumes spans 2r+1 slices
+        pad_value -- value of the voxels of the patches that lie outside of the volume, e.g. the level that
+                     intensity 0 is quantized to for quantized volumes
+        output -- tiled mode: evaluate the volume in tiles with the halo their patches need and stream the
+                  result into output, a writable array-like or the path of a .npy/.h5 file to create (or a list of
+                  them for multiple outputs), see features_tiled.tiled_feature. image_volume may also be a
+                  memory-mapped array, an h5py.Dataset or the path of a .npy/.h5 file, so that peak memory is
+                  bounded by the tile size. Every voxel is evaluated, without roi, sparse, stride, points, report
+                  or body mask
+        tiles  -- (z, y, x) shape of the tiles of the tiled mode, features_tiled.TILE_SHAPE by default
     Returns:
-        feature_volume as MaskableVolume with shape=image.shape
+        feature_volume as MaskableVolume with shape=image.shape, or a list with one feature_volume per output
+        if a list of functions or a multi-output function was supplied. In tiled mode output, with paths of
+        created files in place of open storage
     """
-    # This is an ugly way of type-checking but cant get isinstance to see both as the same
-    if (MaskableVolume.__name__ in str(type(image_volume))):
-        (c, r, d) = image_volume.frameofreference.size
-        def get_val(image_volume, z, y, x):
-            # image boundary handling is built into BaseVolume.get_val
-            return image_volume.get_val(z, y, x)
-        def set_val(feature_volume, z, y, x, val):
-            feature_volume.set_val(z, y, x, val)
-
-        #instantiate a blank BaseVolume of the proper size
-        feature_volume = MaskableVolume().fromArray(np.zeros((d, r, c)), image_volume.frameofreference)
-        # feature_volume.modality = image_volume.modality
-        # feature_volume.feature_label = 'feature'
-    elif isinstance(image_volume, np.ndarray):
-        if image_volume.ndim == 3:
-            d, r, c = image_volume.shape
-        elif image_volume.ndim == 2:
-            d, r, c = (1, *image_volume.shape)
-            image_volume = image_volume.reshape((d, r, c))
-
-        # instantiate a blank np.ndarray of the proper size
-        feature_volume = np.zeros((d, r, c))
-
-        def get_val(image, z, y, x):
-            if (z<0 or y<0 or x<0) or (z>=d or y>=r or x>=c):
-                return 0
-            else:
-                return image[z, y, x]
-        def set_val(image, z, y, x, val):
-            image[z, y, x] = val
-    else:
-        logger.info('invalid image type supplied ({:s}). Please specify an image of type BaseVolume \
-            or type np.ndarray'.format(str(type(image_volume))))
+    if output is not None:
+        return _tiled_feature(image_iterator, image_volume, output, tiles, radius,
+                              {'roi': roi, 'sparse': sparse, 'stride': stride, 'points': points, 'report': report,
+                               'body_threshold': (None if body_threshold == 'auto' else body_threshold)},
+                              processing_function=processing_function, workers=workers, processes=processes,
+                              homogeneous=homogeneous, memo=memo, mode=mode, pad_value=pad_value)
+    array, is_volume = _unpack_image(image_volume)
+    if array is None:
         return None
+    d, r, c = array.shape
+    functions, noutputs, multiple = _function_list(processing_function)
+    if workers is None:
+        workers = default_workers()
+    if sparse not in (None, 'indices', 'volume'):
+        raise ValueError('sparse must be one of [None, "indices", "volume"], not "{!s}"'.format(sparse))
+    if sparse and roi is None:
+        raise ValueError('an roi is required for sparse evaluation')
+    if sparse and stride is not None:
+        raise ValueError('sparse evaluation does not support a stride')
+    pointwise = points is not None
+    if pointwise and (sparse or stride is not None):
+        raise ValueError('point queries do not support sparse or strided evaluation')
+    stride = _stride(stride)
+    if homogeneous and not _is_discrete(array):
+        raise ValueError('homogeneous patch detection requires a quantized or integer valued volume')
 
-    # z_radius_range controls 2d neighborhood vs 3d neighborhood for 2d vs 3d images
-    if d == 1:  # 2D image
-        logger.debug(indent('Computing 2D feature with radius: {:d}'.format(radius), l3))
-        z_radius_range = [0]
-    elif d > 1:  # 3D image
-        logger.debug(indent('Computing 3D feature with radius: {:d}'.format(radius), l3))
-        z_radius_range = range(-radius, radius+1)
-
-    # in plane patch range
-    radius_range = range(-radius, radius+1)
+    z_radius = _get_z_radius(d, radius, mode)
 
     # timing
     start_feature_calc = time.time()
 
-
-    # absolute max indices for imagevolume - for handling request of voxel out of bounds
-    cbound = c
-    rbound = r
-    dbound = d
-
-    # set calculation index bounds -- will be redefined if roi is specified
-    cstart, cstop = 0, cbound
-    rstart, rstop = 0, rbound
-    dstart, dstop = 0, dbound
-
-    # defines dimensionality
-    d_subset = dstop - dstart
-    r_subset = rstop - rstart
-    c_subset = cstop - cstart
-
-    # restrict calculation bounds to roi
-    if (roi is not None):
-        # get max extents of the mask/ROI to speed up calculation only within ROI cubic volume
-        extents = roi.getROIExtents()
-        cstart, rstart, dstart = image_volume.frameofreference.getIndices(extents.start)
-        cstop, rstop, dstop = np.subtract(image_volume.frameofreference.getIndices(extents.end()), 1)
-        logger.info(indent('calculation subset volume x=({xstart:d}->{xstop:d}), '
-                                               'y=({ystart:d}->{ystop:d}), '
-                                               'z=({zstart:d}->{zstop:d})'.format(zstart=dstart,
-                                                                                  zstop=dstop,
-                                                                                  ystart=rstart,
-                                                                                  ystop=rstop,
-                                                                                  xstart=cstart,
-                                                                                  xstop=cstop ), l4))
-        # redefine feature_volume
-        d_subset = dstop - dstart
-        r_subset = rstop - rstart
-        c_subset = cstop - cstart
-        feature_frameofreference = FrameOfReference((extents.start),
-                                                    (image_volume.frameofreference.spacing),
-                                                    (c_subset, r_subset, d_subset))
-        feature_volume = feature_volume.fromArray(np.zeros((d_subset, r_subset, c_subset)), feature_frameofreference)
-
-    # # setup an output volume for each feature in processing_function list
-    # if (not isinstance(processing_function, list)):
-    #     tmp = []
-    #     tmp.append(processing_function)
-    #     processing_function = tmp
-    # feature_volumes = [feature_volume]
-    # for funct in processing_function[1:]:
-    #     feature_volumes.append(np.zeros_like(feature_volume))
-
-    # nested loop approach -> slowest, try GPU next
     total_voxels = d * r * c
-    subset_total_voxels = d_subset * r_subset * c_subset
-    #onepercent = int(subset_total_voxels / 100)
-    fivepercent = int(subset_total_voxels / 100 * 5)
-
-    idx = -1
-    subset_idx = -1
-    z_idx = -1
-    for z in range(dstart, dstop):
-        z_idx += 1
-        y_idx = -1
-        x_idx = -1
-        for y in range(rstart, rstop):
-            y_idx += 1
-            x_idx = -1
-            for x in range(cstart, cstop):
-                x_idx += 1
-                idx += 1
-                if (z<dstart or z>dstop or y<rstart or y>rstop or x<cstart or x>cstop):
-                    # we shouldnt ever be here
-                    logger.info('why are we here?!')
-                    #fill 0 instead
-                    set_val(feature_volume, z_idx, y_idx, x_idx, 0)
-                else:
-                    subset_idx += 1
-                    patch_vals = np.zeros((len(z_radius_range), len(radius_range), len(radius_range)))
-                    for p_z, k_z in enumerate(z_radius_range):
-                        for p_x, k_x in enumerate(radius_range):
-                            for p_y, k_y in enumerate(radius_range):
-                                #logger.info('k_z:{z:d}, k_y:{y:d}, k_x:{x:d}'.format(z=k_z,y=k_y,x=k_x))
-                                # handle out of bounds requests - replace with 0
-                                request_z = z+k_z
-                                request_y = y+k_y
-                                request_x = x+k_x
-                                if (request_z < 0 or request_z >= dbound or
-                                    request_y < 0 or request_y >= rbound or
-                                    request_x < 0 or request_x >= cbound):
-                                    val = 0
-                                else:
-                                    val = get_val(image_volume, request_z, request_y, request_x)
-                                # store to local image patch
-                                patch_vals[p_z, p_y, p_x] = val
-
-                    # for i, funct in enumerate(processing_function):
-                    proc_value = processing_function(patch_vals)
-                    set_val(feature_volume, z_idx, y_idx, x_idx, proc_value)
-
-                    if (False and (subset_idx % fivepercent == 0 or subset_idx == subset_total_voxels-1)):
-                        logger.debug('feature value at ({x:d}, {y:d}, {z:d})= {e:f}'.format(
-                            x=z*y*x + y*x + x,
-                            y=z*y*x + y,
-                            z=z*y*x,
-                            e=proc_value))
-
-                    if ((subset_idx % fivepercent == 0 or subset_idx == subset_total_voxels-1)):
-                        logger.debug(indent('{p:0.2%} - voxel: {i:d} of {tot:d} (of total: {abstot:d})'.format(
-                            p=subset_idx/subset_total_voxels,
-                            i=subset_idx,
-                            tot=subset_total_voxels,
-                            abstot=total_voxels), l4))
-
-    if isinstance(image_volume, np.ndarray) and d == 1:
-        # need to reshape ndarray if input was 2d
-        feature_volume = feature_volume.reshape((r_subset, c_subset))
-        # for i, feature_volume in enumerate(feature_volumes):
-        #     feature_volumes[i] = feature_volume.reshape((r_subset, c_subset))
-
-
-    end_feature_calc = time.time()
-    logger.debug(timer('feature calculation time:', end_feature_calc-start_feature_calc, l3))
-    # if len(features_volumes > 1):
-    #     return feature_volumes
-    # else:
-    return feature_volume
+    block_voxels = _block_voxels((2*z_radius+1, 2*radius+1, 2*radius+1))
+    if sparse or pointwise:
+        if pointwise:
+            indices = _point_indices(points, (d, r, c))
+        else:
+            # only evaluate the voxels within the roi
+            indices = np.flatnonzero(_roi_mask(image_volume, (d, r, c), roi))
+        # bounding box of the voxels, which limits the padded copy of the patches
+        voxels = np.unravel_index(indices, (d, r, c))
+        start = tuple(int(np.min(v)) if len(indices) else 0 for v in voxels)
+        stop = tuple(int(np.max(v))+1 if len(indices) else 0 for v in voxels)
+    else:
+        # set calculation index bounds -- restricted to roi bounding box if specified
+        start, stop = _calculation_bounds(image_volume, (d, r, c), roi)
+        lattice_shape = _lattice_shape(start, stop, stride)
+
+    nvoxels = len(indices) if (sparse or pointwise) else int(np.prod(lattice_shape))
+    nhomogeneous = 0
+    if homogeneous and nvoxels:
+        homogeneous = _homogeneous_patches(functions, noutputs, array, radius, z_radius, start, stop, pad_value)
+        if sparse or pointwise:
+            evaluated = tuple(v - o for v, o in zip(voxels, start))
+        else:
+            evaluated = (slice(None, None, stride[0]), slice(None, None, stride[1]), slice(None, None, stride[2]))
+        nhomogeneous = int(np.count_nonzero(homogeneous.constant[evaluated]))
+        logger.debug(indent('assigned {:d} of {:d} voxels from homogeneous patches ({:0.2%})'.format(
+            nhomogeneous, nvoxels, nhomogeneous/max(1, nvoxels)), l4))
+    else:
+        homogeneous = None
+    if report is not None:
+        report.update(voxels=nvoxels, homogeneous=nhomogeneous)
+
+    if (sparse or pointwise) and not nvoxels:
+        # an empty roi, body mask or list of points has no bounding box to extract patches from
+        feature_vectors = np.zeros((noutputs, 0))
+        nevaluated = 0
+    elif processes and not (sparse or pointwise):
+        def evaluate_region(array, lattice_start, lattice_stop):
+            # voxels of the lattice points [lattice_start, lattice_stop)
+            region_start = np.add(start, np.multiply(lattice_start, stride))
+            region_stop = np.add(start, np.multiply(np.subtract(lattice_stop, 1), stride)) + 1
+            region_patches = _patch_view(array, radius, z_radius, region_start, region_stop, pad_value)
+            # with memo, an extra plane collects the number of patches evaluated in each block
+            region_arrays = np.zeros((noutputs + memo, *np.subtract(lattice_stop, lattice_start)))
+            region_vectors = region_arrays.reshape((noutputs + memo, -1))
+            for block, voxels in _box_index_blocks((0, 0, 0), np.subtract(region_stop, region_start),
+                                                   block_voxels, stride):
+                region_vectors[:noutputs, block], nevaluated = _evaluate_voxels(
+                    functions, region_patches, voxels, homogeneous, region_start, memo)
+                if memo:
+                    region_vectors[noutputs, block.start] = nevaluated
+            return region_arrays
+
+        feature_arrays = _map_slabs(evaluate_region, array, (0, 0, 0), lattice_shape, processes=processes,
+                                    leading_shape=(noutputs + memo, ))
+        if memo:
+            nevaluated = int(np.sum(feature_arrays[noutputs]))
+            feature_arrays = feature_arrays[:noutputs]
+        else:
+            nevaluated = nvoxels - nhomogeneous
+        logger.debug(timer('feature calculation time:', time.time()-start_feature_calc, l3))
+    else:
+        # patches of the bounding box of the evaluated voxels, indexed relative to start
+        patches = _patch_view(array, radius, z_radius, start, stop, pad_value)
+        if sparse or pointwise:
+            subset_shape = (len(indices), )
+            index_blocks = _sparse_index_blocks(indices, (d, r, c), block_voxels, start)
+        else:
+            subset_shape = lattice_shape
+            index_blocks = _box_index_blocks((0, 0, 0), np.subtract(stop, start), block_voxels, stride)
+        subset_total_voxels = int(np.prod(subset_shape))
+
+        # setup an output volume for each output of the functions in processing_function
+        feature_arrays = np.zeros((noutputs, *subset_shape))
+        feature_vectors = feature_arrays.reshape((noutputs, -1))
+
+        block_evaluated = []
+
+        def evaluate(index_block):
+            block, voxels = index_block
+            # patches are extracted once per block and shared by all functions. blocks cover disjoint voxels
+            feature_vectors[:, block], nevaluated = _evaluate_voxels(functions, patches, voxels, homogeneous,
+                                                                     start, memo)
+            block_evaluated.append(nevaluated)
+            return block
+
+        fivepercent = max(1, int(subset_total_voxels / 100 * 5))
+        next_report = 0
+        for block in _ordered_map(evaluate, index_blocks, workers):
+            if (block.stop >= next_report or block.stop == subset_total_voxels):
+                logger.debug(indent('{p:0.2%} - voxel: {i:d} of {tot:d} (of total: {abstot:d})'.format(
+                    p=block.stop/subset_total_voxels,
+                    i=block.stop,
+                    tot=subset_total_voxels,
+                    abstot=total_voxels), l4))
+                next_report = block.stop + fivepercent
+
+        nevaluated = sum(block_evaluated)
+        end_feature_calc = time.time()
+        logger.debug(timer('feature calculation time:', end_feature_calc-start_feature_calc, l3))
+
+    if memo:
+        nmemo = nvoxels - nhomogeneous
+        logger.debug(indent('evaluated {:d} distinct of {:d} patches (memo hit rate: {:0.2%})'.format(
+            nevaluated, nmemo, 1 - nevaluated/max(1, nmemo)), l4))
+    if report is not None:
+        report.update(evaluated=nevaluated)
+
+    if pointwise:
+        return feature_vectors.T
+    if sparse == 'indices':
+        return (feature_vectors if multiple else feature_vectors[0]), indices
+    elif sparse == 'volume':
+        expanded = np.full((noutputs, total_voxels), fill_value, dtype=np.float64)
+        expanded[:, indices] = feature_vectors
+        feature_arrays = expanded.reshape((noutputs, d, r, c))
+        roi = None
+
+    if stride != (1, 1, 1) and not coarse:
+        feature_arrays = [_interpolate_lattice(feature_array, np.subtract(stop, start), stride)
+                          for feature_array in feature_arrays]
+    feature_volumes = [_package_feature(feature_array, image_volume, roi, stride if coarse else None)
+                       for feature_array in feature_arrays]
+    if multiple:
+        return feature_volumes
+    return feature_volumes[0]
+
+def feature_points(feature_function, image_volume, points, world=False, **kwargs):
+    """evaluate a local feature only at a set of voxels, e.g. a sample of training voxels, without allocating
+    any feature volume
+
+    The patches of the points are extracted in blocks and evaluated by the batched engine of image_iterator.
+
+    Args:
+        feature_function -- image_iterator or any feature entry function accepting points (glcm, glrlm,
+                            image_entropy, image_energy, image_median, image_meanabsdev)
+        image_volume     -- BaseVolume or ndarray image
+        points           -- (N, 3) array of (z, y, x) voxel indices, or of (x, y, z) positions in mm if world
+    Optional Args:
+        world  -- points are positions in mm, assigned to the nearest voxel of image_volume.frameofreference
+                  as by FrameOfReference.getIndices
+        kwargs -- further arguments of feature_function, e.g. processing_function of image_iterator or
+                  stat_name of glcm
+    Returns:
+        ndarray of shape (N, n_features)
+    """
+    if world:
+        if isinstance(image_volume, np.ndarray):
+            raise TypeError('positions in mm require a BaseVolume with a frameofreference')
+        frame = image_volume.frameofreference
+        positions = np.asarray(points, dtype=np.float64).reshape((-1, 3))
+        indices = np.round((positions - np.asarray(frame.start)) / np.asarray(frame.spacing)).astype(np.int64)
+        # (x, y, z) -> (z, y, x)
+        points = indices[:, ::-1]
+    return feature_function(image_volume=image_volume, points=points, **kwargs)
 
 def energy_plugin(patch_vals):
     val_counts = {}
@@ -246,74 +791,526 @@ def entropy_plugin(patch_vals):
     return h
 
 
-def image_entropy(image_volume, radius=2, roi=None):
-    return image_iterator(entropy_plugin, image_volume, radius, roi)
+def _block_value_probabilities(patches):
+    """occurence probability of each distinct value in each patch of a block
+
+    Returns:
+        (patch_index, probability) vectors with one entry for every distinct value of every patch
+    """
+    n = patches.shape[0]
+    patch_size = patches[0].size
+    sorted_vals = np.sort(patches.reshape(n, patch_size), axis=1)
+    # a run of equal values in the sorted patch holds all occurences of that value
+    run_starts = np.ones(sorted_vals.shape, dtype=bool)
+    run_starts[:, 1:] = sorted_vals[:, 1:] != sorted_vals[:, :-1]
+    start_idx = np.flatnonzero(run_starts)
+    run_lengths = np.diff(np.append(start_idx, n*patch_size))
+    return start_idx // patch_size, run_lengths / patch_size
+
+@batched
+def _block_entropy(patches):
+    """batched equivalent of entropy_plugin"""
+    patch_idx, probs = _block_value_probabilities(patches)
+    return -np.bincount(patch_idx, weights=probs*np.log(probs), minlength=patches.shape[0])
+
+@batched
+def _block_energy(patches):
+    """batched equivalent of energy_plugin"""
+    patch_idx, probs = _block_value_probabilities(patches)
+    return np.sqrt(np.bincount(patch_idx, weights=probs*probs, minlength=patches.shape[0]))
+
+# most distinct intensities for which the running-histogram engine is selected automatically
+RUNNING_HISTOGRAM_MAX_LEVELS = 4096
 
-def image_energy(image_volume, radius=2, roi=None):
-    return image_iterator(energy_plugin, image_volume, radius, roi)
+def _slab_planes(array):
+    """number of planes along the first axis of array in a slab of at most BLOCK_BYTES"""
+    plane_bytes = max(1, int(np.prod(array.shape[1:])) * array.dtype.itemsize)
+    return max(1, int(BLOCK_BYTES // plane_bytes))
+
+def _is_discrete(array):
+    """True if every value in array is an integer
+
+    float arrays are checked in slabs along the first axis, stopping at the first non-integer slab, so the
+    temporaries stay within BLOCK_BYTES rather than the size of the volume
+    """
+    if array.dtype.kind in 'biu':
+        return True
+    nplanes = _slab_planes(array)
+    return all(np.all(np.mod(array[z:z+nplanes], 1) == 0) for z in range(0, array.shape[0], nplanes))
+
+def _distinct_levels(array, max_levels):
+    """sorted distinct values of array, collected slab by slab as in _is_discrete, or None as soon as max_levels
+    of them are found
+    """
+    nplanes = _slab_planes(array)
+    levels = np.empty(0, dtype=array.dtype)
+    for z in range(0, array.shape[0], nplanes):
+        levels = np.union1d(levels, array[z:z+nplanes])
+        if len(levels) >= max_levels:
+            return None
+    return levels
+
+def _has_few_levels(array, max_levels):
+    """True if the discrete valued array holds fewer than max_levels distinct values
+
+    a value range narrower than max_levels decides without any temporaries, see _distinct_levels otherwise
+    """
+    if array.size == 0 or int(np.max(array)) - int(np.min(array)) + 1 < max_levels:
+        return True
+    return _distinct_levels(array, max_levels) is not None
+
+def _running_histogram_features(array, radius, z_radius, start, stop):
+    """local entropy and energy of a discrete valued array using a running histogram per scanline
+
+    Each (z, y) scanline of the calculation box keeps the histogram of its current patch. As the patch slides
+    one voxel along x, the counts of the plane that leaves the patch are removed and the counts of the plane
+    that enters are added (Huang's running histogram update), making the cost per voxel O(radius^2) rather
+    than O(radius^3). All scanlines in a slab of slices are updated together.
+
+    Returns:
+        (entropy, energy) ndarrays with the shape of the calculation box
+    """
+    pz, py, px = 2*z_radius+1, 2*radius+1, 2*radius+1
+    patch_size = pz*py*px
+    plane_size = pz*py
+
+    # label the distinct values (including zero padding) of the box and its halo as histogram bins, so that the
+    # cost of each call (e.g. per slab of _map_slabs) does not depend on the size of the volume
+    halo = (z_radius, radius, radius)
+    lo, hi = np.subtract(start, halo), np.add(stop, halo)
+    region = array[tuple(slice(max(0, l), min(n, h)) for l, h, n in zip(lo, hi, array.shape))]
+    padded = np.pad(region, [(max(0, -l), max(0, h-n)) for l, h, n in zip(lo, hi, array.shape)],
+                    mode='constant', constant_values=0)
+    levels, labels = np.unique(padded, return_inverse=True)
+    labels = labels.reshape(padded.shape).astype(np.int64)
+    nlevels = len(levels)
+    # whole histograms are cheaper to rescan than sparse updates when there are few bins
+    dense_update = nlevels <= 2*plane_size
+
+    # c*log(c) and c^2 lookups for every attainable bin count
+    counts = np.arange(patch_size+1, dtype=np.float64)
+    clogc = counts * np.log(np.maximum(counts, 1))
+    csquared = counts * counts
+
+    # planes[z, y, xp] is the (pz, py) plane of the patch centered on scanline (z, y) at padded column xp
+    planes = np.lib.stride_tricks.sliding_window_view(labels, (pz, py), axis=(0, 1))
+
+    # planes are indexed relative to start
+    (zstart, ystart, xstart), (zstop, ystop, xstop) = (0, 0, 0), tuple(int(x) for x in np.subtract(stop, start))
+    ny, nx = ystop-ystart, xstop-xstart
+    entropy = np.zeros((zstop-zstart, ny, nx))
+    energy = np.zeros((zstop-zstart, ny, nx))
+    slab_depth = max(1, int(BLOCK_BYTES // (ny * (nlevels + 2*plane_size) * 8)))
+    for zslab in range(zstart, zstop, slab_depth):
+        zslab_stop = min(zstop, zslab+slab_depth)
+        nrows = (zslab_stop-zslab) * ny
+        nbins = nrows * nlevels
+        row_offsets = (np.arange(nrows) * nlevels).reshape((-1, 1))
+
+        def plane_keys(xp):
+            return (planes[zslab:zslab_stop, ystart:ystop, xp].reshape((nrows, plane_size)) + row_offsets).ravel()
+
+        hist = np.bincount(np.concatenate([plane_keys(xp) for xp in range(xstart, xstart+px)]), minlength=nbins)
+        sum_clogc = clogc[hist].reshape((nrows, nlevels)).sum(axis=1)
+        sum_csquared = csquared[hist].reshape((nrows, nlevels)).sum(axis=1)
+        for i in range(nx):
+            zrows = slice(zslab-zstart, zslab_stop-zstart)
+            entropy[zrows, :, i] = (math.log(patch_size) - sum_clogc/patch_size).reshape((-1, ny))
+            energy[zrows, :, i] = (np.sqrt(sum_csquared)/patch_size).reshape((-1, ny))
+            if i == nx-1:
+                break
+
+            # padded column x is the first column of the patch centered on x
+            removed = plane_keys(xstart+i)
+            added = plane_keys(xstart+i+px)
+            if dense_update:
+                hist += np.bincount(added, minlength=nbins) - np.bincount(removed, minlength=nbins)
+                sum_clogc = clogc[hist].reshape((nrows, nlevels)).sum(axis=1)
+                sum_csquared = csquared[hist].reshape((nrows, nlevels)).sum(axis=1)
+            else:
+                keys, inverse = np.unique(np.concatenate([removed, added]), return_inverse=True)
+                delta = np.bincount(inverse.ravel(), minlength=len(keys)) - \
+                    2*np.bincount(inverse[:removed.size].ravel(), minlength=len(keys))
+                old = hist[keys]
+                new = old + delta
+                hist[keys] = new
+                rows = keys // nlevels
+                sum_clogc += np.bincount(rows, weights=clogc[new]-clogc[old], minlength=nrows)
+                sum_csquared += np.bincount(rows, weights=csquared[new]-csquared[old], minlength=nrows)
+    return entropy, energy
+
+def _local_histogram_feature(stat, image_volume, radius=2, roi=None, running_histogram=None, workers=None,
+                             processes=None, stride=None, coarse=False, points=None, mode=None):
+    """shared entry for image_entropy and image_energy"""
+    array, is_volume = _unpack_image(image_volume)
+    if array is None:
+        return None
+
+    if running_histogram and (stride is not None or points is not None):
+        raise ValueError('running histogram mode evaluates every voxel and does not support a stride or points')
+    if running_histogram is None:
+        running_histogram = (stride is None and points is None and _is_discrete(array)
+                             and _has_few_levels(array, RUNNING_HISTOGRAM_MAX_LEVELS))
+    elif running_histogram and not _is_discrete(array):
+        raise ValueError('running histogram mode requires a quantized or integer valued volume')
+
+    if not running_histogram:
+        block_plugin = {'entropy': _block_entropy, 'energy': _block_energy}[stat]
+        # the body mask is applied by image_entropy/image_energy
+        return image_iterator(block_plugin, image_volume, radius, roi, workers=workers, processes=processes,
+                              stride=stride, coarse=coarse, points=points, body_threshold=None, mode=mode)
+
+    start_feature_calc = time.time()
+    start, stop = _calculation_bounds(image_volume, array.shape, roi)
+    z_radius = _get_z_radius(array.shape[0], radius, mode)
+    entropy, energy = _map_slabs(
+        lambda array, slab_start, slab_stop: np.stack(_running_histogram_features(array, radius, z_radius,
+                                                                                  slab_start, slab_stop)),
+        array, start, stop, default_workers() if workers is None else workers, processes, (2, ))
+    logger.debug(timer('feature calculation time:', time.time()-start_feature_calc, l3))
+    return _package_feature({'entropy': entropy, 'energy': energy}[stat], image_volume, roi)
+
+@body_masked
+def image_entropy(image_volume, radius=2, roi=None, running_histogram=None, workers=None, processes=None,
+                  stride=None, coarse=False, points=None, mode=None, body_threshold='auto', fill_value=-1):
+    """local entropy of the intensities in each voxel's neighborhood
+
+    Optional Args:
+        running_histogram -- update one histogram per scanline as the neighborhood slides (quantized or
+                             integer valued volumes only). By default this is used whenever the volume is
+                             discrete with fewer than RUNNING_HISTOGRAM_MAX_LEVELS distinct values
+        workers           -- number of threads, see multiprocess_manager.default_workers()
+        processes         -- number of processes sharing the volume through shared memory, see image_iterator
+        stride, coarse    -- evaluate on a coarse lattice of voxels, see image_iterator. Not available in
+                             running histogram mode
+        points            -- evaluate only these voxels, see feature_points. Not available in running
+                             histogram mode
+        mode              -- '2d' evaluates each axial slice independently with in-plane neighborhoods, see
+                             image_iterator
+        body_threshold, fill_value -- evaluate only the body mask of image_volume without an roi (by default
+                                      for CT BaseVolumes), see body_masked
+    """
+    return _local_histogram_feature('entropy', image_volume, radius, roi, running_histogram, workers, processes,
+                                    stride, coarse, points, mode)
+
+@body_masked
+def image_energy(image_volume, radius=2, roi=None, running_histogram=None, workers=None, processes=None,
+                 stride=None, coarse=False, points=None, mode=None, body_threshold='auto', fill_value=-1):
+    """local energy of the intensities in each voxel's neighborhood
+
+    Optional Args:
+        running_histogram -- see image_entropy
+        workers           -- number of threads, see multiprocess_manager.default_workers()
+        processes         -- see image_entropy
+        stride, coarse    -- see image_entropy
+        points            -- see image_entropy
+        mode              -- see image_entropy
+        body_threshold, fill_value -- see image_entropy
+    """
+    return _local_histogram_feature('energy', image_volume, radius, roi, running_histogram, workers, processes,
+                                    stride, coarse, points, mode)
+
+
+@sweeps('radius')
+@body_masked
+def image_firstorder(image_volume, roi=None, radius=2, stat_name='mean', workers=None, processes=None, mode=None,
+                     body_threshold='auto', fill_value=-1):
+    """local first-order statistic of the intensities in each voxel's zero-padded neighborhood, CPU equivalent
+    of the kernel_fo_* kernels of features_gpu.image_iterator_gpu. Follows the argument order of image_min so it
+    can be used as LocalFeatureDefinition.calculation_function
+
+    All statistics are derived from local raw moments evaluated with separable box filters (see
+    features_firstorder), so the runtime does not depend on radius. A list of radii is evaluated in one pass
+    from a single summed-volume table per moment (see features_firstorder.local_firstorder_sweep), e.g. by
+    calculate_features.calculateRadiusSweep.
+
+    Optional Args:
+        roi       -- ROI restricting the calculation to its bounding box
+        radius    -- neighborhood radius, or a list of radii
+        stat_name -- one (or a list) of 'mean', 'variance', 'stddev', 'rms', 'skewness', 'kurtosis'
+        workers   -- number of threads computing z-slabs in parallel, see multiprocess_manager.default_workers()
+        processes -- number of processes sharing the volume through shared memory, see image_iterator
+        mode      -- '2d' evaluates each axial slice independently with in-plane neighborhoods, see
+                     image_iterator
+        body_threshold, fill_value -- evaluate only the body mask of image_volume without an roi (by default for
+                                      CT BaseVolumes), see body_masked
+    Returns:
+        feature volume, or a list with one feature volume per statistic if a list was supplied. For a list of
+        radii, a list with this result for each radius
+    """
+    array, is_volume = _unpack_image(image_volume)
+    if array is None:
+        return None
+    multiple = isinstance(stat_name, (list, tuple))
+    stat_names = list(stat_name) if multiple else [stat_name]
+    sweep = isinstance(radius, (list, tuple))
+
+    start_feature_calc = time.time()
+    start, stop = _calculation_bounds(image_volume, array.shape, roi)
+    # all slabs share one shift so that results do not depend on the number of workers
+    shift = float(np.mean(array[tuple(slice(b, e) for b, e in zip(start, stop))]))
+    if sweep:
+        radii = list(radius)
+        z_radii = [_get_z_radius(array.shape[0], r, mode) for r in radii]
+        feature_arrays = _map_slabs(
+            lambda array, slab_start, slab_stop: features_firstorder.local_firstorder_sweep(
+                array, stat_names, radii, z_radii, slab_start, slab_stop, shift),
+            array, start, stop, default_workers() if workers is None else workers, processes,
+            (len(radii), len(stat_names)))
+    else:
+        z_radius = _get_z_radius(array.shape[0], radius, mode)
+        feature_arrays = _map_slabs(
+            lambda array, slab_start, slab_stop: features_firstorder.local_firstorder_stats(
+                array, stat_names, radius, z_radius, slab_start, slab_stop, shift),
+            array, start, stop, default_workers() if workers is None else workers, processes, (len(stat_names), ))
+        feature_arrays = [feature_arrays]
+    logger.debug(timer('feature calculation time:', time.time()-start_feature_calc, l3))
+    results = []
+    for radius_arrays in feature_arrays:
+        feature_volumes = [_package_feature(feature_array, image_volume, roi) for feature_array in radius_arrays]
+        results.append(feature_volumes if multiple else feature_volumes[0])
+    if sweep:
+        return results
+    return results[0]
+
+
+def _local_filter_feature(filter_function, image_volume, roi=None, radius=2, workers=None, processes=None,
+                          mode=None):
+    """apply a features_morphology local filter to the voxels of image_volume within the roi bounds"""
+    array, is_volume = _unpack_image(image_volume)
+    if array is None:
+        return None
+    start_feature_calc = time.time()
+    start, stop = _calculation_bounds(image_volume, array.shape, roi)
+    z_radius = _get_z_radius(array.shape[0], radius, mode)
+    feature_array = _map_slabs(
+        lambda array, slab_start, slab_stop: filter_function(array, radius, z_radius, slab_start, slab_stop),
+        array, start, stop, default_workers() if workers is None else workers, processes)
+    logger.debug(timer('feature calculation time:', time.time()-start_feature_calc, l3))
+    return _package_feature(feature_array.astype(np.float64), image_volume, roi)
+
+# the local min/max/range/median/meanabsdev features follow the argument order of
+# features_gpu.image_iterator_gpu so they can be used as LocalFeatureDefinition.calculation_function, and
+# evaluate only the body mask of CT volumes by default like it (see body_masked)
+@body_masked
+def image_min(image_volume, roi=None, radius=2, workers=None, processes=None, mode=None, body_threshold='auto',
+              fill_value=-1):
+    """local minimum of each voxel's zero-padded neighborhood (kernel_fo_min)"""
+    return _local_filter_feature(features_morphology.local_min, image_volume, roi, radius, workers, processes,
+                                 mode)
+
+@body_masked
+def image_max(image_volume, roi=None, radius=2, workers=None, processes=None, mode=None, body_threshold='auto',
+              fill_value=-1):
+    """local maximum of each voxel's zero-padded neighborhood (kernel_fo_max)"""
+    return _local_filter_feature(features_morphology.local_max, image_volume, roi, radius, workers, processes,
+                                 mode)
+
+@body_masked
+def image_range(image_volume, roi=None, radius=2, workers=None, processes=None, mode=None, body_threshold='auto',
+                fill_value=-1):
+    """local maximum - minimum of each voxel's zero-padded neighborhood (kernel_fo_range)"""
+    return _local_filter_feature(features_morphology.local_range, image_volume, roi, radius, workers, processes,
+                                 mode)
+
+@batched
+def _block_median(patches):
+    """median of each patch from a partial sort. patches always hold an odd number of voxels"""
+    flat_patches = patches.reshape((patches.shape[0], -1))
+    kth = flat_patches.shape[1] // 2
+    return np.partition(flat_patches, kth, axis=1)[:, kth]
+
+@batched
+def _block_meanabsdev(patches):
+    """kernel_fo_meanabsdev of each patch, which returns the square root of the mean absolute deviation"""
+    flat_patches = patches.reshape((patches.shape[0], -1))
+    return np.sqrt(np.mean(np.abs(flat_patches - np.mean(flat_patches, axis=1, keepdims=True)), axis=1))
+
+@body_masked
+def image_median(image_volume, roi=None, radius=2, workers=None, processes=None, stride=None, coarse=False,
+                 points=None, mode=None, body_threshold='auto', fill_value=-1):
+    """local median of each voxel's zero-padded neighborhood"""
+    return image_iterator(_block_median, image_volume, radius, roi, workers=workers, processes=processes,
+                          stride=stride, coarse=coarse, points=points, body_threshold=None, mode=mode)
+
+@body_masked
+def image_meanabsdev(image_volume, roi=None, radius=2, workers=None, processes=None, stride=None, coarse=False,
+                     points=None, mode=None, body_threshold='auto', fill_value=-1):
+    """local mean absolute deviation of each voxel's zero-padded neighborhood (kernel_fo_meanabsdev)"""
+    return image_iterator(_block_meanabsdev, image_volume, radius, roi, workers=workers, processes=processes,
+                          stride=stride, coarse=coarse, points=points, body_threshold=None, mode=mode)
+
+
+@body_masked
+def haar_features(image_volume, configurations, roi=None, workers=None, processes=None, body_threshold='auto',
+                  fill_value=-1):
+    """evaluate a bank of Haar-like block features (see features_haar.haar_bank) for every voxel
+
+    One summed-volume table is built per volume (and memoized on BaseVolumes) and shared by every
+    configuration, so each block mean costs 8 lookups regardless of the block size.
+
+    Args:
+        configurations -- list of (cadd, sadd, csub, ssub) tuples, with cadd/csub=(x, y, z) block centers
+                          relative to the voxel and sadd/ssub the block side lengths. ssub=None selects a
+                          one-block feature
+    Optional Args:
+        workers        -- number of threads computing z-slabs in parallel, see
+                          multiprocess_manager.default_workers()
+        processes      -- number of processes sharing the table through shared memory, see image_iterator
+        body_threshold, fill_value -- evaluate only the body mask of image_volume without an roi (by default
+                                      for CT BaseVolumes), see body_masked
+    Returns:
+        list with one feature volume per configuration
+    """
+    array, is_volume = _unpack_image(image_volume)
+    if array is None:
+        return None
+    start_feature_calc = time.time()
+    if is_volume:
+        table = image_volume.getDerivedData(('summed_volume_table',),
+                                            lambda: features_haar.summed_volume_table(array))
+    else:
+        table = features_haar.summed_volume_table(array)
+    start, stop = _calculation_bounds(image_volume, array.shape, roi)
+    feature_arrays = _map_slabs(
+        lambda table, slab_start, slab_stop: features_haar.haar_bank(table, configurations, slab_start, slab_stop,
+                                                                     is_2d=(array.shape[0] == 1)),
+        table, start, stop, default_workers() if workers is None else workers, processes, (len(configurations), ))
+    logger.debug(timer('feature calculation time:', time.time()-start_feature_calc, l3))
+    return [_package_feature(feature_array, image_volume, roi) for feature_array in feature_arrays]
+
+@sweeps('sadd')
+@body_masked
+def image_haar(image_volume, roi=None, cadd=(0, 0, 0), sadd=3, csub=(0, 0, 0), ssub=None, workers=None,
+               processes=None, body_threshold='auto', fill_value=-1):
+    """single Haar-like block feature (see haar_features), for use as LocalFeatureDefinition.calculation_function
+
+    The block geometry of features_haar.haar_bank differs from the haar kernels of features_gpu, so results are
+    not interchangeable with GPU features of the same cadd/sadd/csub/ssub, and the GPU-only arguments (radius,
+    feature_kernel, ...) are not accepted. ssub=None selects a one-block feature.
+
+    A list of block sizes sadd returns a list with the feature of each size, all evaluated from the same
+    summed-volume table (see calculate_features.calculateRadiusSweep). body_threshold and fill_value as for
+    haar_features
+    """
+    if isinstance(sadd, (list, tuple)):
+        return haar_features(image_volume, [(cadd, s, csub, ssub) for s in sadd], roi, workers, processes,
+                             body_threshold, fill_value)
+    return haar_features(image_volume, [(cadd, sadd, csub, ssub)], roi, workers, processes, body_threshold,
+                         fill_value)[0]
 
 
 def wavelet_decomp_3d(image_volume, wavelet_str='db1', mode_str='smooth'):
     """perform full 3d wavelet decomp and return coefficients"""
-    coeffs = pywt.wavedecn(image_volume.array, wavelet_str, mode_str)
+    coeffs = pywt.wavedecn(image_volume.data, wavelet_str, mode_str)
     return coeffs
 
+# names of the 3d detail subbands of each decomposition level, as keyed by pywt.wavedecn
+WAVELET_SUBBANDS = ('aad', 'ada', 'add', 'daa', 'dad', 'dda', 'ddd')
 
-def wavelet_entropy(image_volume, radius=2, roi=None, wavelet_str='db1', mode_str='smooth'):
-    # compute wavelet coefficients
-    logger.info(indent('performing 3d wavelet decomp using wavelet: {!s}'.format(wavelet_str), g_indents[3]))
-    roi_volume = image_volume.conformTo(roi.frameofreference)
-    wavelet_coeffs = wavelet_decomp_3d(roi_volume, wavelet_str, mode_str)
-    nlevels = len(wavelet_coeffs) - 1
-    # level_results = []
-    accumulator = np.zeros(roi_volume.frameofreference.size[::-1])
-    # sum voxel-wise energy across all levels
-    for level in range(nlevels-1, 0, -1):
-        wavelet_coeffs_diag = wavelet_coeffs[level+1]['ddd']
-        logger.info(indent('computing entropy for level {:d} of shape:{!s}'.format(level, wavelet_coeffs_diag.shape), g_indents[3]))
-        result = image_iterator(entropy_plugin, wavelet_coeffs_diag, radius)
-
-        zoomfactors = tuple(np.true_divide(roi_volume.frameofreference.size[::-1], result.shape))
-        # scale low-res coefficients to image res
-        result = scipy.ndimage.interpolation.zoom(result, zoomfactors, order=3)
-        result = MaskableVolume().fromArray(result, roi_volume.frameofreference)
-        # level_results.append(result)
-        accumulator = np.add(accumulator, result.array)
-    return MaskableVolume().fromArray(accumulator, roi_volume.frameofreference)
-
-def wavelet_energy(image_volume, radius=2, roi=None, wavelet_str='db1', mode_str='smooth'):
-    # compute wavelet coefficients
-    logger.info(indent('performing 3d wavelet decomp using wavelet: {!s}'.format(wavelet_str), g_indents[3]))
-    roi_volume = image_volume.conformTo(roi.frameofreference)
-    wavelet_coeffs = wavelet_decomp_3d(roi_volume, wavelet_str, mode_str)
+def wavelet_coefficients(image_volume, roi=None, wavelet_str='db1', mode_str='smooth'):
+    """3d wavelet decomposition of image_volume conformed to the frame of reference of roi
+
+    The coefficients of every subband are memoized on image_volume keyed by (wavelet, mode, frame of reference),
+    so a whole bank of wavelet features of one volume shares a single conformTo and decomposition.
+
+    Returns:
+        (conformed FrameOfReference, coefficients as returned by pywt.wavedecn)
+    """
+    frameofreference = (roi if roi is not None else image_volume).frameofreference
+    def decompose():
+        logger.info(indent('performing 3d wavelet decomp using wavelet: {!s}'.format(wavelet_str), g_indents[3]))
+        roi_volume = image_volume.conformTo(frameofreference)
+        return roi_volume.frameofreference, wavelet_decomp_3d(roi_volume, wavelet_str, mode_str)
+    key = ('wavelet', wavelet_str, mode_str,
+           tuple(frameofreference.start), tuple(frameofreference.spacing), tuple(frameofreference.size))
+    return image_volume.getDerivedData(key, decompose)
+
+def _wavelet_subbands(subbands):
+    """validate a subband name or list of names ('all' selects every detail subband)"""
+    if subbands == 'all':
+        return list(WAVELET_SUBBANDS)
+    if isinstance(subbands, str):
+        subbands = [subbands]
+    for subband in subbands:
+        if subband not in WAVELET_SUBBANDS:
+            raise ValueError('unknown wavelet subband "{!s}". must be one of {!s}'.format(subband,
+                                                                                         WAVELET_SUBBANDS))
+    return list(subbands)
+
+def _wavelet_levels(coeffs, binwidth=None):
+    """discrete levels of the wavelet coefficients for the running-histogram engine of image_entropy/image_energy
+
+    Local entropy and energy only depend on which values of a patch are equal, so coefficients with fewer than
+    RUNNING_HISTOGRAM_MAX_LEVELS distinct values are relabeled to integer ranks (zero keeping label 0, as the
+    zero padding) without changing the features. With binwidth, coefficients are binned to floor(c/binwidth)
+    first. Otherwise they are returned unchanged and evaluated by the sort-based engine of image_iterator
+    """
+    if binwidth:
+        return np.floor(coeffs / binwidth)
+    levels = _distinct_levels(coeffs, RUNNING_HISTOGRAM_MAX_LEVELS)
+    if levels is None:
+        return coeffs
+    levels = np.union1d(levels, [0])
+    return np.searchsorted(levels, coeffs) - np.searchsorted(levels, 0)
+
+def _wavelet_level_feature(feature_function, image_volume, radius, roi, wavelet_str, mode_str, subbands, workers,
+                           binwidth=None):
+    """sum of feature_function over the subbands of the decomposition levels, each scaled to image resolution"""
+    frameofreference, wavelet_coeffs = wavelet_coefficients(image_volume, roi, wavelet_str, mode_str)
+    subbands = _wavelet_subbands(subbands)
     nlevels = len(wavelet_coeffs) - 1
-    # level_results = []
-    accumulator = np.zeros(roi_volume.frameofreference.size[::-1])
-    # sum voxel-wise energy across all levels
+    accumulator = np.zeros(frameofreference.size[::-1])
+    # sum voxel-wise feature across all levels
     for level in range(nlevels-1, 0, -1):
-        wavelet_coeffs_diag = wavelet_coeffs[level+1]['ddd']
-        logger.info(indent('computing energy for level {:d} of shape:{!s}'.format(level, wavelet_coeffs_diag.shape), g_indents[3]))
-        result = image_iterator(energy_plugin, wavelet_coeffs_diag, radius)
-
-        zoomfactors = tuple(np.true_divide(roi_volume.frameofreference.size[::-1], result.shape))
-        # scale low-res coefficients to image res
-        result = scipy.ndimage.interpolation.zoom(result, zoomfactors, order=3)
-        result = MaskableVolume().fromArray(result, roi_volume.frameofreference)
-        # level_results.append(result)
-        accumulator = np.add(accumulator, result.array)
-    return MaskableVolume().fromArray(accumulator, roi_volume.frameofreference)
-
-def wavelet_raw(image_volume, radius=2, roi=None, wavelet_str='db1', mode_str='smooth', level=0):
-    # compute wavelet coefficients
-    logger.info(indent('performing 3d wavelet decomp using wavelet: {!s}'.format(wavelet_str), g_indents[3]))
-    roi_volume = image_volume.conformTo(roi.frameofreference)
-    wavelet_coeffs = wavelet_decomp_3d(roi_volume, wavelet_str, mode_str)
+        for subband in subbands:
+            coeffs = wavelet_coeffs[level+1][subband]
+            logger.info(indent('computing {!s} for level {:d} ({!s}) of shape:{!s}'.format(
+                feature_function.__name__, level, subband, coeffs.shape), g_indents[3]))
+            result = feature_function(_wavelet_levels(coeffs, binwidth), radius, workers=workers)
+
+            zoomfactors = tuple(np.true_divide(frameofreference.size[::-1], result.shape))
+            # scale low-res coefficients to image res
+            accumulator += scipy.ndimage.zoom(result, zoomfactors, order=3)
+    return MaskableVolume().fromArray(accumulator, frameofreference)
+
+def wavelet_entropy(image_volume, radius=2, roi=None, wavelet_str='db1', mode_str='smooth', subbands='ddd',
+                    workers=None, binwidth=None):
+    """local entropy of the wavelet coefficients summed over the decomposition levels
+
+    Levels with few distinct coefficients are evaluated by the running-histogram engine of image_entropy,
+    levels of continuous coefficients by the sort-based engine unless binwidth is given
+
+    Optional Args:
+        subbands -- detail subband (or list of them, or 'all') whose level entropies are summed, see
+                    WAVELET_SUBBANDS
+        workers  -- number of threads, see image_entropy
+        binwidth -- bin the coefficients to floor(c/binwidth) before taking their entropy
+    """
+    return _wavelet_level_feature(image_entropy, image_volume, radius, roi, wavelet_str, mode_str, subbands,
+                                  workers, binwidth)
+
+def wavelet_energy(image_volume, radius=2, roi=None, wavelet_str='db1', mode_str='smooth', subbands='ddd',
+                   workers=None, binwidth=None):
+    """local energy of the wavelet coefficients summed over the decomposition levels
+
+    Optional Args:
+        subbands -- see wavelet_entropy
+        workers  -- number of threads, see image_energy
+        binwidth -- see wavelet_entropy
+    """
+    return _wavelet_level_feature(image_energy, image_volume, radius, roi, wavelet_str, mode_str, subbands,
+                                  workers, binwidth)
+
+def wavelet_raw(image_volume, radius=2, roi=None, wavelet_str='db1', mode_str='smooth', level=0, subband='ddd'):
+    """wavelet coefficients of one subband of a decomposition level, scaled to image resolution"""
+    frameofreference, wavelet_coeffs = wavelet_coefficients(image_volume, roi, wavelet_str, mode_str)
     nlevels = len(wavelet_coeffs) - 1
-    wavelet_coeffs_diag = wavelet_coeffs[nlevels-level]['ddd']
-    zoomfactors = tuple(np.true_divide(roi_volume.frameofreference.size[::-1], wavelet_coeffs_diag.shape))
+    coeffs = wavelet_coeffs[nlevels-level][_wavelet_subbands(subband)[0]]
+    zoomfactors = tuple(np.true_divide(frameofreference.size[::-1], coeffs.shape))
     # scale low-res coefficients at highest level to image res
-    result = scipy.ndimage.interpolation.zoom(wavelet_coeffs_diag, zoomfactors, order=3)
-    result = MaskableVolume().fromArray(result, roi_volume.frameofreference)
+    result = scipy.ndimage.zoom(coeffs, zoomfactors, order=3)
+    result = MaskableVolume().fromArray(result, frameofreference)
     return result
 
 def glcm_polar(patch_vals, d, theta):
@@ -339,12 +1336,8 @@ def quantize(image_patch, gray_levels=12, n_stddev=2):
     # logger.debug('bin_width: {!s}'.format(bin_width))
 
     # rebin values into new quanization, first and last bins hold outliers
-    quantized_image_patch = np.zeros_like(image_patch, dtype=np.int8)
-    it = np.nditer(image_patch, op_flags=['readwrite'], flags=['multi_index'])
-    while not it.finished:
-        val = image_patch[it.multi_index]
-        quantized_image_patch[it.multi_index] = min(gray_levels-1, max(0, math.floor(((val - mean + n_stddev*stddev)/(bin_width+1e-9))+1)))
-        it.iternext()
+    quantized_image_patch = np.clip(np.floor(((image_patch - mean + n_stddev*stddev)/(bin_width+1e-9))+1),
+                                    0, gray_levels-1).astype(np.int8)
 
     # import matplotlib.pyplot as plt
     # xy_shape = quantized_image_patch.shape[1:]
@@ -358,101 +1351,383 @@ def quantize(image_patch, gray_levels=12, n_stddev=2):
     return quantized_image_patch
 
 def glcmMatrix(image_patch, dx, dy, dz, symmetric=False, normalized=False):
+    """co-occurence matrix of a single quantized patch using mirrored boundaries
+
+    see features_glcm.glcm_matrix_batch() for building the matrices of many patches at once
+    """
     # logger.debug('offsets-> dx:{:d}, dy:{:d}, dz:{:d}'.format(dx, dy, dz))
-    levels = np.max(image_patch)
-    glcm_matrix = np.zeros((levels+1, levels+1))
-    # loop through and accumulate counts
-    it = np.nditer(image_patch, op_flags=['readwrite'], flags=['multi_index'])
-    while (not it.finished):
-        y_idx = image_patch[it.multi_index]
-        # logger.debug('parent loc: ({!s}) -> y_idx: {!s}'.format(it.multi_index, y_idx))
-        x_idx_query = tuple(np.add(it.multi_index, (dz, dy, dx)))
-        # boundary handling
-        for i in range(3):
-            s = image_patch.shape[i]
-            q = x_idx_query[i]
-            if (x_idx_query[i] >= image_patch.shape[i]):
-                x_idx_query = list(x_idx_query)
-                x_idx_query[i] = s - abs(q-s) - 1
-                x_idx_query = tuple(x_idx_query)
-            if (x_idx_query[i] < 0):
-                x_idx_query = list(x_idx_query)
-                x_idx_query[i] = s - abs(q-s) - 1
-                x_idx_query = tuple(x_idx_query)
-        x_idx = image_patch[x_idx_query]
-        # logger.debug('  child loc: ({!s}) -> x_idx: {!s}'.format(x_idx_query, x_idx))
-        glcm_matrix[y_idx, x_idx] += 1
-        if (symmetric and x_idx != y_idx):
-            # fill lower_diagonal values
-            glcm_matrix[x_idx, y_idx] += 1
-        it.iternext()
-
-    # normalize counts
-    if (normalized):
-        total_counts = np.sum(glcm_matrix)
-        for val in np.nditer(glcm_matrix, op_flags=["readwrite"]):
-            val = val / total_counts
-
-    return glcm_matrix
+    levels = int(np.max(image_patch))
+    image_patch = np.asarray(image_patch).reshape((1, *image_patch.shape))
+    return features_glcm.glcm_matrix_batch(image_patch, levels+1, dx, dy, dz, symmetric=symmetric,
+                                           normalized=normalized, boundary='mirror')[0]
+
+def _glcm_level_offsets(glcm_matrix):
+    """(i - j) for every entry of a (..., L, L) glcm"""
+    levels = np.arange(glcm_matrix.shape[-1])
+    return levels.reshape((-1, 1)) - levels.reshape((1, -1))
 
+# the glcm statistics accept a single (L, L) matrix or a block of matrices of shape (N, L, L)
+@batched
 def glcm_stat_mean(glcm_matrix):
-    """glcm statistic evaluation method"""
-    return np.mean(glcm_matrix)
+    """glcm statistic evaluation method
+
+    the mean is taken over the levels up to the highest level of each patch, as over the (max+1, max+1) matrix
+    of glcmMatrix, rather than over all levels of the quantization
+    """
+    occupied = np.any(glcm_matrix != 0, axis=-1) | np.any(glcm_matrix != 0, axis=-2)
+    levels = np.maximum(1, occupied.shape[-1] - np.argmax(occupied[..., ::-1], axis=-1))
+    return np.sum(glcm_matrix, axis=(-2, -1)) / np.square(levels)
 
+@batched
 def glcm_stat_contrast(glcm_matrix):
     """glcm statistic evaluation method"""
-    it = np.nditer(glcm_matrix, flags=['multi_index'])
-    accum = 0
-    while (not it.finished):
-        accum += glcm_matrix[it.multi_index] * pow(np.diff(it.multi_index), 2)
-        it.iternext()
-    return accum
+    return np.sum(glcm_matrix * np.square(_glcm_level_offsets(glcm_matrix)), axis=(-2, -1))
 
+@batched
 def glcm_stat_energy(glcm_matrix):
     """glcm statistic evaluation method"""
-    return np.sum(np.square(glcm_matrix))
+    return np.sum(np.square(glcm_matrix), axis=(-2, -1))
 
+@batched
 def glcm_stat_dissimilarity(glcm_matrix):
     """glcm statistic evaluation method"""
-    it = np.nditer(glcm_matrix, flags=['multi_index'])
-    accum = 0
-    while (not it.finished):
-        accum += glcm_matrix[it.multi_index] * abs(np.diff(it.multi_index))
-        it.iternext()
-    return accum
+    return np.sum(glcm_matrix * np.abs(_glcm_level_offsets(glcm_matrix)), axis=(-2, -1))
 
+@batched
 def glcm_stat_homogeneity(glcm_matrix):
     """glcm statistic evaluation method"""
-    it = np.nditer(glcm_matrix, flags=['multi_index'])
-    accum = 0
-    while (not it.finished):
-        accum += glcm_matrix[it.multi_index] / (1 + pow(np.diff(it.multi_index), 2))
-        it.iternext()
-    return accum
-
-
-def glcm(image_volume, glcm_stat_function, radius=2, roi=None, gray_levels=12, n_stddev=2, dx=0, dy=0, dz=0):
-    """feature calculation entry function"""
-    # lexical scoping allows glcm to be adapted as a higher-order function then fed to image_iterator()
-    def glcm_eval(patch_vals):
-        """takes an ndarray of values in an image/volume patch and computes a single grey-level co-occurence matrix \
-        based on the distance and angle in radians
-
-        Args:
-            gray_levels -- gray_levels are binned according to uniform thresholding within +- 2std-dev,
-                           lowest and highest bins hold outliers and total bin count will be equal to requested
+    return np.sum(glcm_matrix / (1 + np.square(_glcm_level_offsets(glcm_matrix))), axis=(-2, -1))
+
+
+def _texture_halo(radius, binwidth=None, **feature_args):
+    """halo of glcm and glrlm: QMODE_STAT quantization takes the local stats of every voxel of a patch from its
+    own neighborhood, reaching 2*radius
+    """
+    return radius if binwidth else 2*radius
+
+def _quantize_texture_volume(image_volume, radius, gray_levels, n_stddev, binwidth, fixed_start, fixed_end,
+                             mode=None):
+    """quantize image_volume for the texture matrix features (memoized on BaseVolumes), with in-plane local
+    stats for mode='2d'
+
+    Patches are padded beyond the volume with the level of intensity 0 for QMODE_FIXEDHU, as if the zero-padded
+    patch had been quantized. QMODE_STAT levels depend on the local stats of each voxel, which padding voxels
+    don't have, so they are padded with level 0.
+
+    Returns:
+        (quantized volume of the same type as image_volume, number of quantization levels, padding level)
+    """
+    if binwidth:
+        quantized = quantization.quantize_volume(image_volume, binwidth=binwidth, fixed_start=fixed_start,
+                                                 fixed_end=fixed_end)
+        nlevels = quantization.getFixedNBins(binwidth, fixed_start, fixed_end)
+        pad_level = int(quantization.quantizeFixed(0, binwidth, fixed_start, fixed_end))
+    else:
+        quantized = quantization.quantize_volume(image_volume, gray_levels=gray_levels, ndev=n_stddev,
+                                                 radius=radius, z_radius=(0 if mode == '2d' else None))
+        nlevels = gray_levels
+        pad_level = 0
+    if not isinstance(image_volume, np.ndarray):
+        quantized = MaskableVolume().fromArray(quantized, image_volume.frameofreference)
+    return quantized, nlevels, pad_level
+
+@tile_halo(_texture_halo)
+@body_masked
+def glcm(image_volume, glcm_stat_function=None, radius=2, roi=None, gray_levels=12, n_stddev=2, dx=0, dy=0, dz=0,
+         binwidth=None, fixed_start=-250, fixed_end=350, stat_name=None, directions=None, aggregate='mean',
+         incremental=False, triplets=None, sparse=None, workers=None, processes=None, stride=None, coarse=False,
+         points=None, homogeneous=None, memo=False, report=None, body_threshold='auto', fill_value=-1,
+         mode=None, output=None, tiles=None):
+    """feature calculation entry function
+
+    The volume is quantized once (and memoized on the volume by quantization.quantize_volume) so that every
+    glcm statistic computed on the same volume shares one quantized copy. When a list of statistics is given,
+    the patches, quantized patches and glcms are built once per voxel and shared by all of them.
+
+    Args:
+        glcm_stat_function -- callable evaluated on each glcm (see glcm_stat_*), the name of a statistic, or a
+                              list of either
+    Optional Args:
+        gray_levels -- QMODE_STAT quantization into gray_levels bins within +-n_stddev local std. deviations
+        binwidth    -- QMODE_FIXEDHU quantization with fixed bins between fixed_start and fixed_end,
+                       takes precedence over gray_levels
+        stat_name   -- name (or list of names) of any stat_glcm_* statistic of local_features.cuh
+                       (e.g. 'stat_glcm_correlation'), as accepted by features_gpu.image_iterator_gpu. Named
+                       statistics are evaluated by features_glcm.GLCMStatistics on symmetric matrices with the
+                       kernel's clamped boundaries
+        directions  -- 'all' (the 13 3d directions, or 4 in-plane directions of 2d images and of mode='2d') or a
+                       list of
+                       (dx, dy, dz) offsets evaluated instead of the single offset (dx, dy, dz). The matrices of
+                       all directions are built from the same block of quantized patches
+        aggregate   -- combine the statistic over directions by 'mean' or 'max', or return one feature volume
+                       per direction with None
+        incremental -- build the matrices with running counts along each x scanline (see
+                       features_glcm.glcm_scanlines) at O(radius^2) rather than O(radius^3) cost per voxel, with
+                       identical results. Sparse evaluation always builds the matrices of each patch
+        triplets    -- evaluate named statistics on sparse (i, j, count) triplets holding only the level pairs
+                       that occur in each patch (see features_glcm.SparseGLCMStatistics), so that fine
+                       binwidths do not cost nlevels^2 per voxel. By default triplets are used whenever nlevels^2
+                       exceeds the number of voxel pairs of a patch (unless incremental is set)
+        sparse      -- only evaluate the voxels inside roi, see image_iterator
+        workers     -- number of threads, see image_iterator
+        processes   -- number of processes sharing the volume through shared memory, see image_iterator
+        stride      -- evaluate on a coarse lattice of voxels, see image_iterator. Not available with incremental
+        coarse      -- return the coarse lattice, see image_iterator
+        points      -- evaluate only these voxels (building the matrices of each patch), see feature_points
+        homogeneous -- assign the voxels whose quantized patch holds a single level the statistics of a constant
+                       patch without building their matrices, see image_iterator. On by default except for
+                       points, the incremental construction counts every voxel
+        memo        -- build the matrices and statistics only for the distinct quantized patches of each block,
+                       see image_iterator. Not used by the incremental construction
+        report      -- dict receiving the voxel and patch counts of image_iterator
+        body_threshold, fill_value -- evaluate only the body mask of image_volume without an roi (by default for
+                                      CT BaseVolumes), see image_iterator
+        mode        -- '2d' evaluates each axial slice independently with in-plane neighborhoods, see
+                       image_iterator
+        output, tiles -- evaluate tile by tile into on-disk output, see image_iterator. Tiles are read with the
+                         2*radius halo of QMODE_STAT quantization, see features_tiled.feature_halo
+    Returns:
+        feature volume, or a list with one feature volume per statistic if a list was supplied. Without
+        aggregation each statistic gives a list of feature volumes in the order of directions. With points an
+        ndarray of shape (N, noutputs) holding the statistics in the same order
+    """
+    if output is not None:
+        return _tiled_feature(glcm, image_volume, output, tiles, radius,
+                              {'roi': roi, 'sparse': sparse, 'stride': stride, 'points': points, 'report': report,
+                               'body_threshold': (None if body_threshold == 'auto' else body_threshold)},
+                              glcm_stat_function=glcm_stat_function, gray_levels=gray_levels, n_stddev=n_stddev,
+                              dx=dx, dy=dy, dz=dz, binwidth=binwidth, fixed_start=fixed_start,
+                              fixed_end=fixed_end, stat_name=stat_name, directions=directions,
+                              aggregate=aggregate, incremental=incremental, triplets=triplets, workers=workers,
+                              processes=processes, homogeneous=homogeneous, memo=memo, mode=mode)
+    if homogeneous is None:
+        # quantized volumes are integer valued, with constant patches wherever the intensities are flat
+        homogeneous = points is None
+    stats = glcm_stat_function if glcm_stat_function is not None else stat_name
+    if stats is None:
+        raise ValueError('one of "glcm_stat_function" or "stat_name" must be specified')
+    multiple = isinstance(stats, (list, tuple))
+    if not multiple:
+        stats = [stats]
+    if incremental and stride is not None:
+        raise ValueError('incremental glcm construction evaluates every voxel and does not support a stride')
+    named_idx = [i for i, stat in enumerate(stats) if isinstance(stat, str)]
+    function_idx = [i for i, stat in enumerate(stats) if not isinstance(stat, str)]
+
+    if aggregate not in (None, 'mean', 'max'):
+        raise ValueError('aggregate must be one of [None, "mean", "max"], not "{!s}"'.format(aggregate))
+
+    quantized, nlevels, pad_level = _quantize_texture_volume(image_volume, radius, gray_levels, n_stddev, binwidth,
+                                                             fixed_start, fixed_end, mode)
+    depth = _unpack_image(quantized)[0].shape[0]
+    if directions is None:
+        offsets = [(dx, dy, dz)]
+    else:
+        offsets = features_glcm.glcm_directions(directions, is_2d=(_get_z_radius(depth, radius, mode) == 0))
+    ndirections = len(offsets)
+    per_direction = (directions is not None and aggregate is None)
+    patch_size = (2*_get_z_radius(depth, radius, mode)+1) * (2*radius+1)**2
+    if triplets is None:
+        triplets = (not incremental and nlevels*nlevels > 2*patch_size)
+    # limit the size of each block of (D, N, L, L) matrices or of the triplets of symmetric pairs
+    matrix_block = max(1, int(BLOCK_BYTES // (ndirections*nlevels*nlevels*np.dtype(np.float64).itemsize)))
+    triplet_block = max(1, int(BLOCK_BYTES // (4*ndirections*2*patch_size*np.dtype(np.int64).itemsize)))
+
+    def evaluate_matrices(named_statistics, mirror_matrices):
+        """evaluate every statistic for N voxels, named statistics on the GLCMStatistics of their D*N symmetric
+        clamped matrices and callables on the (D, N, L, L) mirrored matrices, returning (N, noutputs)
         """
-        # if glcm_stat_function contains a collection of processing functions, return a result list
-        # ALL ARE PATCH OPERATIONS
-        # quantize image patch
-        # logger.debug('quantizing image patch of shape: ({!s})'.format(patch_vals.shape))
-        quantized_image_patch = quantize(patch_vals, gray_levels, n_stddev)
-        # generate glcm using mirrored boundaries
-        glcm_matrix = glcmMatrix(quantized_image_patch, dx, dy, dz)
-        # calculate statistic on glcm_matrix
-        result = glcm_stat_function(glcm_matrix)
-
-        return result
-
-    # build patch-eval function
-    return image_iterator(glcm_eval, image_volume, radius, roi)
+        if named_statistics is not None:
+            n = named_statistics.nmatrices // ndirections
+        else:
+            n = mirror_matrices.shape[1]
+        results = np.empty((n, len(stats), ndirections))
+        if named_idx:
+            named_results = named_statistics.evaluate([stats[k] for k in named_idx])
+            results[:, named_idx] = named_results.reshape((ndirections, n, -1)).transpose((1, 2, 0))
+        for k in function_idx:
+            results[:, k] = _evaluate_block(stats[k], mirror_matrices.reshape(
+                (-1, nlevels, nlevels))).reshape((ndirections, n)).T
+
+        if per_direction:
+            return results.reshape((n, -1))
+        elif aggregate == 'max':
+            return np.max(results, axis=2)
+        return np.mean(results, axis=2)
+    noutputs = len(stats) * (ndirections if per_direction else 1)
+
+    if incremental and not (sparse or points is not None):
+        # the kernel's clamped boundaries for named statistics, mirrored boundaries for callables
+        boundaries = (['clamp'] if named_idx else []) + (['mirror'] if function_idx else [])
+        array = _unpack_image(quantized)[0]
+        z_radius = _get_z_radius(array.shape[0], radius, mode)
+        # limit the running and boundary counts of each block of scanlines
+        block_rows = max(1, int(BLOCK_BYTES // (4*ndirections*nlevels*nlevels*np.dtype(np.float64).itemsize)))
+
+        def compute_region(array, region_start, region_stop):
+            feature_arrays = np.empty((noutputs, *np.subtract(region_stop, region_start)))
+            for zslice, x, counts in features_glcm.glcm_scanlines(array, nlevels, radius, z_radius, offsets,
+                                                                  region_start, region_stop, boundaries,
+                                                                  block_rows, pad_level):
+                counts = dict(zip(boundaries, (c.reshape((ndirections, -1, nlevels, nlevels)) for c in counts)))
+                named_statistics = None
+                if 'clamp' in counts:
+                    # symmetric with the doubled diagonal of the kernel, see glcm_matrix_directions
+                    clamp_matrices = counts['clamp'] + np.swapaxes(counts['clamp'], 2, 3)
+                    named_statistics = features_glcm.GLCMStatistics(clamp_matrices.reshape((-1, nlevels, nlevels)))
+                results = evaluate_matrices(named_statistics, counts.get('mirror'))
+                feature_arrays[:, zslice, :, x] = results.T.reshape((noutputs, zslice.stop-zslice.start, -1))
+            return feature_arrays
+
+        start_feature_calc = time.time()
+        start, stop = _calculation_bounds(quantized, array.shape, roi)
+        feature_arrays = _map_slabs(compute_region, array, start, stop,
+                                    default_workers() if workers is None else workers, processes, (noutputs, ))
+        logger.debug(timer('feature calculation time:', time.time()-start_feature_calc, l3))
+        feature_volumes = [_package_feature(feature_array, quantized, roi) for feature_array in feature_arrays]
+        if len(feature_volumes) == 1:
+            feature_volumes = feature_volumes[0]
+    else:
+        # lexical scoping allows glcm to be adapted as a higher-order function then fed to image_iterator()
+        @batched
+        def glcm_eval(patches):
+            """takes a block of quantized image/volume patches and computes the grey-level co-occurence \
+            matrices for every offset of all of them together, then evaluates every statistic on them
+            """
+            results = np.empty((patches.shape[0], noutputs))
+            if not triplets:
+                block_size = matrix_block
+            else:
+                block_size = min(matrix_block, triplet_block) if function_idx else triplet_block
+            for i in range(0, patches.shape[0], block_size):
+                block = patches[i:i+block_size].astype(np.int64)
+                # match the glcm construction of the CUDA kernel for named statistics
+                named_statistics = None
+                if named_idx and triplets:
+                    named_statistics = features_glcm.SparseGLCMStatistics(
+                        features_glcm.glcm_triplets(block, nlevels, offsets, symmetric=True, boundary='clamp',
+                                                    double_diagonal=True),
+                        ndirections*block.shape[0], nlevels)
+                elif named_idx:
+                    named_statistics = features_glcm.GLCMStatistics(features_glcm.glcm_matrix_directions(
+                        block, nlevels, offsets, symmetric=True, boundary='clamp', double_diagonal=True).reshape(
+                        (-1, nlevels, nlevels)))
+                # generate glcms using mirrored boundaries for callables
+                mirror_matrices = features_glcm.glcm_matrix_directions(
+                    block, nlevels, offsets) if function_idx else None
+                results[i:i+block.shape[0]] = evaluate_matrices(named_statistics, mirror_matrices)
+            return results
+        glcm_eval.noutputs = noutputs
+
+        # build patch-eval function
+        feature_volumes = image_iterator(glcm_eval, quantized, radius, roi, sparse=sparse, workers=workers,
+                                         processes=processes, stride=stride, coarse=coarse, points=points,
+                                         homogeneous=homogeneous, memo=memo, report=report, body_threshold=None,
+                                         fill_value=fill_value, mode=mode, pad_value=pad_level)
+        if points is not None:
+            return feature_volumes
+    if per_direction:
+        # group the volumes of each statistic
+        if sparse == 'indices':
+            values, indices = feature_volumes
+            values = np.reshape(values, (len(stats), ndirections, -1))
+            return (values if multiple else values[0]), indices
+        if not isinstance(feature_volumes, list):
+            feature_volumes = [feature_volumes]
+        feature_volumes = [feature_volumes[k*ndirections:(k+1)*ndirections] for k in range(len(stats))]
+    if not multiple and isinstance(feature_volumes, list):
+        return feature_volumes[0]
+    return feature_volumes
+
+
+@tile_halo(_texture_halo)
+@body_masked
+def glrlm(image_volume, stat_name, radius=2, roi=None, gray_levels=12, n_stddev=2, dx=1, dy=0, dz=0, binwidth=None,
+          fixed_start=-250, fixed_end=350, sparse=None, workers=None, processes=None, stride=None, coarse=False,
+          points=None, homogeneous=None, memo=False, report=None, body_threshold='auto', fill_value=-1,
+          mode=None, output=None, tiles=None):
+    """gray level run-length matrix feature calculation entry function, CPU equivalent of
+    features_gpu.image_iterator_gpu(feature_kernel='kernel_glrlm')
+
+    Run-length matrices of shape (nlevels, MAXRUNLENGTH) are built for blocks of quantized patches at once by
+    features_glrlm.glrlm_matrix_batch() with the run semantics of the CUDA kernel.
+
+    Args:
+        stat_name -- name (or list of names) of any stat_glrlm_* statistic of local_features.cuh
+                     (e.g. 'stat_glrlm_sre'), see features_glrlm.GLRLMStatistics
+    Optional Args:
+        dx, dy, dz  -- direction in which runs are measured
+        gray_levels -- QMODE_STAT quantization into gray_levels bins within +-n_stddev local std. deviations
+        binwidth    -- QMODE_FIXEDHU quantization with fixed bins between fixed_start and fixed_end,
+                       takes precedence over gray_levels
+        sparse      -- only evaluate the voxels inside roi, see image_iterator
+        workers     -- number of threads, see image_iterator
+        processes   -- number of processes sharing the volume through shared memory, see image_iterator
+        stride      -- evaluate on a coarse lattice of voxels, see image_iterator
+        coarse      -- return the coarse lattice, see image_iterator
+        points      -- evaluate only these voxels, see feature_points
+        homogeneous -- assign the voxels whose quantized patch holds a single level the statistics of a constant
+                       patch without building their matrices, see image_iterator. On by default except for
+                       points
+        memo        -- build the matrices and statistics only for the distinct quantized patches of each block,
+                       see image_iterator
+        report      -- dict receiving the voxel and patch counts of image_iterator
+        body_threshold, fill_value -- evaluate only the body mask of image_volume without an roi (by default for
+                                      CT BaseVolumes), see image_iterator
+        mode        -- '2d' evaluates each axial slice independently with in-plane neighborhoods, see
+                       image_iterator
+        output, tiles -- evaluate tile by tile into on-disk output, see image_iterator. Tiles are read with the
+                         2*radius halo of QMODE_STAT quantization, see features_tiled.feature_halo
+    Returns:
+        feature volume, or a list with one feature volume per statistic if a list was supplied. With points an
+        ndarray of shape (N, nstats)
+    """
+    if output is not None:
+        return _tiled_feature(glrlm, image_volume, output, tiles, radius,
+                              {'roi': roi, 'sparse': sparse, 'stride': stride, 'points': points, 'report': report,
+                               'body_threshold': (None if body_threshold == 'auto' else body_threshold)},
+                              stat_name=stat_name, gray_levels=gray_levels, n_stddev=n_stddev, dx=dx, dy=dy, dz=dz,
+                              binwidth=binwidth, fixed_start=fixed_start, fixed_end=fixed_end, workers=workers,
+                              processes=processes, homogeneous=homogeneous, memo=memo, mode=mode)
+    if homogeneous is None:
+        # quantized volumes are integer valued, with constant patches wherever the intensities are flat
+        homogeneous = points is None
+    multiple = isinstance(stat_name, (list, tuple))
+    stats = list(stat_name) if multiple else [stat_name]
+    for name in stats:
+        if not name.startswith('stat_glrlm_'):
+            name = 'stat_glrlm_' + name
+        if name not in features_glrlm.GLRLMStatistics.available():
+            raise ValueError('unknown glrlm statistic "{!s}". must be one of {!s}'.format(
+                name, features_glrlm.GLRLMStatistics.available()))
+
+    quantized, nlevels, pad_level = _quantize_texture_volume(image_volume, radius, gray_levels, n_stddev, binwidth,
+                                                             fixed_start, fixed_end, mode)
+    depth = _unpack_image(quantized)[0].shape[0]
+    maxrunlength = features_glrlm.max_run_length(radius, _get_z_radius(depth, radius, mode))
+    # limit the size of each (N, L, MAXRUNLENGTH) block of matrices
+    matrix_block = max(1, int(BLOCK_BYTES // (nlevels*maxrunlength*np.dtype(np.float64).itemsize)))
+
+    @batched
+    def glrlm_eval(patches):
+        """takes a block of quantized image/volume patches and computes the run-length matrices in direction \
+        (dx, dy, dz) of all of them together, then evaluates every statistic on them
+        """
+        results = np.empty((patches.shape[0], len(stats)))
+        patch_size = int(np.prod(patches.shape[1:]))
+        for i in range(0, patches.shape[0], matrix_block):
+            glrlm_matrices = features_glrlm.glrlm_matrix_batch(patches[i:i+matrix_block].astype(np.int64),
+                                                               nlevels, dx, dy, dz, maxrunlength)
+            results[i:i+matrix_block] = features_glrlm.glrlm_stats(glrlm_matrices, stats, patch_size)
+        return results
+    glrlm_eval.noutputs = len(stats)
+
+    feature_volumes = image_iterator(glrlm_eval, quantized, radius, roi, sparse=sparse, workers=workers,
+                                     processes=processes, stride=stride, coarse=coarse, points=points,
+                                     homogeneous=homogeneous, memo=memo, report=report, body_threshold=None,
+                                     fill_value=fill_value, mode=mode, pad_value=pad_level)
+    if points is not None:
+        return feature_volumes
+    if not multiple and isinstance(feature_volumes, list):
+        return feature_volumes[0]
+    return feature_volumes
@@ -0,0 +1,180 @@
+"""features_firstorder.py
+
+Local first-order statistics of every voxel computed from separable box filters of the local raw moments
+
+Each requested moment is the mean of a power of the (shifted) intensities over the zero-padded neighborhood,
+evaluated with one running-sum uniform filter per axis so the cost does not depend on the neighborhood radius.
+Several radii are evaluated from a single summed-volume table per power instead (see local_firstorder_sweep).
+"""
+import logging
+import numpy as np
+import scipy.ndimage
+from pymedimage import features_haar
+
+# initialize module logger
+logger = logging.getLogger(__name__)
+
+# highest raw moment required by each statistic, named as the kernel_fo_* functions of local_features.cuh
+STATISTICS = {'mean':     1,
+              'variance': 2,
+              'stddev':   2,
+              'rms':      2,
+              'skewness': 3,
+              'kurtosis': 4}
+
+# second central moments below this fraction of the second raw moment are treated as flat neighborhoods, for
+# which skewness and kurtosis are undefined (and set to 0 as features_gpu does with the kernel's nan results)
+FLAT_TOLERANCE = 1e-10
+
+def _stat_name(name):
+    if name.startswith('kernel_fo_'):
+        name = name[len('kernel_fo_'):]
+    if name not in STATISTICS:
+        raise ValueError('unknown first-order statistic "{!s}". must be one of {!s}'.format(
+            name, list(STATISTICS.keys())))
+    return name
+
+def _halo_region(array, start, stop, halo):
+    """subarray [start-halo, stop+halo), zero-padded wherever it extends beyond the array"""
+    lo = np.subtract(start, halo)
+    hi = np.add(stop, halo)
+    region = array[tuple(slice(max(0, l), min(s, h)) for l, h, s in zip(lo, hi, array.shape))]
+    pad = [(max(0, -l), max(0, h-s)) for l, h, s in zip(lo, hi, array.shape)]
+    return np.pad(np.asarray(region, dtype=np.float64), pad, mode='constant', constant_values=0)
+
+def local_moments(array, radius, z_radius, max_order, start=None, stop=None, shift=None):
+    """means of the powers 1..max_order of the shifted intensities over every zero-padded neighborhood
+
+    Intensities are shifted (by default by the mean of the region) first, which keeps the cancellation in the
+    central moments derived from these raw moments small.
+
+    Args:
+        array     -- 3d ndarray of voxel intensities
+        radius    -- in-plane neighborhood radius
+        z_radius  -- neighborhood radius along the first axis
+        max_order -- highest power to evaluate
+    Optional Args:
+        start, stop -- (z, y, x) bounds of the voxels for which moments are computed, defaults to all voxels
+        shift       -- value subtracted from the intensities. Regions computed separately (e.g. in slabs) give
+                       identical results when they share the same shift
+    Returns:
+        (shift, list of ndarrays of the local means of (x-shift)**k for k=1..max_order over the bounded region)
+    """
+    if start is None:
+        start = (0, 0, 0)
+    if stop is None:
+        stop = array.shape
+    halo = (z_radius, radius, radius)
+    region = _halo_region(array, start, stop, halo)
+    if shift is None:
+        shift = float(np.mean(region)) if region.size else 0.0
+    region -= shift
+    inner = tuple(slice(h, h+int(e-s)) for h, s, e in zip(halo, start, stop))
+    size = (2*z_radius+1, 2*radius+1, 2*radius+1)
+
+    moments = []
+    power = np.ones_like(region)
+    for order in range(1, max_order+1):
+        power *= region
+        # the region already holds the zero-padded halo of every inner voxel, so cval is never sampled
+        moments.append(scipy.ndimage.uniform_filter(power, size, mode='constant', cval=0)[inner])
+    return shift, moments
+
+def local_moments_sweep(array, radii, z_radii, max_order, start=None, stop=None, shift=None):
+    """local_moments for several neighborhood sizes from one summed-volume table per power
+
+    The tables cover the region and the halo of the largest neighborhood, and every moment of every radius is
+    then a block sum of 8 table lookups (see features_haar.block_sums).
+
+    Args:
+        radii, z_radii -- in-plane and first axis radius of each neighborhood
+    Returns:
+        (shift, list with the list of local moments of each radius, see local_moments())
+    """
+    if start is None:
+        start = (0, 0, 0)
+    if stop is None:
+        stop = array.shape
+    halo = (max(z_radii), max(radii), max(radii))
+    region = _halo_region(array, start, stop, halo)
+    if shift is None:
+        shift = float(np.mean(region)) if region.size else 0.0
+    region -= shift
+    extent = tuple(int(e-s) for s, e in zip(start, stop))
+
+    tables = []
+    power = np.ones_like(region)
+    for order in range(1, max_order+1):
+        power *= region
+        tables.append(features_haar.summed_volume_table(power))
+    moments = []
+    for radius, z_radius in zip(radii, z_radii):
+        size = (2*z_radius+1, 2*radius+1, 2*radius+1)
+        offset = (-z_radius, -radius, -radius)
+        moments.append([features_haar.block_sums(table, halo, np.add(halo, extent), offset, size) / np.prod(size)
+                        for table in tables])
+    return shift, moments
+
+def _firstorder_from_moments(stat_names, shift, a, n):
+    """first-order statistics from the local means a of the powers of the shifted intensities over
+    neighborhoods of n voxels, see local_firstorder_stats()
+    """
+    max_order = len(a)
+    # central moments from the shifted raw moments
+    m = {}
+    if max_order >= 2:
+        m[2] = np.maximum(0, a[1] - a[0]*a[0])
+        flat = m[2] <= FLAT_TOLERANCE * a[1]
+    if max_order >= 3:
+        m[3] = a[2] - 3*a[0]*a[1] + 2*a[0]**3
+    if max_order >= 4:
+        m[4] = a[3] - 4*a[0]*a[2] + 6*a[0]*a[0]*a[1] - 3*a[0]**4
+
+    results = np.empty((len(stat_names), *a[0].shape))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        for i, name in enumerate(stat_names):
+            if name == 'mean':
+                results[i] = a[0] + shift
+            elif name == 'variance':
+                results[i] = m[2] * n/(n-1)
+            elif name == 'stddev':
+                results[i] = np.sqrt(m[2] * n/(n-1))
+            elif name == 'rms':
+                results[i] = np.sqrt(np.maximum(0, a[1] + 2*shift*a[0] + shift*shift))
+            elif name == 'skewness':
+                results[i] = np.where(flat, 0, m[3] / np.power(m[2], 1.5))
+            elif name == 'kurtosis':
+                results[i] = np.where(flat, 0, m[4] / m[2])
+    return results
+
+def local_firstorder_stats(array, stat_names, radius, z_radius, start=None, stop=None, shift=None):
+    """evaluate first-order statistics of every zero-padded neighborhood with the formulas of local_features.cuh
+
+    variance and stddev use dof=1, while skewness and kurtosis are normalized by the dof=0 std. deviation,
+    with kurtosis divided by its square as in kernel_fo_kurtosis.
+
+    Args:
+        array      -- 3d ndarray of voxel intensities
+        stat_names -- list of statistic names (see STATISTICS), optionally prefixed with 'kernel_fo_'
+    Optional Args:
+        start, stop, shift -- see local_moments()
+    Returns:
+        ndarray of shape (len(stat_names), *bounded region shape)
+    """
+    stat_names = [_stat_name(name) for name in stat_names]
+    max_order = max(STATISTICS[name] for name in stat_names)
+    shift, a = local_moments(array, radius, z_radius, max_order, start, stop, shift)
+    return _firstorder_from_moments(stat_names, shift, a, (2*z_radius+1) * (2*radius+1)**2)
+
+def local_firstorder_sweep(array, stat_names, radii, z_radii, start=None, stop=None, shift=None):
+    """local_firstorder_stats for several neighborhood sizes sharing one summed-volume table per power, see
+    local_moments_sweep()
+
+    Returns:
+        ndarray of shape (len(radii), len(stat_names), *bounded region shape)
+    """
+    stat_names = [_stat_name(name) for name in stat_names]
+    max_order = max(STATISTICS[name] for name in stat_names)
+    shift, moments = local_moments_sweep(array, radii, z_radii, max_order, start, stop, shift)
+    return np.stack([_firstorder_from_moments(stat_names, shift, a, (2*z_radius+1) * (2*radius+1)**2)
+                     for a, radius, z_radius in zip(moments, radii, z_radii)])
@@ -0,0 +1,632 @@
+"""features_glcm.py
+
+Vectorized CPU construction of gray level co-occurence matrices (GLCM) for blocks of quantized patches
+"""
+import logging
+import numpy as np
+
+# initialize module logger
+logger = logging.getLogger(__name__)
+
+def _mirror(q, s):
+    """mirrored boundary handling of features.glcmMatrix for indices q along an axis of length s"""
+    q = np.where(q >= s, 2*s - q - 1, q)
+    q = np.where(q < 0, q - 1, q)
+    # negative indices wrap to the end of the axis
+    return np.mod(q, s)
+
+def glcm_pair_indices(patch_shape, dx=0, dy=0, dz=0, boundary='mirror'):
+    """flat indices of the reference and neighbor voxel of every co-occuring pair within a patch
+
+    Args:
+        patch_shape -- (pz, py, px)
+        boundary    -- 'mirror': out of patch neighbors are reflected back into the patch as in features.glcmMatrix
+                       'clamp':  the flat neighbor index is clamped to the patch as in glcm_matrix of
+                                 local_features.cuh
+    Returns:
+        (reference, neighbor) ndarrays of flat patch indices
+    """
+    pz, py, px = patch_shape
+    z, y, x = np.indices(patch_shape).reshape((3, -1))
+    reference = np.arange(pz*py*px)
+    if boundary == 'mirror':
+        neighbor = np.ravel_multi_index((_mirror(z+dz, pz), _mirror(y+dy, py), _mirror(x+dx, px)), patch_shape)
+    elif boundary == 'clamp':
+        neighbor = np.clip((z+dz)*py*px + (y+dy)*px + (x+dx), 0, pz*py*px-1)
+    else:
+        raise ValueError('boundary must be one of ["mirror", "clamp"], not "{!s}"'.format(boundary))
+    return reference, neighbor
+
+# the 13 unique (dx, dy, dz) offsets to the 26-connected neighbors of a voxel, and the 4 offsets within a plane
+DIRECTIONS_3D = ((1, 0, 0), (0, 1, 0), (0, 0, 1),
+                 (1, 1, 0), (1, -1, 0), (1, 0, 1), (1, 0, -1), (0, 1, 1), (0, 1, -1),
+                 (1, 1, 1), (1, 1, -1), (1, -1, 1), (1, -1, -1))
+DIRECTIONS_2D = tuple(d for d in DIRECTIONS_3D if d[2] == 0)
+
+def glcm_directions(directions, is_2d=False):
+    """list of (dx, dy, dz) offsets for directions='all' (DIRECTIONS_2D for 2d images) or an explicit list"""
+    if isinstance(directions, str):
+        if directions != 'all':
+            raise ValueError('directions must be "all" or a list of (dx, dy, dz) offsets, not "{!s}"'.format(
+                directions))
+        return list(DIRECTIONS_2D if is_2d else DIRECTIONS_3D)
+    directions = [tuple(int(x) for x in d) for d in directions]
+    if not directions or any(len(d) != 3 for d in directions):
+        raise ValueError('directions must be a non-empty list of (dx, dy, dz) offsets')
+    return directions
+
+def glcm_matrix_directions(patches, nlevels, directions, symmetric=False, normalized=False, boundary='mirror',
+                           double_diagonal=False):
+    """co-occurence matrices of a block of quantized patches for several offsets from a single np.bincount
+
+    Every (offset d, patch n, reference level i, neighbor level j) is encoded as a single flat index into the
+    (D, N, nlevels, nlevels) result so that all counts of the block are accumulated at once.
+
+    Args:
+        patches    -- integer ndarray of shape (N, pz, py, px) holding levels in [0, nlevels)
+        nlevels    -- number of quantization levels, sets the matrix size
+        directions -- list of (dx, dy, dz) offsets
+    Optional Args:
+        symmetric  -- also count every pair of distinct levels in the opposite direction (adds the transposed
+                      counts off the diagonal) as features.glcmMatrix
+        normalized -- divide the counts of each matrix by its total so entries are joint probabilities
+        boundary   -- boundary handling of neighbors outside the patch, see glcm_pair_indices()
+        double_diagonal -- with symmetric, also count the pairs of equal levels twice as glcm_matrix of
+                           local_features.cuh does
+    Returns:
+        ndarray of shape (len(directions), N, nlevels, nlevels)
+    """
+    n = patches.shape[0]
+    nmatrices = len(directions) * n
+    flat_patches = patches.reshape((n, -1)).astype(np.int64)
+    keys = []
+    for d, (dx, dy, dz) in enumerate(directions):
+        reference, neighbor = glcm_pair_indices(patches.shape[1:], dx, dy, dz, boundary)
+        matrix = (d*n + np.arange(n)).reshape((-1, 1))
+        keys.append(((matrix*nlevels + flat_patches[:, reference])*nlevels + flat_patches[:, neighbor]).ravel())
+    counts = np.bincount(np.concatenate(keys), minlength=nmatrices*nlevels*nlevels)
+    counts = counts.reshape((len(directions), n, nlevels, nlevels)).astype(np.float64)
+    if symmetric:
+        diagonal = np.diagonal(counts, axis1=2, axis2=3).copy()
+        counts = counts + np.swapaxes(counts, 2, 3)
+        if not double_diagonal:
+            levels = np.arange(nlevels)
+            counts[:, :, levels, levels] -= diagonal
+    if normalized:
+        counts /= np.sum(counts, axis=(2, 3), keepdims=True)
+    return counts
+
+def glcm_matrix_batch(patches, nlevels, dx=0, dy=0, dz=0, symmetric=False, normalized=False, boundary='mirror',
+                      double_diagonal=False):
+    """co-occurence matrices for a block of quantized patches from a single np.bincount
+
+    Args:
+        patches   -- integer ndarray of shape (N, pz, py, px) holding levels in [0, nlevels)
+        nlevels   -- number of quantization levels, sets the matrix size
+    Optional Args:
+        symmetric, normalized, boundary, double_diagonal -- see glcm_matrix_directions()
+    Returns:
+        ndarray of shape (N, nlevels, nlevels)
+    """
+    return glcm_matrix_directions(patches, nlevels, [(dx, dy, dz)], symmetric, normalized, boundary,
+                                  double_diagonal)[0]
+
+
+def _pair_coordinates(patch_shape, dx, dy, dz, boundaries):
+    """patch coordinates of the pairs of glcm_pair_indices() split into interior and boundary pairs
+
+    Returns:
+        (interior (reference, neighbor) coordinates, [boundary (reference, neighbor) coordinates per boundary])
+        where each coordinates entry is an ndarray of shape (3, npairs)
+    """
+    reference = np.array(np.unravel_index(np.arange(int(np.prod(patch_shape))), patch_shape))
+    neighbor = reference + np.reshape((dz, dy, dx), (3, 1))
+    interior = np.all((neighbor >= 0) & (neighbor < np.reshape(patch_shape, (3, 1))), axis=0)
+    boundary_pairs = []
+    for boundary in boundaries:
+        mapped = glcm_pair_indices(patch_shape, dx, dy, dz, boundary)[1][~interior]
+        boundary_pairs.append((reference[:, ~interior], np.array(np.unravel_index(mapped, patch_shape))))
+    return (reference[:, interior], neighbor[:, interior]), boundary_pairs
+
+def glcm_scanlines(array, nlevels, radius, z_radius, directions, start=None, stop=None, boundaries=('mirror', ),
+                   block_rows=None, pad_value=0):
+    """co-occurence matrices of the zero-padded (or pad_value padded) patch of every voxel in the region
+    [start, stop), updated incrementally along each x scanline
+
+    The pairs of a patch split into interior pairs, whose reference and neighbor both lie within the patch, and
+    boundary pairs, whose neighbor is mapped back into the patch by the boundary rule. Interior pairs do not
+    depend on the position of the patch, so as the patch slides one voxel along x only the interior pairs that
+    touch the leaving and the entering plane are removed from and added to a running count matrix per scanline.
+    Boundary pairs (one plane of the patch for unit offsets) are counted directly, so every matrix costs
+    O(radius^2) rather than the O(radius^3) of glcm_matrix_directions(), whose counts are reproduced exactly.
+
+    Args:
+        array      -- 3d integer ndarray of levels in [0, nlevels)
+        nlevels    -- number of quantization levels, sets the matrix size
+        directions -- list of (dx, dy, dz) offsets
+    Optional Args:
+        start, stop -- (z, y, x) bounds of the voxels, defaults to all voxels
+        boundaries  -- boundary handling of the matrices to build, see glcm_pair_indices()
+        block_rows  -- most scanlines updated together, defaults to all scanlines of the region
+        pad_value   -- level of the voxels outside of the array
+    Yields:
+        (zslice, x, counts) with zslice and x indexing the region relative to start and counts a list holding an
+        ndarray of shape (len(directions), nz, ny, nlevels, nlevels) for each boundary
+    """
+    if start is None:
+        start = (0, 0, 0)
+    if stop is None:
+        stop = array.shape
+    patch_shape = (2*z_radius+1, 2*radius+1, 2*radius+1)
+    halo = (z_radius, radius, radius)
+    lo = [max(0, b-h) for b, h in zip(start, halo)]
+    hi = [min(n, e+h) for e, h, n in zip(stop, halo, array.shape)]
+    # padded[z, y, x] is the first voxel of the patch centered on voxel (z, y, x) of the region
+    padded = np.pad(np.asarray(array[tuple(slice(l, u) for l, u in zip(lo, hi))], dtype=np.int64),
+                    [(h-(b-l), e+h-u) for b, e, l, u, h in zip(start, stop, lo, hi, halo)], mode='constant',
+                    constant_values=pad_value)
+    nz, ny, nx = (int(e-b) for b, e in zip(start, stop))
+    px = patch_shape[2]
+    pairs = [_pair_coordinates(patch_shape, dx, dy, dz, boundaries) for dx, dy, dz in directions]
+    if block_rows is None:
+        block_rows = nz*ny
+    zstep = max(1, block_rows // max(1, ny))
+
+    for zblock in range(0, nz, zstep):
+        zslice = slice(zblock, min(nz, zblock+zstep))
+        nrows = (zslice.stop-zslice.start) * ny
+        nbins = len(directions) * nrows * nlevels * nlevels
+        zz, yy = (np.reshape(c, (-1, 1)) for c in np.meshgrid(np.arange(zslice.start, zslice.stop), np.arange(ny),
+                                                               indexing='ij'))
+        matrix = np.arange(nrows).reshape((-1, 1))
+
+        def keys(d, coordinates, x):
+            """flat (direction, row, reference level, neighbor level) keys of the pairs of every row at column x"""
+            reference, neighbor = coordinates
+            levels = [padded[zz + c[0], yy + c[1], x + c[2]] for c in (reference, neighbor)]
+            return ((((d*nrows + matrix)*nlevels + levels[0])*nlevels) + levels[1]).ravel()
+
+        interior = [p[0] for p in pairs]
+        # interior pairs leaving the patch as it moves from x to x+1, and entering it (in the new patch coordinates)
+        leaving = [(r[:, np.minimum(r[2], n[2]) == 0], n[:, np.minimum(r[2], n[2]) == 0]) for r, n in interior]
+        entering = [(r[:, np.maximum(r[2], n[2]) == px-1], n[:, np.maximum(r[2], n[2]) == px-1])
+                    for r, n in interior]
+        hist = np.bincount(np.concatenate([keys(d, c, 0) for d, c in enumerate(interior)]), minlength=nbins)
+        for x in range(nx):
+            counts = []
+            for b in range(len(boundaries)):
+                boundary_keys = np.concatenate([keys(d, p[1][b], x) for d, p in enumerate(pairs)])
+                counts.append((hist + np.bincount(boundary_keys, minlength=nbins)).reshape(
+                    (len(directions), zslice.stop-zslice.start, ny, nlevels, nlevels)).astype(np.float64))
+            yield zslice, x, counts
+            if x == nx-1:
+                break
+            hist -= np.bincount(np.concatenate([keys(d, c, x) for d, c in enumerate(leaving)]), minlength=nbins)
+            hist += np.bincount(np.concatenate([keys(d, c, x+1) for d, c in enumerate(entering)]), minlength=nbins)
+
+
+####################################################################################################
+# GLCM STATISTICS
+####################################################################################################
+# arbitrarily small number used to alleviate log(0) errors as log(0+eps), as in local_features.cuh
+eps = 1e-16
+
+def _lazy(method):
+    """evaluate a GLCMStatistics term on first access only, sharing it between all statistics"""
+    name = method.__name__
+    def getter(self):
+        if name not in self._terms:
+            self._terms[name] = method(self)
+        return self._terms[name]
+    getter.__doc__ = method.__doc__
+    return property(getter)
+
+def _entropy(probs, axis):
+    return -np.sum(probs * np.log2(probs + eps), axis=axis)
+
+class GLCMStatistics:
+    """Evaluates the stat_glcm_* statistics of local_features.cuh on a block of co-occurence matrices
+
+    Intermediate terms (normalized matrices, marginals, means, sum/difference distributions and entropies)
+    are computed at most once per block and shared by every requested statistic. Formulas follow the CUDA
+    kernels exactly, so statistics that the kernels evaluate on the raw counts rather than on the normalized
+    matrix (differenceavg, differencevariance, idm, id) do so here as well.
+    """
+    def __init__(self, counts):
+        """
+        Args:
+            counts -- co-occurence counts of shape (N, L, L) or (L, L), see glcm_matrix_batch()
+        """
+        counts = np.asarray(counts, dtype=np.float64)
+        self.squeeze = (counts.ndim == 2)
+        self.counts = counts.reshape((-1, *counts.shape[-2:]))
+        self.nmatrices, self.nlevels = self.counts.shape[:2]
+        self._terms = {}
+
+        # weight arrays indexed as [y, x] == [row, column]
+        levels = np.arange(self.nlevels, dtype=np.float64)
+        self.y = levels.reshape((-1, 1))
+        self.x = levels.reshape((1, -1))
+        self.diff = self.y - self.x
+        self.sqdiff = np.square(self.diff)
+        self.absdiff = np.abs(self.diff)
+
+    @staticmethod
+    def available():
+        """names of all statistics that can be evaluated"""
+        return sorted(name for name in dir(GLCMStatistics) if name.startswith('stat_glcm_'))
+
+    def evaluate(self, stat_names):
+        """evaluate each named statistic for every matrix
+
+        Args:
+            stat_names -- name or list of names with or without the 'stat_glcm_' prefix, e.g. 'contrast'
+        Returns:
+            ndarray of shape (N,) for a single name or (N, len(stat_names)) for a list
+        """
+        single = isinstance(stat_names, str)
+        if single:
+            stat_names = [stat_names]
+        results = np.empty((self.nmatrices, len(stat_names)))
+        for i, name in enumerate(stat_names):
+            if not name.startswith('stat_glcm_'):
+                name = 'stat_glcm_' + name
+            if name not in self.available():
+                raise ValueError('unknown glcm statistic "{!s}". must be one of {!s}'.format(name, self.available()))
+            results[:, i] = getattr(self, name)()
+        if single:
+            results = results[:, 0]
+        if self.squeeze:
+            results = results[0]
+        return results
+
+    def _sum(self, weighted):
+        return np.sum(weighted, axis=(1, 2))
+
+    def _per_entry(self, values):
+        """broadcast one value per matrix to the entries of the matrices"""
+        return values.reshape((-1, 1, 1))
+
+    # SHARED TERMS
+    @_lazy
+    def P(self):
+        """normalized joint probabilities"""
+        return self.counts / self._per_entry(self._sum(self.counts))
+
+    @_lazy
+    def Px(self):
+        """marginal over rows, indexed by y"""
+        return np.sum(self.P, axis=2)
+
+    @_lazy
+    def Py(self):
+        """marginal over columns, indexed by x"""
+        return np.sum(self.P, axis=1)
+
+    @_lazy
+    def mean_Px(self):
+        return self._sum(self.P * self.y)
+
+    @_lazy
+    def mean_Py(self):
+        return self._sum(self.P * self.x)
+
+    @_lazy
+    def variance_Px(self):
+        # rn::glcm_variance_Px weighs the column index by mean_Px
+        return self._sum(self.P * np.square(self.x - self._per_entry(self.mean_Px)))
+
+    @_lazy
+    def variance_Py(self):
+        return self._sum(self.P * np.square(self.y - self._per_entry(self.mean_Py)))
+
+    @_lazy
+    def cluster_offset(self):
+        """(x + y - mean_Px - mean_Py) for every matrix entry"""
+        return self.x + self.y - self._per_entry(self.mean_Px + self.mean_Py)
+
+    def _marginal_by(self, matrices, index, length):
+        """sum the entries of each matrix that share the same integer index"""
+        keys = (np.arange(self.nmatrices).reshape((-1, 1))*length + index.reshape((1, -1))).ravel()
+        return np.bincount(keys, weights=matrices.reshape((self.nmatrices, -1)).ravel(),
+                           minlength=self.nmatrices*length).reshape((self.nmatrices, length))
+
+    @_lazy
+    def Pxplusy(self):
+        """P(x+y=k) for k in [0, 2L-2]"""
+        return self._marginal_by(self.P, (self.y + self.x).astype(np.int64), 2*self.nlevels-1)
+
+    @_lazy
+    def Pxminusy(self):
+        """P(|x-y|=k) for k in [0, L-1]"""
+        return self._marginal_by(self.P, self.absdiff.astype(np.int64), self.nlevels)
+
+    @_lazy
+    def counts_xminusy(self):
+        """un-normalized equivalent of Pxminusy"""
+        return self._marginal_by(self.counts, self.absdiff.astype(np.int64), self.nlevels)
+
+    @_lazy
+    def HX(self):
+        return _entropy(self.Px, axis=1)
+
+    @_lazy
+    def HY(self):
+        return _entropy(self.Py, axis=1)
+
+    @_lazy
+    def HXY(self):
+        return _entropy(self.P, axis=(1, 2))
+
+    @_lazy
+    def PxPy(self):
+        """outer product of the marginals, indexed as [y, x]"""
+        return self.Px[:, :, np.newaxis] * self.Py[:, np.newaxis, :]
+
+    @_lazy
+    def HXY1(self):
+        return -self._sum(self.P * np.log2(self.PxPy + eps))
+
+    @_lazy
+    def HXY2(self):
+        return _entropy(self.PxPy, axis=(1, 2))
+
+    @_lazy
+    def sum_k(self):
+        """k in [2, 2L-2], the range summed over by the sum* kernels"""
+        return np.arange(2, 2*self.nlevels-1, dtype=np.float64)
+
+    # STATISTICS
+    def stat_glcm_contrast(self):
+        return self._sum(self.P * self.sqdiff)
+
+    def stat_glcm_dissimilarity(self):
+        return self._sum(self.P * self.absdiff)
+
+    def stat_glcm_energy(self):
+        return self._sum(np.square(self.P))
+
+    def stat_glcm_homogeneity(self):
+        return self._sum(self.P / (1 + self.sqdiff))
+
+    def stat_glcm_homogeneity1(self):
+        return self._sum(self.P / (1 + self.absdiff))
+
+    def stat_glcm_autocorrelation(self):
+        return self._sum(self.P * self.x * self.y)
+
+    def stat_glcm_clusterprominence(self):
+        return self._sum(np.power(self.cluster_offset, 4) * self.P)
+
+    def stat_glcm_clustershade(self):
+        return self._sum(np.power(self.cluster_offset, 3) * self.P)
+
+    def stat_glcm_clustertendency(self):
+        return self._sum(np.square(self.cluster_offset) * self.P)
+
+    def stat_glcm_correlation(self):
+        # the kernel subtracts mean_Px*mean_Py once for every matrix entry
+        numerator = self._sum(self.P * self.x * self.y) - self.nlevels*self.nlevels*self.mean_Px*self.mean_Py
+        return numerator / (np.sqrt(self.variance_Px) * np.sqrt(self.variance_Py))
+
+    def stat_glcm_sumentropy(self):
+        return _entropy(self.Pxplusy[:, 2:], axis=1)
+
+    def stat_glcm_differenceentropy(self):
+        return _entropy(self.Pxminusy, axis=1)
+
+    def stat_glcm_entropy(self):
+        return self.HXY
+
+    def stat_glcm_avgintensity(self):
+        return self.mean_Px
+
+    def stat_glcm_differenceavg(self):
+        return np.sum(np.arange(self.nlevels) * self.counts_xminusy, axis=1)
+
+    def stat_glcm_differencevariance(self):
+        # the kernel weights every k by (1-DA)^2
+        return np.square(1 - self.stat_glcm_differenceavg()) * np.sum(self.counts_xminusy, axis=1)
+
+    def stat_glcm_imc1(self):
+        return (self.HXY - self.HXY1) / np.maximum(self.HX, self.HY)
+
+    def stat_glcm_imc2(self):
+        return np.sqrt(1 - np.exp(-2*(self.HXY2 - self.HXY)))
+
+    def stat_glcm_idm(self):
+        return self._sum(self.counts / (1 + self.sqdiff))
+
+    def stat_glcm_idmn(self):
+        # GLCM_SIZE expands to NBINS*NBINS without parentheses: (d^2/NBINS)*NBINS
+        return self._sum(self.P / (1 + (self.sqdiff/self.nlevels)*self.nlevels))
+
+    def stat_glcm_id(self):
+        return self._sum(self.counts / (1 + self.absdiff))
+
+    def stat_glcm_idn(self):
+        # GLCM_SIZE expands to NBINS*NBINS without parentheses: (|d|/NBINS)*NBINS
+        return self._sum(self.P / (1 + (self.absdiff/self.nlevels)*self.nlevels))
+
+    def stat_glcm_inversevariance(self):
+        with np.errstate(divide='ignore'):
+            weights = np.where(self.diff != 0, 1/self.sqdiff, 0)
+        return self._sum(self.P * weights)
+
+    def stat_glcm_maxprob(self):
+        return np.max(self.P.reshape((self.nmatrices, -1)), axis=1)
+
+    def stat_glcm_sumavg(self):
+        return np.sum(self.sum_k * self.Pxplusy[:, 2:], axis=1)
+
+    def stat_glcm_sumvariance(self):
+        # the kernel centers on the sum entropy rather than the sum average
+        SE = self.stat_glcm_sumentropy().reshape((-1, 1))
+        return np.sum(np.square(self.sum_k - SE) * self.Pxplusy[:, 2:], axis=1)
+
+    def stat_glcm_sumvariance2(self):
+        return self.stat_glcm_sumvariance()
+
+    def stat_glcm_sumsquares(self):
+        return self._sum(np.square(self.y - self._per_entry(self.mean_Px)) * self.P)
+
+def glcm_stats(counts, stat_names):
+    """evaluate one or more named statistics on a block of glcm counts, see GLCMStatistics.evaluate()"""
+    return GLCMStatistics(counts).evaluate(stat_names)
+
+
+class SparseGLCMStatistics(GLCMStatistics):
+    """Evaluates the stat_glcm_* statistics on sparse co-occurence counts stored as (matrix, i, j, count) triplets
+
+    Only the level pairs that occur in a patch are stored (see glcm_triplets()), so memory and time scale with the
+    number of voxels per patch rather than with nlevels^2, which matters for fine QMODE_FIXEDHU binwidths. Every
+    matrix entry term of GLCMStatistics is a vector over the triplets here and sums over the entries of a matrix
+    become bincounts over the matrix index, so the formulas and kernel quirks are shared. Only stat_glcm_imc2
+    differs by the log(0) guard eps: its HXY2 term is evaluated as HX + HY, which avoids the dense outer product
+    of the marginals.
+    """
+    def __init__(self, triplets, nmatrices, nlevels):
+        """
+        Args:
+            triplets  -- (matrix, i, j, count) ndarrays, see glcm_triplets()
+            nmatrices -- number of matrices N, matrix indices are in [0, N)
+            nlevels   -- number of quantization levels
+        """
+        matrix, i, j, counts = triplets
+        self.squeeze = False
+        self.matrix = np.asarray(matrix, dtype=np.int64)
+        self.counts = np.asarray(counts, dtype=np.float64)
+        self.nmatrices, self.nlevels = nmatrices, nlevels
+        self._terms = {}
+
+        # weights of every triplet, i indexes rows (y) and j columns (x)
+        self.y = np.asarray(i, dtype=np.float64)
+        self.x = np.asarray(j, dtype=np.float64)
+        self.diff = self.y - self.x
+        self.sqdiff = np.square(self.diff)
+        self.absdiff = np.abs(self.diff)
+
+    def _sum(self, weighted):
+        return np.bincount(self.matrix, weights=weighted, minlength=self.nmatrices)
+
+    def _per_entry(self, values):
+        return values[self.matrix]
+
+    def _marginal_by(self, matrices, index, length):
+        """sum the entries of each matrix that share the same integer index
+
+        Returns:
+            (matrix index, index, sum) of every occuring (matrix, index) combination and the position of the
+            combination of every triplet
+        """
+        keys, inverse = np.unique(self.matrix*length + index, return_inverse=True)
+        inverse = inverse.ravel()
+        return keys // length, keys % length, np.bincount(inverse, weights=matrices), inverse
+
+    def _marginal_entropy(self, marginal, first=0):
+        """entropy of the marginal entries with index >= first, see _entropy()"""
+        matrix, index, probs = marginal[:3]
+        weights = np.where(index >= first, probs * np.log2(probs + eps), 0)
+        return -np.bincount(matrix, weights=weights, minlength=self.nmatrices)
+
+    @_lazy
+    def Px(self):
+        return self._marginal_by(self.P, self.y.astype(np.int64), self.nlevels)
+
+    @_lazy
+    def Py(self):
+        return self._marginal_by(self.P, self.x.astype(np.int64), self.nlevels)
+
+    @_lazy
+    def Pxplusy(self):
+        return self._marginal_by(self.P, (self.y + self.x).astype(np.int64), 2*self.nlevels-1)
+
+    @_lazy
+    def Pxminusy(self):
+        return self._marginal_by(self.P, self.absdiff.astype(np.int64), self.nlevels)
+
+    @_lazy
+    def HX(self):
+        return self._marginal_entropy(self.Px)
+
+    @_lazy
+    def HY(self):
+        return self._marginal_entropy(self.Py)
+
+    @_lazy
+    def HXY(self):
+        return -self._sum(self.P * np.log2(self.P + eps))
+
+    @_lazy
+    def HXY1(self):
+        # the marginal probabilities of the row and the column of every triplet
+        PxPy = self.Px[2][self.Px[3]] * self.Py[2][self.Py[3]]
+        return -self._sum(self.P * np.log2(PxPy + eps))
+
+    @_lazy
+    def HXY2(self):
+        return self.HX + self.HY
+
+    def stat_glcm_sumentropy(self):
+        return self._marginal_entropy(self.Pxplusy, first=2)
+
+    def stat_glcm_differenceentropy(self):
+        return self._marginal_entropy(self.Pxminusy)
+
+    def stat_glcm_differenceavg(self):
+        return self._sum(self.absdiff * self.counts)
+
+    def stat_glcm_differencevariance(self):
+        return np.square(1 - self.stat_glcm_differenceavg()) * self._sum(self.counts)
+
+    def stat_glcm_maxprob(self):
+        maxprob = np.zeros(self.nmatrices)
+        np.maximum.at(maxprob, self.matrix, self.P)
+        return maxprob
+
+    def _sum_marginal(self, weights):
+        """sum of weights(k) * P(x+y=k) over k in [2, 2L-2] for every matrix"""
+        matrix, k, probs = self.Pxplusy[:3]
+        return np.bincount(matrix, weights=np.where(k >= 2, weights(k, matrix) * probs, 0),
+                           minlength=self.nmatrices)
+
+    def stat_glcm_sumavg(self):
+        return self._sum_marginal(lambda k, matrix: k)
+
+    def stat_glcm_sumvariance(self):
+        SE = self.stat_glcm_sumentropy()
+        return self._sum_marginal(lambda k, matrix: np.square(k - SE[matrix]))
+
+def glcm_triplets(patches, nlevels, directions, symmetric=False, boundary='mirror', double_diagonal=False):
+    """sparse co-occurence counts of a block of quantized patches for several offsets
+
+    Only the (reference level i, neighbor level j) combinations that occur are stored, at most one per voxel
+    pair of each patch, so memory does not grow with nlevels^2 as for glcm_matrix_directions().
+
+    Args:
+        patches    -- integer ndarray of shape (N, pz, py, px) holding levels in [0, nlevels)
+        nlevels    -- number of quantization levels
+        directions -- list of (dx, dy, dz) offsets
+    Optional Args:
+        symmetric, boundary, double_diagonal -- see glcm_matrix_directions()
+    Returns:
+        (matrix, i, j, count) ndarrays sorted by matrix, with matrix = d*N + n indexing the matrices in the order
+        of glcm_matrix_directions(), for use with SparseGLCMStatistics
+    """
+    n = patches.shape[0]
+    flat_patches = patches.reshape((n, -1)).astype(np.int64)
+    keys = []
+    for d, (dx, dy, dz) in enumerate(directions):
+        reference, neighbor = glcm_pair_indices(patches.shape[1:], dx, dy, dz, boundary)
+        matrix = (d*n + np.arange(n)).reshape((-1, 1))*nlevels*nlevels
+        reference_levels, neighbor_levels = flat_patches[:, reference], flat_patches[:, neighbor]
+        keys.append((matrix + reference_levels*nlevels + neighbor_levels).ravel())
+        if symmetric:
+            opposite = matrix + neighbor_levels*nlevels + reference_levels
+            if not double_diagonal:
+                opposite = opposite[reference_levels != neighbor_levels]
+            keys.append(opposite.ravel())
+    keys, counts = np.unique(np.concatenate(keys), return_counts=True)
+    matrix, entry = np.divmod(keys, nlevels*nlevels)
+    i, j = np.divmod(entry, nlevels)
+    return matrix, i, j, counts
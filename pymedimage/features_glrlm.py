@@ -0,0 +1,247 @@
+"""features_glrlm.py
+
+Vectorized CPU construction of gray level run-length matrices (GLRLM) for blocks of quantized patches
+"""
+import logging
+import math
+import numpy as np
+
+# initialize module logger
+logger = logging.getLogger(__name__)
+
+def max_run_length(radius, z_radius):
+    """number of run-length columns of the GLRLM, as MAXRUNLENGTH set by features_gpu.image_iterator_gpu"""
+    return int(math.ceil(math.sqrt(2*(radius*2+1)*(radius*2+1) + (z_radius*2+1))))
+
+def glrlm_lines(patch_shape, dx=0, dy=0, dz=0):
+    """flat patch indices of every line traversed by runs in direction (dx, dy, dz)
+
+    Returns:
+        int ndarray of shape (nlines, maxlen) holding the voxels of each line in increasing flat index order,
+        padded with -1
+    """
+    pz, py, px = patch_shape
+    z, y, x = np.indices(patch_shape).reshape((3, -1))
+    inside = lambda z, y, x: (z >= 0) & (z < pz) & (y >= 0) & (y < py) & (x >= 0) & (x < px)
+    # lines start at the voxels without a predecessor in the patch
+    is_start = ~inside(z-dz, y-dy, x-dx)
+    z, y, x = z[is_start], y[is_start], x[is_start]
+    maxlen = max(pz, py, px)
+    lines = np.full((len(z), maxlen), -1, dtype=np.int64)
+    for i in range(maxlen):
+        valid = inside(z, y, x)
+        lines[valid, i] = np.ravel_multi_index((z[valid], y[valid], x[valid]), patch_shape)
+        z, y, x = z+dz, y+dy, x+dx
+    if dz*py*px + dy*px + dx < 0:
+        # runs walk towards decreasing flat indices
+        lines = np.where(lines >= 0, lines, np.iinfo(np.int64).max)
+        lines = np.sort(lines, axis=1)
+        lines[lines == np.iinfo(np.int64).max] = -1
+    return lines
+
+def glrlm_matrix_batch(patches, nlevels, dx=0, dy=0, dz=0, maxrunlength=None):
+    """run-length matrices for a block of quantized patches, matching glrlm_matrix of local_features.cuh
+
+    Patch voxels are gathered into the lines along (dx, dy, dz) and the boundaries of every maximal run of
+    equal levels are found for the whole block at once with diff/cumsum. The runs are then counted with the
+    semantics of the CUDA kernel, which starts runs in flat index order and limits the walk from each start to
+    MAXRUNLENGTH-2 steps:
+        - a run of length m along a direction of increasing flat index is counted as m//(MAXRUNLENGTH-1)
+          runs of length MAXRUNLENGTH-1 and one run of the remaining length
+        - along a direction of decreasing flat index the first voxel of the run is counted as a run of length
+          1 and each following voxel as a run of length 2
+        - for (dx, dy, dz) = (0, 0, 0) every voxel is counted as a run of length 2
+    As in the kernel, column rl of the matrix holds the runs of length rl so that column 0 is never used.
+
+    Args:
+        patches   -- integer ndarray of shape (N, pz, py, px) holding levels in [0, nlevels)
+        nlevels   -- number of quantization levels, sets the number of matrix rows
+    Optional Args:
+        maxrunlength -- number of matrix columns, defaults to max_run_length() of the patch size
+    Returns:
+        ndarray of shape (N, nlevels, maxrunlength)
+    """
+    n = patches.shape[0]
+    pz, py, px = patches.shape[1:]
+    if maxrunlength is None:
+        maxrunlength = max_run_length(py//2, pz//2)
+    cap = max(1, maxrunlength-1)
+    flat_patches = patches.reshape((n, -1)).astype(np.int64)
+    matrix_index = np.arange(n).reshape((-1, 1))*nlevels*maxrunlength
+
+    if dx == 0 and dy == 0 and dz == 0:
+        keys = (matrix_index + flat_patches*maxrunlength + min(2, cap)).ravel()
+        counts = np.bincount(keys, minlength=n*nlevels*maxrunlength)
+        return counts.reshape((n, nlevels, maxrunlength)).astype(np.float64)
+
+    lines = glrlm_lines((pz, py, px), dx, dy, dz)
+    valid = np.broadcast_to(lines >= 0, (n, *lines.shape))
+    levels = np.where(valid, flat_patches[:, np.maximum(lines, 0)], -1)
+
+    # detect run boundaries along each line
+    run_start = valid.copy()
+    run_start[:, :, 1:] &= (np.diff(levels, axis=2) != 0)
+    run_start = run_start.ravel()
+    run_id = np.cumsum(run_start) - 1
+    run_length = np.bincount(run_id[valid.ravel()])
+    run_level = levels.ravel()[run_start]
+    run_matrix = np.nonzero(run_start)[0] // (lines.size)
+    row_key = matrix_index.ravel()[run_matrix] + run_level*maxrunlength
+
+    if dz*py*px + dy*px + dx > 0:
+        remainder = run_length % cap
+        keys = np.concatenate((row_key + cap, row_key[remainder > 0] + remainder[remainder > 0]))
+        weights = np.concatenate((run_length // cap, np.ones(np.count_nonzero(remainder))))
+    else:
+        keys = np.concatenate((row_key + 1, row_key + min(2, cap)))
+        weights = np.concatenate((np.ones(len(row_key)), run_length - 1))
+    counts = np.bincount(keys, weights=weights, minlength=n*nlevels*maxrunlength)
+    return counts.reshape((n, nlevels, maxrunlength))
+
+
+####################################################################################################
+# GLRLM STATISTICS
+####################################################################################################
+# arbitrarily small number used to alleviate log(0) errors as log(0+eps), as in local_features.cuh
+eps = 1e-16
+
+def _lazy(method):
+    """evaluate a GLRLMStatistics term on first access only, sharing it between all statistics"""
+    name = method.__name__
+    def getter(self):
+        if name not in self._terms:
+            self._terms[name] = method(self)
+        return self._terms[name]
+    getter.__doc__ = method.__doc__
+    return property(getter)
+
+class GLRLMStatistics:
+    """Evaluates the stat_glrlm_* statistics of local_features.cuh on a block of run-length matrices
+
+    Formulas follow the CUDA kernels exactly: the weights use (rl+1) for the run length of column rl and
+    (level+1) for the level of each row, and the normalized variants (glnn, rlnn) divide by the sum of the
+    squared counts.
+    """
+    def __init__(self, counts, patch_size=None):
+        """
+        Args:
+            counts     -- run-length counts of shape (N, L, MAXRUNLENGTH) or (L, MAXRUNLENGTH), see
+                          glrlm_matrix_batch()
+        Optional Args:
+            patch_size -- number of voxels in each patch, required by stat_glrlm_rp only
+        """
+        counts = np.asarray(counts, dtype=np.float64)
+        self.squeeze = (counts.ndim == 2)
+        self.counts = counts.reshape((-1, *counts.shape[-2:]))
+        self.nmatrices, self.nlevels, self.maxrunlength = self.counts.shape
+        self.patch_size = patch_size
+        self._terms = {}
+
+        # weight arrays indexed as [y, x] == [level, run length]
+        self.y = np.arange(1, self.nlevels+1, dtype=np.float64).reshape((-1, 1))
+        self.x = np.arange(1, self.maxrunlength+1, dtype=np.float64).reshape((1, -1))
+
+    @staticmethod
+    def available():
+        """names of all statistics that can be evaluated"""
+        return sorted(name for name in dir(GLRLMStatistics) if name.startswith('stat_glrlm_'))
+
+    def evaluate(self, stat_names):
+        """evaluate each named statistic for every matrix
+
+        Args:
+            stat_names -- name or list of names with or without the 'stat_glrlm_' prefix, e.g. 'sre'
+        Returns:
+            ndarray of shape (N,) for a single name or (N, len(stat_names)) for a list
+        """
+        single = isinstance(stat_names, str)
+        if single:
+            stat_names = [stat_names]
+        results = np.empty((self.nmatrices, len(stat_names)))
+        for i, name in enumerate(stat_names):
+            if not name.startswith('stat_glrlm_'):
+                name = 'stat_glrlm_' + name
+            if name not in self.available():
+                raise ValueError('unknown glrlm statistic "{!s}". must be one of {!s}'.format(name, self.available()))
+            results[:, i] = getattr(self, name)()
+        if single:
+            results = results[:, 0]
+        if self.squeeze:
+            results = results[0]
+        return results
+
+    def _sum(self, weighted):
+        return np.sum(weighted, axis=(1, 2))
+
+    # SHARED TERMS
+    @_lazy
+    def sumP(self):
+        return self._sum(self.counts)
+
+    @_lazy
+    def sumSqP(self):
+        return self._sum(np.square(self.counts))
+
+    @_lazy
+    def P(self):
+        """normalized run probabilities"""
+        return self.counts / self.sumP.reshape((-1, 1, 1))
+
+    # STATISTICS
+    def stat_glrlm_sre(self):
+        return self._sum(self.counts / np.square(self.x)) / self.sumP
+
+    def stat_glrlm_lre(self):
+        return self._sum(self.counts * np.square(self.x)) / self.sumP
+
+    def stat_glrlm_gln(self):
+        return np.sum(np.square(np.sum(self.counts, axis=2)), axis=1) / self.sumP
+
+    def stat_glrlm_glnn(self):
+        return np.sum(np.square(np.sum(self.counts, axis=2)), axis=1) / self.sumSqP
+
+    def stat_glrlm_rln(self):
+        return np.sum(np.square(np.sum(self.counts, axis=1)), axis=1) / self.sumP
+
+    def stat_glrlm_rlnn(self):
+        return np.sum(np.square(np.sum(self.counts, axis=1)), axis=1) / self.sumSqP
+
+    def stat_glrlm_rp(self):
+        if self.patch_size is None:
+            raise ValueError('patch_size must be specified to evaluate stat_glrlm_rp')
+        return self.sumP / self.patch_size
+
+    def stat_glrlm_glv(self):
+        # the kernel scales each entry's mean by the entry itself: mu_i = P_i * sum_j(y_j)
+        mu = self.P * (np.sum(self.y) * self.maxrunlength)
+        return self._sum(self.P * np.square(self.y - mu))
+
+    def stat_glrlm_rv(self):
+        mu = self.P * (np.sum(self.x) * self.nlevels)
+        return self._sum(self.P * np.square(self.x - mu))
+
+    def stat_glrlm_re(self):
+        return -self._sum(self.P * np.log2(self.P + eps))
+
+    def stat_glrlm_lglre(self):
+        return self._sum(self.counts / np.square(self.y)) / self.sumP
+
+    def stat_glrlm_hglre(self):
+        return self._sum(self.counts * np.square(self.y)) / self.sumP
+
+    def stat_glrlm_srlgle(self):
+        # the kernel combines level and run length as a sum rather than a product
+        return self._sum(self.counts / np.square(self.y + self.x)) / self.sumP
+
+    def stat_glrlm_srhgle(self):
+        return self._sum(self.counts * np.square(self.y) / np.square(self.x)) / self.sumP
+
+    def stat_glrlm_lrlglre(self):
+        return self._sum(self.counts * np.square(self.x) / np.square(self.y)) / self.sumP
+
+    def stat_glrlm_lrhglre(self):
+        return self._sum(self.counts * np.square(self.y + self.x)) / self.sumP
+
+def glrlm_stats(counts, stat_names, patch_size=None):
+    """evaluate one or more named statistics on a block of glrlm counts, see GLRLMStatistics.evaluate()"""
+    return GLRLMStatistics(counts, patch_size).evaluate(stat_names)
@@ -4,6 +4,7 @@ import logging
 import math
 import numpy as np
 from pymedimage.rttypes import MaskableVolume
+from pymedimage import quantization, features_morphology
 from pymedimage.quantization import QMODE_STAT, QMODE_FIXEDHU
 import warnings
 
@@ -19,6 +20,9 @@ pycuda.compiler.DEFAULT_NVCC_FLAGS = ['--std=c++11']
 # set default nvidia device number
 NVDEVICE = 1
 
+# kernels of local_features.cuh that quantize their patches, all others compute on the raw intensities
+QUANTIZING_KERNELS = ('kernel_glcm', 'kernel_glrlm', 'kernel_fo_entropy', 'kernel_fo_uniformity')
+
 # initialize module logger
 logger = logging.getLogger(__name__)
 
@@ -94,13 +98,40 @@ def elementwiseMin_gpu(feature_volume_list):
 def image_iterator_gpu(image_volume, roi=None, radius=2, gray_levels=None, binwidth=None, dx=1, dy=0, dz=0, ndev=2,
                        cadd=(0,0,0), sadd=3, csub=(0,0,0), ssub=3, i=0,
                        fixed_start=-250, fixed_end=350,
-             feature_kernel='kernel_glcm', stat_name='stat_glcm_contrast'):
+             feature_kernel='kernel_glcm', stat_name='stat_glcm_contrast', body_threshold='auto', fill_value=-1):
     """Uses PyCuda to parallelize the computation of the voxel-wise image entropy using a variable \
             neighborhood radius
 
     Args:
 	radius -- neighborhood radius; where neighborhood size is isotropic and calculated as 2*radius+1
+    Optional Args:
+        body_threshold -- without an roi, only run the kernel on the bounding box of the body mask of the image
+                          (see features_morphology.body_mask) plus the neighborhood radius, and set the voxels
+                          outside of the mask to fill_value as data_handling.expand_pruned_vector does. The
+                          default 'auto' masks CT BaseVolumes only, see features_morphology.resolve_body_threshold
     """
+    if not roi:
+        body_threshold = features_morphology.resolve_body_threshold(image_volume, body_threshold)
+    if body_threshold is not None and not roi:
+        array = image_volume if isinstance(image_volume, np.ndarray) else image_volume.data
+        volume_shape = (-1, *array.shape[-2:])
+        mask = features_morphology.body_mask(image_volume, body_threshold).reshape(volume_shape)
+        result = np.full(mask.shape, fill_value, dtype=np.float32)
+        if np.any(mask):
+            halo = (radius if mask.shape[0] > 1 else 0, radius, radius)
+            crop = tuple(slice(max(0, int(np.min(v))-h), min(n, int(np.max(v))+1+h))
+                         for v, h, n in zip(np.nonzero(mask), halo, mask.shape))
+            # the crop keeps every voxel the neighborhoods of the masked voxels reach
+            cropped = image_iterator_gpu(np.ascontiguousarray(array.reshape(volume_shape)[crop]), None, radius,
+                                         gray_levels, binwidth, dx, dy, dz, ndev, cadd, sadd, csub, ssub, i,
+                                         fixed_start, fixed_end, feature_kernel, stat_name)
+            result[crop] = np.where(mask[crop], np.reshape(cropped, mask[crop].shape), fill_value)
+        result = result.reshape(array.shape)
+        if isinstance(image_volume, np.ndarray):
+            return result
+        outvolume = MaskableVolume().fromArray(result, image_volume.frameofreference)
+        outvolume.modality = image_volume.modality
+        return outvolume
     # initialize cuda context
     cuda.init()
     cudacontext = cuda.Device(NVDEVICE).make_context()
@@ -162,6 +193,17 @@ def image_iterator_gpu(image_volume, roi=None, radius=2, gray_levels=None, binwi
         gray_levels = -1
         binwidth = -1
 
+    if quantize_mode == QMODE_FIXEDHU and feature_kernel in QUANTIZING_KERNELS:
+        # fixed bins don't depend on the patch: quantize the whole volume once (memoized on the volume and shared
+        # by every feature definition) and skip the per-patch quantization in the kernel. Kernels that don't
+        # quantize keep the raw intensities
+        if toBaseVolume and not roi:
+            image = quantization.quantize_volume(image_volume, binwidth=binwidth, fixed_start=fixed_start,
+                                                 fixed_end=fixed_end).reshape(image.shape)
+        else:
+            image = quantization.quantizeFixed(image, binwidth, fixed_start, fixed_end)
+        quantize_mode = -1
+
     maxrunlength = math.ceil(math.sqrt(2*(radius*2+1)*(radius*2+1) + (z_radius*2+1)))
 
     cuda_source = cuda_template.substitute({'RADIUS': radius,
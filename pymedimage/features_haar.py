@@ -0,0 +1,105 @@
+"""features_haar.py
+
+Haar-like block features of every voxel evaluated from a single 3D summed-volume table
+"""
+import logging
+import numpy as np
+
+# initialize module logger
+logger = logging.getLogger(__name__)
+
+def summed_volume_table(array):
+    """3D summed-volume (integral image) table of array
+
+    table[z, y, x] holds the sum of array[:z, :y, :x], so the table has one more entry than array along each
+    axis. Integer volumes are summed exactly in int64, all others in float64.
+
+    Returns:
+        ndarray of shape (d+1, r+1, c+1)
+    """
+    dtype = np.int64 if np.issubdtype(array.dtype, np.integer) else np.float64
+    table = np.zeros(tuple(s+1 for s in array.shape), dtype=dtype)
+    np.cumsum(array, axis=0, dtype=dtype, out=table[1:, 1:, 1:])
+    np.cumsum(table[1:, 1:, 1:], axis=1, out=table[1:, 1:, 1:])
+    np.cumsum(table[1:, 1:, 1:], axis=2, out=table[1:, 1:, 1:])
+    return table
+
+def pad_table(table, margin):
+    """extend a summed-volume table by margin entries along each axis so that block corners beyond the volume
+    can be looked up without clipping. Edge replication of the table equals summing the zeros padded around
+    the volume
+    """
+    return np.pad(table, [(margin, margin)]*table.ndim, mode='edge')
+
+def block_sums(table, start, stop, offset, size, margin=0):
+    """sum of the zero-padded volume within the block at offset from each voxel of the region [start, stop)
+
+    Each block sum is evaluated with 8 lookups into the summed-volume table, one strided slice per corner.
+
+    Args:
+        table  -- summed-volume table, see summed_volume_table(), extended by margin (see pad_table()) so that
+                  it covers every corner of the blocks
+        start, stop -- (z, y, x) bounds of the voxels
+        offset -- (z, y, x) offset of the first voxel of the block from each voxel
+        size   -- (z, y, x) extents of the block
+    Returns:
+        ndarray with the shape of the region
+    """
+    lo = [s + o + margin for s, o in zip(start, offset)]
+    extent = [int(e-s) for s, e in zip(start, stop)]
+    if min(min(lo), *(table.shape[axis] - (lo[axis] + size[axis] + extent[axis]) for axis in range(3))) < 0:
+        raise ValueError('block exceeds the summed-volume table, increase margin')
+    sums = np.zeros(extent, dtype=table.dtype)
+    for corner in np.ndindex(2, 2, 2):
+        # inclusion-exclusion over the 8 corners of the block
+        sign = -1 if (3-sum(corner)) % 2 else 1
+        index = tuple(slice(l + c*n, l + c*n + e) for l, c, n, e in zip(lo, corner, size, extent))
+        if sign > 0:
+            sums += table[index]
+        else:
+            sums -= table[index]
+    return sums
+
+def _block_geometry(center, side, is_2d):
+    """(z, y, x) offset and size of the block of the given side length centered at center=(x, y, z)"""
+    cx, cy, cz = center
+    if is_2d:
+        return (0, cy - side//2, cx - side//2), (1, side, side)
+    return (cz - side//2, cy - side//2, cx - side//2), (side, side, side)
+
+def haar_bank(table, configurations, start, stop, is_2d=False):
+    """evaluate a bank of Haar-like features from one summed-volume table
+
+    Each configuration (cadd, sadd, csub, ssub) describes the mean intensity of the block of side length sadd
+    centered at offset cadd=(x, y, z) from every voxel, minus the mean intensity of the block (csub, ssub). For
+    one-block features csub and ssub are None. As in image_iterator, voxels beyond the volume count as zeros.
+
+    Args:
+        table          -- summed-volume table, see summed_volume_table()
+        configurations -- list of (cadd, sadd, csub, ssub) tuples
+        start, stop    -- (z, y, x) bounds of the voxels for which the features are evaluated
+    Optional Args:
+        is_2d          -- blocks only extend within the plane of each voxel
+    Returns:
+        ndarray of shape (len(configurations), *region shape)
+    """
+    geometries = []
+    for cadd, sadd, csub, ssub in configurations:
+        blocks = [_block_geometry(cadd, sadd, is_2d)]
+        if ssub:
+            blocks.append(_block_geometry(csub, ssub, is_2d))
+        geometries.append(blocks)
+    # extend the table once so that every block of the bank is looked up with plain slices
+    margin = max(max(max(-x for x in offset), max(x+n for x, n in zip(offset, size)))
+                 for blocks in geometries for offset, size in blocks)
+    margin = max(0, int(margin))
+    table = pad_table(table, margin)
+
+    results = np.empty((len(configurations), *[int(e-s) for s, e in zip(start, stop)]))
+    for i, blocks in enumerate(geometries):
+        offset, size = blocks[0]
+        results[i] = block_sums(table, start, stop, offset, size, margin) / np.prod(size)
+        if len(blocks) > 1:
+            offset, size = blocks[1]
+            results[i] -= block_sums(table, start, stop, offset, size, margin) / np.prod(size)
+    return results
@@ -0,0 +1,115 @@
+"""features_morphology.py
+
+Local minimum/maximum filters of zero-padded neighborhoods using the van Herk/Gil-Werman algorithm, and the
+foreground (body) mask of CT volumes used to skip the air around the patient
+"""
+import logging
+import numpy as np
+import scipy.ndimage
+
+# initialize module logger
+logger = logging.getLogger(__name__)
+
+def _vhgw_axis(array, radius, axis, ufunc):
+    """running ufunc (np.minimum or np.maximum) over windows of 2*radius+1 along one axis of array
+
+    The zero-padded axis is split into blocks of the window size. Within each block the prefix and suffix
+    extrema are accumulated, and every window spans the suffix of one block and the prefix of the next, so each
+    result takes a single comparison regardless of radius.
+    """
+    if radius == 0:
+        return array
+    width = 2*radius+1
+    array = np.moveaxis(array, axis, -1)
+    n = array.shape[-1]
+    nblocks = int(np.ceil((n + 2*radius) / width))
+    padded = np.pad(array, [(0, 0)]*(array.ndim-1) + [(radius, nblocks*width - n - radius)], mode='constant')
+    blocks = padded.reshape((*padded.shape[:-1], nblocks, width))
+    prefix = ufunc.accumulate(blocks, axis=-1).reshape(padded.shape)
+    suffix = ufunc.accumulate(blocks[..., ::-1], axis=-1)[..., ::-1].reshape(padded.shape)
+    result = ufunc(suffix[..., :n], prefix[..., width-1:width-1+n])
+    return np.moveaxis(result, -1, axis)
+
+def local_extremum(array, radius, z_radius, ufunc, start=None, stop=None):
+    """separable local extremum of every zero-padded (2*z_radius+1, 2*radius+1, 2*radius+1) neighborhood
+
+    Args:
+        array    -- 3d ndarray of voxel intensities
+        ufunc    -- np.minimum or np.maximum
+    Optional Args:
+        start, stop -- (z, y, x) bounds of the voxels for which the extremum is computed, defaults to all voxels
+    Returns:
+        ndarray with the shape of the bounded region
+    """
+    if start is None:
+        start = (0, 0, 0)
+    if stop is None:
+        stop = array.shape
+    halo = (z_radius, radius, radius)
+    # only the bounded region and its halo are filtered. Zeros padded at the edges of the halo only reach
+    # voxels outside the bounded region, so the result equals zero-padding of the whole array
+    lo = [max(0, s-h) for s, h in zip(start, halo)]
+    hi = [min(d, e+h) for e, h, d in zip(stop, halo, array.shape)]
+    result = array[tuple(slice(l, h) for l, h in zip(lo, hi))]
+    for axis, r in enumerate(halo):
+        result = _vhgw_axis(result, r, axis, ufunc)
+    return result[tuple(slice(s-l, e-l) for s, e, l in zip(start, stop, lo))]
+
+def local_min(array, radius, z_radius, start=None, stop=None):
+    """local minimum, see local_extremum()"""
+    return local_extremum(array, radius, z_radius, np.minimum, start, stop)
+
+def local_max(array, radius, z_radius, start=None, stop=None):
+    """local maximum, see local_extremum()"""
+    return local_extremum(array, radius, z_radius, np.maximum, start, stop)
+
+def local_range(array, radius, z_radius, start=None, stop=None):
+    """local maximum - local minimum, see local_extremum()"""
+    return (local_max(array, radius, z_radius, start, stop).astype(np.float64)
+            - local_min(array, radius, z_radius, start, stop))
+
+# default HU threshold separating the patient (and couch) from the surrounding air
+BODY_THRESHOLD = -500
+
+def foreground_mask(array, threshold=BODY_THRESHOLD):
+    """largest connected component of the voxels above threshold, with the holes of each axial slice filled
+
+    Holes are filled per slice so that air cavities connected to the outside through other slices (lungs,
+    airways, bowel) are still included.
+
+    Args:
+        array     -- 2d or 3d ndarray of intensities (HU for CT)
+    Optional Args:
+        threshold -- intensity separating foreground from background
+    Returns:
+        boolean ndarray with the shape of array
+    """
+    labels, nlabels = scipy.ndimage.label(array > threshold)
+    if nlabels == 0:
+        return np.zeros(array.shape, dtype=bool)
+    largest = np.argmax(np.bincount(labels.ravel())[1:]) + 1
+    structure = scipy.ndimage.generate_binary_structure(2, 1)
+    if array.ndim == 3:
+        # in-plane connectivity only fills each slice independently
+        structure = np.stack([np.zeros_like(structure), structure, np.zeros_like(structure)])
+    return scipy.ndimage.binary_fill_holes(labels == largest, structure=structure)
+
+def body_mask(image_volume, threshold=BODY_THRESHOLD):
+    """foreground_mask of a BaseVolume (memoized on the volume) or of an ndarray"""
+    if isinstance(image_volume, np.ndarray):
+        return foreground_mask(image_volume, threshold)
+    return image_volume.getDerivedData(('body_mask', threshold),
+                                       lambda: foreground_mask(image_volume.data, threshold))
+
+def resolve_body_threshold(image_volume, threshold='auto'):
+    """threshold of the body mask of an ROI-less feature run
+
+    'auto' selects BODY_THRESHOLD for BaseVolumes of CT modality, whose intensities are HU, and no body mask
+    (None) for ndarrays and other modalities, whose intensity scale is unknown. Any other threshold is returned
+    unchanged
+    """
+    if not (isinstance(threshold, str) and threshold == 'auto'):
+        return threshold
+    if isinstance(image_volume, np.ndarray) or str(getattr(image_volume, 'modality', None)).lower() != 'ct':
+        return None
+    return BODY_THRESHOLD
@@ -0,0 +1,151 @@
+"""features_shared.py
+
+Process-pool evaluation of local features on a single volume through shared memory
+
+The input volume and the feature output are placed in multiprocessing.shared_memory blocks. Worker processes
+attach to both once when they start, receive only the (start, stop) coordinates of the slabs they compute and
+write their results straight into the shared output, so neither the volume nor the results are pickled between
+processes. The result is returned in the shared block itself rather than gathered into a private copy.
+"""
+import logging
+import multiprocessing
+import weakref
+from multiprocessing import shared_memory
+import numpy as np
+
+# initialize module logger
+logger = logging.getLogger(__name__)
+
+class SharedArray:
+    """ndarray backed by a multiprocessing.shared_memory block
+
+    The process that creates the block owns it and unlinks it on close(), processes attaching to it by
+    spec only unmap it. release() hands the array of the block over to the caller instead.
+    """
+    def __init__(self, shape, dtype=np.float64, name=None):
+        self.shape = tuple(int(x) for x in shape)
+        self.dtype = np.dtype(dtype)
+        self._owner = name is None
+        nbytes = max(1, int(np.prod(self.shape)) * self.dtype.itemsize)
+        self._shm = shared_memory.SharedMemory(name=name, create=self._owner, size=nbytes)
+        self.array = np.ndarray(self.shape, dtype=self.dtype, buffer=self._shm.buf)
+
+    @classmethod
+    def fromArray(cls, array):
+        """copy array into a new shared memory block"""
+        shared = cls(array.shape, array.dtype)
+        shared.array[...] = array
+        return shared
+
+    @classmethod
+    def attach(cls, spec):
+        """attach to the block of another process, see spec"""
+        name, shape, dtype = spec
+        return cls(shape, dtype, name=name)
+
+    @property
+    def spec(self):
+        """picklable (name, shape, dtype) description used to attach to the block"""
+        return (self._shm.name, self.shape, self.dtype.str)
+
+    def close(self):
+        if self._shm is None:
+            # released
+            return
+        self.array = None
+        self._shm.close()
+        if self._owner:
+            self._shm.unlink()
+
+    def release(self):
+        """return the array of the block and give up ownership of the block to it
+
+        The owner unlinks the name of the block right away, so no other process can attach to it any more and it
+        cannot outlive this process. The mapping stays valid until the array and every view of it are garbage
+        collected, then it is unmapped and the memory is freed. close() does nothing afterwards.
+        """
+        array = self.array
+        if self._owner:
+            self._shm.unlink()
+        weakref.finalize(array, self._shm.close)
+        self.array = None
+        self._shm = None
+        return array
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def slabs(start, stop, nslabs):
+    """split the region [start, stop) into at most nslabs slabs along z, or along y for single slice regions
+
+    Returns:
+        (axis, list of (slab_start, slab_stop))
+    """
+    extents = np.subtract(stop, start)
+    axis = 0 if extents[0] > 1 else 1
+    nslabs = max(1, min(nslabs, int(extents[axis])))
+    bounds = np.linspace(start[axis], stop[axis], nslabs+1).astype(int)
+    result = []
+    for lo, hi in zip(bounds[:-1], bounds[1:]):
+        slab_start, slab_stop = list(start), list(stop)
+        slab_start[axis], slab_stop[axis] = int(lo), int(hi)
+        result.append((tuple(slab_start), tuple(slab_stop)))
+    return axis, result
+
+# state of each worker process, set once by _init_worker
+_worker = None
+
+def _init_worker(compute_region, source_spec, output_spec, origin):
+    global _worker
+    _worker = (compute_region, SharedArray.attach(source_spec), SharedArray.attach(output_spec), origin)
+
+def _compute_slab(bounds):
+    """evaluate one slab in a worker process, writing the result into the shared output"""
+    compute_region, source, output, origin = _worker
+    slab_start, slab_stop = bounds
+    index = tuple(slice(b-o, e-o) for b, e, o in zip(slab_start, slab_stop, origin))
+    output.array[(Ellipsis, *index)] = compute_region(source.array, slab_start, slab_stop)
+    return bounds
+
+def map_slabs(compute_region, array, start, stop, leading_shape=(), processes=None, dtype=np.float64):
+    """evaluate compute_region(array, slab_start, slab_stop) on slabs of the region [start, stop) in a pool of
+    processes sharing array and the result through shared memory
+
+    compute_region is handed to the workers when they start. With the fork start method (the default on linux)
+    it is inherited and may be any callable, e.g. a closure over feature settings. Other start methods require
+    it to be picklable.
+
+    Args:
+        compute_region -- callable(array, slab_start, slab_stop) returning an ndarray of shape
+                          (*leading_shape, *slab shape)
+        array          -- ndarray read by compute_region, e.g. the image or its summed-volume table
+        start, stop    -- (z, y, x) bounds of the region
+    Optional Args:
+        leading_shape -- shape of the leading (per-output) axes of the results of compute_region
+        processes     -- number of worker processes, defaults to the number of cpus
+        dtype         -- dtype of the result
+    Returns:
+        ndarray of shape (*leading_shape, *region shape). With worker processes it is backed by the shared block
+        the workers wrote to (see SharedArray.release), which this process owns and frees once the array and its
+        views are garbage collected
+    """
+    if processes is None:
+        processes = multiprocessing.cpu_count()
+    region_shape = tuple(int(x) for x in np.subtract(stop, start))
+    if processes <= 1 or multiprocessing.current_process().daemon:
+        # daemonic processes (e.g. MultiprocessManager workers) cannot have children
+        return np.asarray(compute_region(array, tuple(start), tuple(stop)), dtype=dtype).reshape(
+            (*leading_shape, *region_shape))
+
+    _, slab_bounds = slabs(start, stop, processes)
+    with SharedArray.fromArray(np.ascontiguousarray(array)) as source, \
+            SharedArray((*leading_shape, *region_shape), dtype) as output:
+        with multiprocessing.Pool(processes=min(processes, len(slab_bounds)), initializer=_init_worker,
+                                  initargs=(compute_region, source.spec, output.spec, tuple(start))) as p:
+            for slab_start, slab_stop in p.imap_unordered(_compute_slab, slab_bounds):
+                logger.debug('computed slab {!s} -> {!s}'.format(slab_start, slab_stop))
+        # the results stay in the shared block, which is freed with the returned array
+        return output.release()
@@ -0,0 +1,164 @@
+"""features_tiled.py
+
+Out-of-core evaluation of local features in tiles read from (and written to) memory-mapped or HDF5 storage
+
+Each tile is read together with a halo of neighboring voxels so that every voxel in the tile sees the same
+neighborhood as it would in the full volume, and only the voxels of the tile itself are evaluated. Only one tile
+(plus halo) is in memory at any time.
+"""
+import os
+import logging
+import numpy as np
+import h5py
+from pymedimage.misc import g_indents, indent
+
+# initialize module logger
+logger = logging.getLogger(__name__)
+
+# indent shortnames
+l3 = g_indents[3]
+
+# name of the image dataset in HDF5 files written by BaseVolume.toHDF5
+HDF5_DATASET = 'arraydata'
+
+# default (z, y, x) shape of the tiles
+TILE_SHAPE = (16, 256, 256)
+
+def _open_source(source):
+    """get a sliceable array-like for source
+
+    Returns:
+        (array-like, HDF5 attributes or {}, open h5py.File or None)
+    """
+    if isinstance(source, str):
+        ext = os.path.splitext(source)[1].lower()
+        if ext == '.npy':
+            return np.load(source, mmap_mode='r'), {}, None
+        elif ext in ('.h5', '.hdf5'):
+            f = h5py.File(source, 'r')
+            return f[HDF5_DATASET], dict(f.attrs), f
+        raise ValueError('source file must be one of [.npy, .h5, .hdf5], not "{!s}"'.format(ext))
+    elif isinstance(source, h5py.Dataset):
+        return source, dict(source.file.attrs), None
+    return source, {}, None
+
+def _open_output(output, shape, dtype, attrs):
+    """get a writable array-like for output, creating the file if output is a path
+
+    HDF5 files are written in the layout of BaseVolume.toHDF5 (with the attributes of an HDF5 source) so that
+    the result can be restored with MaskableVolume.fromHDF5
+
+    Returns:
+        (array-like, open h5py.File or None)
+    """
+    if isinstance(output, str):
+        ext = os.path.splitext(output)[1].lower()
+        if ext == '.npy':
+            return np.lib.format.open_memmap(output, mode='w+', dtype=dtype, shape=shape), None
+        elif ext in ('.h5', '.hdf5'):
+            f = h5py.File(output, 'w')
+            for k, v in attrs.items():
+                f.attrs[k] = v
+            return f.create_dataset(HDF5_DATASET, shape=shape, dtype=dtype), f
+        raise ValueError('output file must be one of [.npy, .h5, .hdf5], not "{!s}"'.format(ext))
+    if tuple(output.shape) != tuple(shape):
+        raise ValueError('output shape {!s} does not match the source shape {!s}'.format(output.shape, shape))
+    return output, None
+
+def tiles(shape, tile_shape, halo):
+    """generate the tiles covering a volume of the given (z, y, x) shape
+
+    Yields:
+        (read_slices, tile_slices, crop_slices) where read_slices select the tile and its halo (clipped to the
+        volume), tile_slices select the tile in the volume and crop_slices select the tile within the read region
+    """
+    for tile_start in np.ndindex(*[int(np.ceil(s/t)) for s, t in zip(shape, tile_shape)]):
+        start = [i*t for i, t in zip(tile_start, tile_shape)]
+        stop = [min(s, b+t) for s, b, t in zip(shape, start, tile_shape)]
+        read_start = [max(0, b-h) for b, h in zip(start, halo)]
+        read_stop = [min(s, e+h) for s, e, h in zip(shape, stop, halo)]
+        yield (tuple(slice(b, e) for b, e in zip(read_start, read_stop)),
+               tuple(slice(b, e) for b, e in zip(start, stop)),
+               tuple(slice(b-r, e-r) for b, e, r in zip(start, stop, read_start)))
+
+def feature_halo(feature_function, radius, feature_args):
+    """voxels a feature reads around each voxel, as declared by feature_function.tile_halo (see
+    features.tile_halo) for features that chain neighborhood operations, and radius otherwise
+    """
+    halo_function = getattr(feature_function, 'tile_halo', None)
+    if halo_function is None:
+        return radius
+    return halo_function(radius, **feature_args)
+
+def tiled_feature(feature_function, source, output, radius=2, halo=None, tile_shape=TILE_SHAPE,
+                  dtype=np.float32, **feature_args):
+    """evaluate a local feature tile by tile, streaming the result into on-disk storage
+
+    see the output argument of features.image_iterator, glcm and glrlm for the tiled mode of those features
+
+    Args:
+        feature_function -- any local feature of the features module taking an ndarray, called as
+                            feature_function(image_volume=tile_array, radius=radius, roi=crop_slices,
+                            **feature_args) so that only the tile within the read region is evaluated. Features
+                            that return a list of volumes require a list of outputs
+        source           -- 2d/3d array-like supporting slicing (np.memmap, h5py.Dataset, ndarray) or the path of a
+                            .npy file (memory-mapped) or an .h5 file written by BaseVolume.toHDF5
+        output           -- writable array-like of the same shape or path of a .npy/.h5 file to create, or a list
+                            of either for multi-output features
+    Optional Args:
+        radius     -- neighborhood radius of the feature
+        halo       -- voxels read around each tile, by default (and at least) the halo the feature reads, see
+                      feature_halo (e.g. 2*radius for glcm with QMODE_STAT quantization)
+        tile_shape -- (z, y, x) shape of the tiles, which bounds peak memory
+        dtype      -- dtype of outputs created from a path
+    Returns:
+        output array-like (or list of them); opened files are closed and returned as their paths
+    """
+    source_array, attrs, source_file = _open_source(source)
+    try:
+        shape = tuple(source_array.shape)
+        if len(shape) == 2:
+            shape = (1, *shape)
+        required_halo = feature_halo(feature_function, radius, feature_args)
+        if halo is None:
+            halo = required_halo
+        elif halo < required_halo:
+            raise ValueError('{!s} reads {:d} voxels around each voxel, halo must be at least that, not {:d}'.format(
+                getattr(feature_function, '__name__', feature_function), required_halo, halo))
+        # independent axial slices (mode='2d') don't read neighboring slices
+        is_3d = shape[0] > 1 and feature_args.get('mode') != '2d'
+        halo = (halo if is_3d else 0, halo, halo)
+        if is_3d and radius > 0 and min(tile_shape[0], shape[0]) + 2*halo[0] <= 1:
+            raise ValueError('tiles of a 3d volume must extend over more than one slice')
+
+        multiple = isinstance(output, (list, tuple))
+        outputs = [_open_output(o, tuple(source_array.shape), dtype, attrs)
+                   for o in (output if multiple else [output])]
+        try:
+            ntiles = int(np.prod([np.ceil(s/t) for s, t in zip(shape, tile_shape)]))
+            for i, (read_slices, tile_slices, crop_slices) in enumerate(tiles(shape, tile_shape, halo)):
+                logger.debug(indent('tile {:d} of {:d}: {!s}'.format(i+1, ntiles, tile_slices), l3))
+                read_shape = [s.stop-s.start for s in read_slices]
+                tile_array = np.asarray(source_array[read_slices[3-source_array.ndim:]]).reshape(read_shape)
+                results = feature_function(image_volume=tile_array, radius=radius, roi=crop_slices,
+                                           **feature_args)
+                if not isinstance(results, list):
+                    results = [results]
+                if len(results) != len(outputs):
+                    raise ValueError('feature returned {:d} volumes for {:d} outputs'.format(len(results),
+                                                                                          len(outputs)))
+                for (output_array, _), result in zip(outputs, results):
+                    index = tile_slices[3-output_array.ndim:]
+                    output_array[index] = np.asarray(result).reshape([s.stop-s.start for s in index])
+        finally:
+            for output_array, output_file in outputs:
+                if isinstance(output_array, np.memmap):
+                    output_array.flush()
+                if output_file is not None:
+                    output_file.close()
+    finally:
+        if source_file is not None:
+            source_file.close()
+
+    returned = [o if isinstance(o, str) else a for o, (a, _) in zip((output if multiple else [output]), outputs)]
+    return returned if multiple else returned[0]
@@ -10,6 +10,16 @@ from abc import ABCMeta, abstractmethod
 # initialize module logger
 logger = logging.getLogger(__name__)
 
+def default_workers():
+    """number of threads used to parallelize work on a single volume
+
+    Worker processes of a MultiprocessManagerBase already run one job per core, so each of them uses a single
+    thread. All cores are used otherwise.
+    """
+    if multiprocessing.current_process().daemon:
+        return 1
+    return multiprocessing.cpu_count()
+
 class MultiprocessManagerBase:
     """Base class for multiprocessing with standard logging function and notifications"""
     __metaclass__ = ABCMeta
@@ -1,3 +1,7 @@
+import math
+import numpy as np
+import scipy.ndimage
+
 QMODE_FIXEDHU = 0
 QMODE_STAT = 1
 
@@ -16,3 +20,72 @@ def enforceGLCMQuantizationMode(feature_def, modality):
     #     # force glcm STAT based quantization
     #     del new_def.args['binwidth']
     return new_def
+
+def getFixedNBins(binwidth, fixed_start=-250, fixed_end=350):
+    """number of QMODE_FIXEDHU bins, including the outlier bins below fixed_start and above fixed_end"""
+    return int(math.floor((fixed_end-fixed_start)/binwidth)) + 2
+
+def _smallestUIntType(nbins):
+    return np.uint8 if nbins <= np.iinfo(np.uint8).max+1 else np.uint16
+
+def quantizeFixed(array, binwidth, fixed_start=-250, fixed_end=350):
+    """QMODE_FIXEDHU quantization matching _quantize_fixed in local_features.cuh
+
+    values below fixed_start fall in bin 0, values at or above fixed_end fall in the last bin
+    """
+    nbins = getFixedNBins(binwidth, fixed_start, fixed_end)
+    quantized = np.floor((np.asarray(array, dtype=np.float64)-fixed_start)/binwidth) + 1
+    return np.clip(quantized, 0, nbins-1).astype(_smallestUIntType(nbins))
+
+def quantizeStat(array, gray_levels, ndev=2, radius=2, z_radius=None):
+    """QMODE_STAT quantization of every voxel relative to the gaussian stats of its own neighborhood
+
+    The local mean and std. deviation (dof=1, as in _quantize_stat in local_features.cuh) of the zero-padded
+    (2*radius+1) neighborhood are computed for all voxels at once with box filters. Unlike the per-patch
+    quantization of the GPU kernels, each voxel is binned by the stats of the neighborhood centered on it,
+    so one quantized volume can be shared by every patch. z_radius=0 takes the stats of in-plane neighborhoods
+    only, for slices that are evaluated independently.
+    """
+    array = np.asarray(array, dtype=np.float64)
+    size = [2*radius+1]*array.ndim
+    if array.ndim == 3 and (array.shape[0] == 1 or z_radius == 0):
+        size[0] = 1
+    n = np.prod(size)
+    local_mean = scipy.ndimage.uniform_filter(array, size, mode='constant', cval=0)
+    local_sqmean = scipy.ndimage.uniform_filter(array*array, size, mode='constant', cval=0)
+    local_std = np.sqrt(np.maximum(0, (local_sqmean - local_mean*local_mean) * n/(n-1)))
+    binwidth = 2*ndev*local_std / (gray_levels-2)
+    quantized = np.floor((array - local_mean + ndev*local_std)/(binwidth+1e-9)) + 1
+    return np.clip(quantized, 0, gray_levels-1).astype(_smallestUIntType(gray_levels))
+
+def quantize_volume(image_volume, binwidth=None, fixed_start=-250, fixed_end=350, gray_levels=None, ndev=2,
+                    radius=2, z_radius=None):
+    """quantize an entire volume once for use by all GLCM/GLRLM features
+
+    For BaseVolumes the result is memoized on the volume, keyed by the quantization parameters, so each
+    feature definition computed on the same volume reuses the same quantized copy.
+
+    Args:
+        image_volume -- BaseVolume or np.ndarray
+    Optional Args:
+        binwidth     -- select QMODE_FIXEDHU quantization with bins of this width between fixed_start and fixed_end
+        gray_levels  -- select QMODE_STAT quantization into this many bins within +-ndev local std. deviations
+        radius       -- neighborhood radius used for the local stats of QMODE_STAT
+        z_radius     -- 0 for in-plane QMODE_STAT neighborhoods, see quantizeStat
+    Returns:
+        np.ndarray of unsigned integer bin indices with the shape of the volume data
+    """
+    if gray_levels and binwidth:
+        raise ValueError('must exclusively specify "binwidth" or "gray_levels" to select glcm quantization mode')
+    elif binwidth:
+        key = ('quantize', QMODE_FIXEDHU, binwidth, fixed_start, fixed_end)
+        compute_function = lambda array: quantizeFixed(array, binwidth, fixed_start, fixed_end)
+    elif gray_levels:
+        key = ('quantize', QMODE_STAT, gray_levels, ndev, radius, z_radius == 0)
+        compute_function = lambda array: quantizeStat(array, gray_levels, ndev, radius, z_radius)
+    else:
+        raise ValueError('one of "binwidth" or "gray_levels" must be specified to select glcm quantization mode')
+
+    if isinstance(image_volume, np.ndarray):
+        return compute_function(image_volume)
+    return image_volume.getDerivedData(key, lambda: compute_function(image_volume.data))
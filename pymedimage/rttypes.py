@@ -542,6 +542,8 @@ class BaseVolume:
     @data.setter
     def data(self, v):
         self._data = v
+        # arrays derived from the previous data are no longer valid
+        self._derived_cache = {}
 
     @property
     def array(self):
@@ -557,6 +559,20 @@ class BaseVolume:
         self.data = self.data.astype(type)
         return self
 
+    def getDerivedData(self, key, compute_function):
+        """memoizes arrays derived from self.data (quantized copies, masks, ...) for reuse by later calls
+
+        The cache is cleared whenever self.data is reassigned or modified through set_val
+
+        Args:
+            key              -- hashable description of the derived data and all parameters it depends on
+            compute_function -- callable with no arguments that computes the derived data on a cache miss
+        """
+        cache = self.__dict__.setdefault('_derived_cache', {})
+        if key not in cache:
+            cache[key] = compute_function()
+        return cache[key]
+
     # CONSTRUCTOR METHODS
     #  @staticmethod
     #  def _getAttrMap():
@@ -1138,6 +1154,7 @@ class BaseVolume:
 
         # reassign value
         self.data[z, y, x] = value
+        self._derived_cache = {}
 
 
 class MaskableVolume(BaseVolume):
@@ -0,0 +1,39 @@
+# coding: utf-8
+
+# helpers.py
+# -*- coding: utf-8 -*-
+"""reference implementations and utilities shared by the feature tests"""
+
+import contextlib
+import numpy
+import pymedimage.features as features
+
+
+def naive_patch(array, z, y, x, radius, z_radius):
+    """reference zero-padded patch extraction, one voxel at a time"""
+    d, r, c = array.shape
+    patch = numpy.zeros((2*z_radius+1, 2*radius+1, 2*radius+1))
+    for p_z, k_z in enumerate(range(-z_radius, z_radius+1)):
+        for p_y, k_y in enumerate(range(-radius, radius+1)):
+            for p_x, k_x in enumerate(range(-radius, radius+1)):
+                qz, qy, qx = z+k_z, y+k_y, x+k_x
+                if (0 <= qz < d and 0 <= qy < r and 0 <= qx < c):
+                    patch[p_z, p_y, p_x] = array[qz, qy, qx]
+    return patch
+
+def naive_iterator(processing_function, array, radius):
+    z_radius = radius if array.shape[0] > 1 else 0
+    result = numpy.zeros(array.shape)
+    for z, y, x in numpy.ndindex(*array.shape):
+        result[z, y, x] = processing_function(naive_patch(array, z, y, x, radius, z_radius))
+    return result
+
+@contextlib.contextmanager
+def block_bytes(nbytes):
+    """temporarily set features.BLOCK_BYTES, e.g. to force many small blocks"""
+    old_block_bytes = features.BLOCK_BYTES
+    features.BLOCK_BYTES = nbytes
+    try:
+        yield
+    finally:
+        features.BLOCK_BYTES = old_block_bytes
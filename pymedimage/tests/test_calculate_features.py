@@ -0,0 +1,99 @@
+# coding: utf-8
+
+# test_calculate_features.py
+# -*- coding: utf-8 -*-
+"""unittest tests for pymedimage.calculate_features module"""
+
+import tempfile
+import unittest
+import numpy
+import pymedimage.features as features
+from pymedimage import calculate_features
+from pymedimage.data_structures import DOIBase, LocalFeatureDefinition
+from pymedimage.rttypes import MaskableVolume, FrameOfReference
+
+
+class ArrayDOI(DOIBase):
+    """doi over an in-memory volume that stores its features as .npy files beneath features_path"""
+    def __init__(self, doi, volume, features_path):
+        super().__init__(doi)
+        self.volume = volume
+        self.features_path = features_path
+
+    def getImageVolume(self):
+        return self.volume
+
+    def saveFeatureVolume(self, vol, path):
+        numpy.save(path, vol.data)
+
+    def loadFeatureVolume(self, path):
+        return numpy.load(path)
+
+    def getROI(self):
+        return None
+
+    def getFeaturesPath(self):
+        return self.features_path
+
+    def getImageFilePath(self):
+        return None
+
+
+class RadiusSweepTests(unittest.TestCase):
+    def setUp(self):
+        rng = numpy.random.RandomState(7)
+        array = rng.randint(-100, 200, size=(4, 9, 11)).astype(numpy.float64)
+        self.volume = MaskableVolume.fromArray(array, FrameOfReference((0, 0, 0), (1, 1, 1), (11, 9, 4)))
+        self.tempdir = tempfile.TemporaryDirectory()
+        self.doi = ArrayDOI('doi1', self.volume, self.tempdir.name)
+        self.featdef = LocalFeatureDefinition('fo_mean', features.image_firstorder, ext='.npy')
+        self.featdef.addArg('stat_name', 'mean')
+
+    def tearDown(self):
+        self.tempdir.cleanup()
+
+    def single_radius_def(self, radius):
+        featdef = self.featdef.copy()
+        featdef.addArg('radius', radius)
+        return featdef
+
+    def assertStored(self, radius):
+        featdef = self.single_radius_def(radius)
+        self.assertTrue(calculate_features.checkCalculated(self.doi, featdef))
+        expected = features.image_firstorder(self.volume, radius=radius, stat_name='mean').data
+        loaded = calculate_features.loadPrecalculated(self.doi, featdef)
+        numpy.testing.assert_allclose(loaded, expected)
+
+    def test_sweep_stores_each_radius(self):
+        results = calculate_features.calculateRadiusSweep(self.doi, self.featdef, [1, 3])
+        self.assertEqual([code for code, vol in results], [0, 0])
+        for radius, (code, vol) in zip([1, 3], results):
+            self.assertEqual(vol.feature_label, self.single_radius_def(radius).generateFeatureLabel())
+            self.assertStored(radius)
+
+        # already stored sizes are skipped, only the new one is calculated
+        results = calculate_features.calculateRadiusSweep(self.doi, self.featdef, [1, 2])
+        self.assertEqual([code for code, vol in results], [10, 0])
+        self.assertStored(2)
+
+    def test_manager_runs_sweep(self):
+        featdef = self.featdef.copy()
+        featdef.addArg('radius', [1, 3])
+        self.assertEqual(calculate_features.getSweepArg(featdef), 'radius')
+        self.assertIsNone(calculate_features.getSweepArg(self.single_radius_def(1)))
+        # functions that do not sweep their sizes reject a list of them
+        entropy_def = LocalFeatureDefinition('entropy', features.image_entropy, ext='.npy')
+        entropy_def.addArg('radius', [1, 3])
+        with self.assertRaises(ValueError):
+            calculate_features.getSweepArg(entropy_def)
+
+        manager = calculate_features.MultiprocessManager_CalculateFeatures('test', notify=False)
+        result_code, result_string = manager.WorkerFunction((self.doi, featdef))[:2]
+        self.assertEqual((result_code, result_string), (0, 'success'))
+        self.assertStored(1)
+        self.assertStored(3)
+        self.assertEqual(manager.WorkerFunction((self.doi, featdef))[:2], (10, 'skipped'))
+
+
+if __name__ == '__main__':
+    unittest.main()
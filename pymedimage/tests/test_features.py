@@ -0,0 +1,328 @@
+# coding: utf-8
+
+# test_features.py
+# -*- coding: utf-8 -*-
+"""unittest tests for pymedimage.features module"""
+
+import unittest
+import numpy
+import scipy.ndimage
+import pymedimage.features as features
+from pymedimage import features_shared
+from pymedimage.rttypes import MaskableVolume, FrameOfReference
+from pymedimage.tests.helpers import naive_patch, naive_iterator, block_bytes
+
+
+class ImageIteratorTests(unittest.TestCase):
+    def setUp(self):
+        rng = numpy.random.RandomState(0)
+        self.array = rng.randint(0, 6, size=(4, 7, 9)).astype(numpy.float64)
+
+    def test_matches_naive_iteration(self):
+        def weighted_sum(patch):
+            return numpy.sum(patch * numpy.arange(patch.size).reshape(patch.shape))
+        result = features.image_iterator(weighted_sum, self.array, radius=1)
+        numpy.testing.assert_allclose(result, naive_iterator(weighted_sum, self.array, 1))
+
+    def test_2d_input(self):
+        result = features.image_iterator(numpy.sum, self.array[0], radius=2)
+        self.assertTupleEqual(result.shape, self.array[0].shape)
+        numpy.testing.assert_allclose(result, naive_iterator(numpy.sum, self.array[:1], 2)[0])
+
+    def test_2d_mode(self):
+        def per_slice(feature_function, array, **kwargs):
+            return numpy.concatenate([feature_function(image_volume=array[z:z+1], **kwargs)
+                                      for z in range(array.shape[0])])
+        def weighted_sum(patch):
+            return numpy.sum(patch * numpy.arange(patch.size).reshape(patch.shape))
+        result = features.image_iterator(weighted_sum, self.array, radius=1, mode='2d')
+        numpy.testing.assert_allclose(result, per_slice(features.image_iterator, self.array,
+                                                        processing_function=weighted_sum, radius=1))
+        for feature_function, kwargs in [(features.glcm, {'stat_name': 'stat_glcm_contrast', 'gray_levels': 6,
+                                                          'directions': 'all'}),
+                                         (features.glrlm, {'stat_name': 'sre', 'binwidth': 1, 'fixed_start': 0,
+                                                           'fixed_end': 6}),
+                                         (features.image_entropy, {}),
+                                         (features.image_firstorder, {'stat_name': 'stddev'})]:
+            numpy.testing.assert_allclose(feature_function(self.array, radius=2, mode='2d', **kwargs),
+                                          per_slice(feature_function, self.array, radius=2, **kwargs),
+                                          rtol=1e-9, atol=1e-12)
+        with self.assertRaises(ValueError):
+            features.image_iterator(numpy.sum, self.array, radius=1, mode='2.5d')
+
+    def test_batched_plugin_matches_per_patch(self):
+        @features.batched
+        def batched_max(patches):
+            return patches.reshape(patches.shape[0], -1).max(axis=1)
+        # force many small blocks
+        with block_bytes(1000):
+            result = features.image_iterator(batched_max, self.array, radius=1)
+        numpy.testing.assert_allclose(result, features.image_iterator(numpy.max, self.array, radius=1))
+
+    def test_multiple_functions(self):
+        @features.batched
+        def batched_minmax(patches):
+            flat = patches.reshape(patches.shape[0], -1)
+            return numpy.stack([flat.min(axis=1), flat.max(axis=1)], axis=1)
+        batched_minmax.noutputs = 2
+        results = features.image_iterator([numpy.mean, batched_minmax], self.array, radius=1)
+        self.assertEqual(len(results), 3)
+        for function, result in zip((numpy.mean, numpy.min, numpy.max), results):
+            numpy.testing.assert_allclose(result, naive_iterator(function, self.array, 1))
+
+    def test_sparse_roi(self):
+        mask = numpy.zeros(self.array.shape, dtype=bool)
+        mask[1:3, 2:6, 4] = True
+        mask[3, 5, 1:8] = True
+        expected = naive_iterator(numpy.max, self.array, 1)
+        values, indices = features.image_iterator(numpy.max, self.array, radius=1, roi=mask, sparse='indices')
+        numpy.testing.assert_array_equal(indices, numpy.flatnonzero(mask))
+        numpy.testing.assert_allclose(values, expected[mask])
+        expanded = features.image_iterator(numpy.max, self.array, radius=1, roi=mask, sparse='volume')
+        numpy.testing.assert_allclose(expanded, numpy.where(mask, expected, -1))
+        with self.assertRaises(ValueError):
+            features.image_iterator(numpy.max, self.array, radius=1, sparse='indices')
+
+    def test_workers(self):
+        # several blocks per worker
+        with block_bytes(1000):
+            for compute in (lambda w: features.image_iterator(numpy.median, self.array, radius=1, workers=w),
+                            lambda w: features.image_entropy(self.array, radius=2, workers=w),
+                            lambda w: features.image_range(self.array, radius=2, workers=w),
+                            lambda w: features.haar_features(self.array, [((1, 0, 0), 3, (0, 0, 1), 2)], workers=w)):
+                numpy.testing.assert_array_equal(compute(1), compute(3))
+        # running sums of the box filters restart in each slab, so results only agree up to rounding
+        numpy.testing.assert_allclose(features.image_firstorder(self.array, radius=1, stat_name='kurtosis', workers=1),
+                                      features.image_firstorder(self.array, radius=1, stat_name='kurtosis', workers=3),
+                                      rtol=1e-10)
+
+    def test_shared_memory_processes(self):
+        numpy.testing.assert_array_equal(features.image_iterator(numpy.median, self.array, radius=1, processes=2),
+                                         features.image_iterator(numpy.median, self.array, radius=1, workers=1))
+        for serial, shared in zip(features.haar_features(self.array, [((1, 0, 0), 3, None, None)], workers=1),
+                                  features.haar_features(self.array, [((1, 0, 0), 3, None, None)], processes=2)):
+            numpy.testing.assert_array_equal(serial, shared)
+
+    def test_shared_memory_result(self):
+        # the result is handed out in the shared block the workers wrote to, not as a gathered copy
+        result = features_shared.map_slabs(
+            lambda array, b, e: 2*array[tuple(slice(lo, hi) for lo, hi in zip(b, e))],
+            self.array, (0, 0, 0), self.array.shape, processes=2)
+        numpy.testing.assert_array_equal(result, 2*self.array)
+        self.assertFalse(result.flags.owndata)
+        # the owner unlinks the block on release, the mapping lives as long as the array
+        shared = features_shared.SharedArray((3, ))
+        spec = shared.spec
+        array = shared.release()
+        array[:] = 1
+        shared.close()
+        with self.assertRaises(FileNotFoundError):
+            features_shared.SharedArray.attach(spec)
+        numpy.testing.assert_array_equal(array, 1)
+
+    def test_stride(self):
+        dense = features.image_iterator(numpy.median, self.array, radius=1)
+        coarse = features.image_iterator(numpy.median, self.array, radius=1, stride=(1, 2, 3), coarse=True)
+        numpy.testing.assert_array_equal(coarse, dense[:, ::2, ::3])
+        interpolated = features.image_iterator(numpy.median, self.array, radius=1, stride=(1, 2, 3))
+        self.assertEqual(interpolated.shape, self.array.shape)
+        numpy.testing.assert_array_equal(interpolated[:, ::2, ::3], coarse)
+        numpy.testing.assert_allclose(interpolated[:, 1, ::3], (coarse[:, 0] + coarse[:, 1]) / 2)
+        numpy.testing.assert_array_equal(interpolated[:, :, 7:], interpolated[:, :, 6:7].repeat(2, axis=2))
+        numpy.testing.assert_array_equal(
+            features.image_iterator(numpy.median, self.array, radius=1, stride=(1, 2, 3), processes=2), interpolated)
+
+        volume = MaskableVolume.fromArray(self.array, FrameOfReference((1, 2, 3), (0.5, 1, 2), (9, 7, 4)))
+        result = features.image_median(volume, radius=1, stride=2, coarse=True)
+        self.assertEqual(result.frameofreference.spacing, (1, 2, 4))
+        self.assertEqual(result.frameofreference.size, (5, 4, 2))
+        self.assertEqual(result.frameofreference.start, (1, 2, 3))
+
+    def test_points(self):
+        points = numpy.array([[0, 0, 0], [3, 6, 8], [2, 3, 4], [2, 3, 4], [1, 5, 0]])
+        dense = features.image_iterator([numpy.median, numpy.max], self.array, radius=1)
+        result = features.feature_points(features.image_iterator, self.array, points,
+                                         processing_function=[numpy.median, numpy.max], radius=1)
+        self.assertEqual(result.shape, (5, 2))
+        numpy.testing.assert_array_equal(result, numpy.stack([d[tuple(points.T)] for d in dense], axis=1))
+
+        stats = ['stat_glcm_contrast', 'stat_glcm_entropy']
+        dense = features.glcm(self.array, stat_name=stats, radius=1, binwidth=1, fixed_start=0, fixed_end=6)
+        result = features.feature_points(features.glcm, self.array, points, stat_name=stats, radius=1, binwidth=1,
+                                         fixed_start=0, fixed_end=6)
+        numpy.testing.assert_allclose(result, numpy.stack([d[tuple(points.T)] for d in dense], axis=1))
+
+        volume = MaskableVolume.fromArray(self.array, FrameOfReference((1, 2, 3), (0.5, 1, 2), (9, 7, 4)))
+        positions = numpy.array([[1, 2, 3], [5.1, 8, 9.2], [3.1, 5, 7]])
+        result = features.feature_points(features.image_median, volume, positions, world=True, radius=1)
+        numpy.testing.assert_array_equal(result[:, 0], features.image_median(volume, radius=1).array[
+            [0, 3, 2], [0, 6, 3], [0, 8, 4]])
+        with self.assertRaises(ValueError):
+            features.feature_points(features.image_median, self.array, [[4, 0, 0]])
+
+    def test_empty_selection(self):
+        empty = numpy.zeros(self.array.shape, dtype=bool)
+        values, indices = features.image_iterator(numpy.max, self.array, 1, roi=empty, sparse='indices')
+        self.assertTupleEqual((values.shape, indices.shape), ((0, ), (0, )))
+        result = features.image_iterator(numpy.max, self.array, 1, roi=empty, sparse='volume', fill_value=-1)
+        numpy.testing.assert_array_equal(result, numpy.full(self.array.shape, -1))
+        # body mask without any voxel above the threshold
+        result = features.image_iterator(numpy.max, self.array, 1, body_threshold=100, fill_value=-1)
+        numpy.testing.assert_array_equal(result, numpy.full(self.array.shape, -1))
+        results = features.feature_points(features.image_iterator, self.array, numpy.zeros((0, 3), dtype=int),
+                                          processing_function=[numpy.max, numpy.min], radius=1)
+        self.assertTupleEqual(results.shape, (0, 2))
+
+    def test_homogeneous_patches(self):
+        array = numpy.full((6, 12, 14), 3.0)
+        array[2:4, 3:7, 4:9] = self.array[:2, :4, :5]
+        evaluated = []
+
+        @features.batched
+        def block_std(patches):
+            evaluated.append(patches.shape[0])
+            return numpy.std(patches.reshape((patches.shape[0], -1)), axis=1) + numpy.mean(patches, axis=(1, 2, 3))
+
+        report = {}
+        expected = features.image_iterator(block_std, array, radius=1, report=report)
+        # off by default in image_iterator
+        self.assertEqual(report['homogeneous'], 0)
+        del evaluated[:]
+        result = features.image_iterator(block_std, array, radius=1, homogeneous=True, report=report)
+        numpy.testing.assert_array_equal(result, expected)
+        # only the varying patches and a single constant patch of level 3 reach the function
+        constant = (scipy.ndimage.maximum_filter(array, 3, mode='constant', cval=0) ==
+                    scipy.ndimage.minimum_filter(array, 3, mode='constant', cval=0))
+        self.assertEqual((report['voxels'], report['homogeneous']), (array.size, numpy.count_nonzero(constant)))
+        self.assertEqual(report['evaluated'], array.size - report['homogeneous'])
+        self.assertEqual(sum(evaluated), report['evaluated'] + 1)
+
+        for kwargs in ({'roi': array != 3, 'sparse': 'volume'}, {'stride': 2, 'processes': 2}):
+            numpy.testing.assert_array_equal(
+                features.image_iterator(block_std, array, radius=1, homogeneous=True, **kwargs),
+                features.image_iterator(block_std, array, radius=1, **kwargs))
+        with self.assertRaises(ValueError):
+            features.image_iterator(block_std, array + 0.5, radius=1, homogeneous=True)
+        # on by default for the quantized volumes of the texture features
+        report = {}
+        features.glcm(array, stat_name='stat_glcm_contrast', radius=1, binwidth=1, fixed_start=0, fixed_end=6,
+                      report=report)
+        self.assertEqual(report['homogeneous'], numpy.count_nonzero(constant))
+
+    def test_memo(self):
+        array = numpy.tile(self.array[:2, :3, :3], (2, 3, 4))
+        distinct = {naive_patch(array, z, y, x, 1, 1).tobytes() for z, y, x in numpy.ndindex(*array.shape)}
+        evaluated = []
+
+        @features.batched
+        def block_sum(patches):
+            evaluated.append(patches.shape[0])
+            return numpy.sum(patches, axis=(1, 2, 3))
+
+        report = {}
+        result = features.image_iterator(block_sum, array, radius=1, homogeneous=False, memo=True, report=report)
+        numpy.testing.assert_array_equal(result, naive_iterator(numpy.sum, array, 1))
+        self.assertEqual(report['evaluated'], len(distinct))
+        self.assertEqual(sum(evaluated), len(distinct))
+        stats = ['stat_glcm_contrast', 'stat_glcm_idm']
+        for memoized, expected in zip(features.glcm(array, stat_name=stats, radius=1, binwidth=1, fixed_start=0,
+                                                    fixed_end=6, memo=True, processes=2),
+                                      features.glcm(array, stat_name=stats, radius=1, binwidth=1, fixed_start=0,
+                                                    fixed_end=6)):
+            numpy.testing.assert_array_equal(memoized, expected)
+
+
+class LocalHistogramTests(unittest.TestCase):
+    def setUp(self):
+        rng = numpy.random.RandomState(1)
+        self.array = rng.randint(0, 5, size=(5, 8, 10)).astype(numpy.float64)
+
+    def test_running_histogram_entropy(self):
+        expected = naive_iterator(features.entropy_plugin, self.array, 2)
+        for running_histogram in (True, False):
+            result = features.image_entropy(self.array, radius=2, running_histogram=running_histogram)
+            numpy.testing.assert_allclose(result, expected, atol=1e-12)
+
+    def test_running_histogram_energy(self):
+        expected = naive_iterator(features.energy_plugin, self.array, 1)
+        for running_histogram in (True, False):
+            result = features.image_energy(self.array, radius=1, running_histogram=running_histogram)
+            numpy.testing.assert_allclose(result, expected, atol=1e-12)
+
+    def test_running_histogram_bounded_region(self):
+        # each slab labels only its own box and halo
+        full = features._running_histogram_features(self.array, 2, 2, (0, 0, 0), self.array.shape)
+        bounded = features._running_histogram_features(self.array, 2, 2, (1, 2, 4), (4, 8, 7))
+        numpy.testing.assert_allclose(bounded, numpy.asarray(full)[:, 1:4, 2:8, 4:7], atol=1e-12)
+        numpy.testing.assert_allclose(features.image_entropy(self.array, radius=2, running_histogram=True, workers=3),
+                                      full[0], atol=1e-12)
+
+    def test_is_discrete_in_slabs(self):
+        # one slice per slab
+        with block_bytes(100):
+            self.assertTrue(features._is_discrete(self.array))
+            self.assertTrue(features._is_discrete(self.array.astype(numpy.uint8)))
+            array = self.array.copy()
+            array[-1, -1, -1] = 0.5
+            self.assertFalse(features._is_discrete(array))
+
+    def test_has_few_levels_in_slabs(self):
+        with block_bytes(100):
+            self.assertTrue(features._has_few_levels(self.array, 6))
+            self.assertFalse(features._has_few_levels(self.array, 5))
+            # a wide value range with few distinct levels
+            array = self.array * 1000
+            self.assertTrue(features._has_few_levels(array, 6))
+            self.assertFalse(features._has_few_levels(array, 4))
+
+    def test_running_histogram_requires_discrete(self):
+        with self.assertRaises(ValueError):
+            features.image_entropy(self.array + 0.5, radius=1, running_histogram=True)
+
+
+class WaveletTests(unittest.TestCase):
+    def setUp(self):
+        self.array = numpy.random.RandomState(12).normal(0, 100, size=(8, 24, 20))
+        self.volume = MaskableVolume.fromArray(self.array, FrameOfReference((0, 0, 0), (1, 1, 1), (20, 24, 8)))
+
+    def test_level_features_match_naive(self):
+        coeffs = features.wavelet_decomp_3d(self.volume)
+        nlevels = len(coeffs) - 1
+        for feature, plugin in ((features.wavelet_entropy, features.entropy_plugin),
+                                (features.wavelet_energy, features.energy_plugin)):
+            result = feature(self.volume, radius=1, subbands=['ddd', 'ada'])
+            expected = numpy.zeros(self.array.shape)
+            for level in range(nlevels-1, 0, -1):
+                for subband in ('ddd', 'ada'):
+                    level_result = naive_iterator(plugin, coeffs[level+1][subband], 1)
+                    expected += scipy.ndimage.zoom(level_result, numpy.true_divide(self.array.shape,
+                                                                                   level_result.shape), order=3)
+            numpy.testing.assert_allclose(result.data.reshape(self.array.shape), expected, atol=1e-9)
+
+    def test_levels_for_running_histogram(self):
+        coeffs = features.wavelet_decomp_3d(self.volume)[-1]['ddd']
+        coeffs[0, 0, :2] = 0
+        levels = features._wavelet_levels(coeffs)
+        self.assertEqual(levels.dtype.kind, 'i')
+        numpy.testing.assert_array_equal(levels == 0, coeffs == 0)
+        # relabeling keeps the zero padded features of the coefficients
+        numpy.testing.assert_allclose(features.image_entropy(levels, radius=1, running_histogram=True),
+                                      features.image_entropy(coeffs, radius=1, running_histogram=False),
+                                      atol=1e-12)
+        binned = features._wavelet_levels(coeffs, binwidth=25)
+        numpy.testing.assert_array_equal(binned, numpy.floor(coeffs / 25))
+        self.assertTrue(features._is_discrete(binned))
+
+    def test_decomposition_is_memoized(self):
+        features.wavelet_entropy(self.volume, radius=1, subbands='all')
+        features.wavelet_energy(self.volume, radius=1)
+        features.wavelet_raw(self.volume, level=1, subband='dad')
+        self.assertEqual(len([key for key in self.volume._derived_cache if key[0] == 'wavelet']), 1)
+        features.wavelet_raw(self.volume, wavelet_str='db2', level=0)
+        self.assertEqual(len([key for key in self.volume._derived_cache if key[0] == 'wavelet']), 2)
+        with self.assertRaises(ValueError):
+            features.wavelet_raw(self.volume, subband='xyz')
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,50 @@
+# coding: utf-8
+
+# test_features_firstorder.py
+# -*- coding: utf-8 -*-
+"""unittest tests for pymedimage.features_firstorder module"""
+
+import unittest
+import numpy
+import pymedimage.features as features
+from pymedimage import features_firstorder
+from pymedimage.rttypes import MaskableVolume, FrameOfReference
+from pymedimage.tests.helpers import naive_iterator
+
+
+class FirstOrderTests(unittest.TestCase):
+    def setUp(self):
+        self.array = numpy.random.RandomState(8).normal(40, 200, size=(4, 9, 11))
+
+    def test_matches_kernel_formulas(self):
+        reference = {'mean':     numpy.mean,
+                     'variance': lambda p: numpy.var(p, ddof=1),
+                     'stddev':   lambda p: numpy.std(p, ddof=1),
+                     'rms':      lambda p: numpy.sqrt(numpy.mean(p**2)),
+                     'skewness': lambda p: numpy.mean((p-p.mean())**3) / numpy.std(p)**3,
+                     'kurtosis': lambda p: numpy.mean((p-p.mean())**4) / numpy.std(p)**2}
+        names = list(reference.keys())
+        for array in (self.array, self.array[:1]):
+            results = features.image_firstorder(array, radius=2, stat_name=names)
+            for name, result in zip(names, results):
+                numpy.testing.assert_allclose(result, naive_iterator(reference[name], array, 2), rtol=1e-8)
+
+    def test_bounded_region(self):
+        full = features_firstorder.local_firstorder_stats(self.array, ['mean', 'kernel_fo_kurtosis'], 1, 1)
+        bounded = features_firstorder.local_firstorder_stats(self.array, ['mean', 'kurtosis'], 1, 1,
+                                                             (1, 3, 0), (4, 9, 6))
+        numpy.testing.assert_allclose(bounded, full[:, 1:4, 3:9, 0:6], rtol=1e-9)
+        with self.assertRaises(ValueError):
+            features_firstorder.local_firstorder_stats(self.array, ['median'], 1, 1)
+
+    def test_radius_sweep(self):
+        volume = MaskableVolume.fromArray(self.array, FrameOfReference((0, 0, 0), (1, 1, 1), (11, 9, 4)))
+        names = ['mean', 'stddev', 'kurtosis']
+        sweep = features.image_firstorder(volume, radius=[1, 2, 3], stat_name=names)
+        for radius, results in zip([1, 2, 3], sweep):
+            for result, expected in zip(results, features.image_firstorder(volume, radius=radius, stat_name=names)):
+                numpy.testing.assert_allclose(result.data, expected.data, rtol=1e-9, atol=1e-9)
+
+
+if __name__ == "__main__":
+    unittest.main()
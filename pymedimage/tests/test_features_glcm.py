@@ -0,0 +1,168 @@
+# coding: utf-8
+
+# test_features_glcm.py
+# -*- coding: utf-8 -*-
+"""unittest tests for pymedimage.features_glcm module"""
+
+import unittest
+import numpy
+import pymedimage.features as features
+from pymedimage import quantization, features_glcm
+from pymedimage.tests.helpers import naive_iterator
+
+
+def naive_glcm(patch, nlevels, dx, dy, dz):
+    """reference glcm with the mirrored boundary handling of features.glcmMatrix"""
+    def mirror(q, s):
+        if q >= s: q = 2*s - q - 1
+        if q < 0: q = q - 1
+        return q % s
+    matrix = numpy.zeros((nlevels, nlevels))
+    for z, y, x in numpy.ndindex(*patch.shape):
+        nz, ny, nx = mirror(z+dz, patch.shape[0]), mirror(y+dy, patch.shape[1]), mirror(x+dx, patch.shape[2])
+        matrix[patch[z, y, x], patch[nz, ny, nx]] += 1
+    return matrix
+
+
+class GLCMTests(unittest.TestCase):
+    def setUp(self):
+        rng = numpy.random.RandomState(3)
+        self.patches = rng.randint(0, 6, size=(10, 3, 5, 5))
+
+    def test_batch_matches_naive(self):
+        for (dx, dy, dz) in [(1, 0, 0), (0, -1, 0), (1, 1, 1), (-2, 0, 1)]:
+            matrices = features_glcm.glcm_matrix_batch(self.patches, 6, dx, dy, dz)
+            for patch, matrix in zip(self.patches, matrices):
+                numpy.testing.assert_array_equal(matrix, naive_glcm(patch, 6, dx, dy, dz))
+
+    def test_symmetric_normalized(self):
+        matrices = features_glcm.glcm_matrix_batch(self.patches, 6, 1, 0, 0, symmetric=True, normalized=True)
+        numpy.testing.assert_allclose(matrices, numpy.swapaxes(matrices, 1, 2))
+        numpy.testing.assert_allclose(matrices.sum(axis=(1, 2)), 1)
+
+    def test_symmetric_counts_diagonal_once(self):
+        # glcmMatrix adds the transposed counts of distinct levels only, the kernel also doubles the diagonal
+        for patch in self.patches[:3]:
+            counts = naive_glcm(patch, patch.max()+1, 1, 0, 0)
+            self.assertGreater(numpy.trace(counts), 0)
+            expected = counts + counts.T - numpy.diag(numpy.diag(counts))
+            numpy.testing.assert_array_equal(features.glcmMatrix(patch, 1, 0, 0, symmetric=True), expected)
+            numpy.testing.assert_array_equal(features_glcm.glcm_matrix_batch(patch[None], patch.max()+1, 1, 0, 0,
+                                                                             symmetric=True, double_diagonal=True)[0],
+                                             counts + counts.T)
+        for double_diagonal in (False, True):
+            matrices = features_glcm.glcm_matrix_batch(self.patches, 6, 0, 1, 0, symmetric=True,
+                                                       double_diagonal=double_diagonal)
+            matrix, i, j, count = features_glcm.glcm_triplets(self.patches, 6, [(0, 1, 0)], symmetric=True,
+                                                              double_diagonal=double_diagonal)
+            numpy.testing.assert_array_equal(matrices[matrix, i, j], count)
+            self.assertEqual(count.sum(), matrices.sum())
+
+    def test_stats_accept_blocks(self):
+        matrices = features_glcm.glcm_matrix_batch(self.patches, 6, 1, 0, 0)
+        for stat in (features.glcm_stat_contrast, features.glcm_stat_homogeneity, features.glcm_stat_energy):
+            numpy.testing.assert_allclose(stat(matrices), [stat(m) for m in matrices])
+
+    def test_stat_mean_over_patch_levels(self):
+        # patches that don't reach the top level are averaged over their own (max+1, max+1) levels
+        patches = self.patches.copy()
+        patches[:5] //= 2
+        matrices = features_glcm.glcm_matrix_batch(patches, 6, 1, 0, 0)
+        expected = [numpy.mean(features.glcmMatrix(patch, 1, 0, 0)) for patch in patches]
+        numpy.testing.assert_allclose(features.glcm_stat_mean(matrices), expected)
+        self.assertAlmostEqual(features.glcm_stat_mean(matrices[0]), expected[0])
+
+    def test_named_stats(self):
+        counts = features_glcm.glcm_matrix_batch(self.patches, 6, 1, 0, 0, symmetric=True, boundary='clamp')
+        stats = features_glcm.GLCMStatistics(counts)
+        results = stats.evaluate(['contrast', 'stat_glcm_energy', 'correlation', 'imc1'])
+        self.assertTupleEqual(results.shape, (10, 4))
+        for m, row in zip(counts, results):
+            p = m / m.sum()
+            i, j = numpy.indices(p.shape)
+            self.assertAlmostEqual(row[0], numpy.sum(p*(i-j)**2))
+            self.assertAlmostEqual(row[1], numpy.sum(p*p))
+            # symmetric matrix: equal marginals
+            mu = numpy.sum(p*i)
+            var = numpy.sum(p*(i-mu)**2)
+            self.assertAlmostEqual(row[2], (numpy.sum(p*i*j) - 36*mu*mu)/var)
+        self.assertEqual(len(stats.available()), 28)
+        with self.assertRaises(ValueError):
+            stats.evaluate('not_a_stat')
+
+    def test_glcm_stat_name(self):
+        array = numpy.random.RandomState(4).normal(0, 100, size=(3, 8, 8))
+        by_name = features.glcm(array, stat_name='stat_glcm_contrast', radius=1, binwidth=25, dx=1)
+        self.assertTupleEqual(by_name.shape, array.shape)
+        numpy.testing.assert_allclose(by_name, features.glcm(array, 'contrast', radius=1, binwidth=25, dx=1))
+
+    def test_glcm_boundary_padding(self):
+        array = numpy.random.RandomState(9).normal(0, 100, size=(3, 6, 7))
+        contrast = lambda levels, nlevels: features.glcm_stat_contrast(naive_glcm(levels.astype(int), nlevels, 1, 0, 0))
+        # QMODE_FIXEDHU: zero-padded patches are quantized as a whole, intensity 0 falls in bin 11
+        self.assertEqual(quantization.quantizeFixed(0, 25), 11)
+        expected = naive_iterator(lambda patch: contrast(quantization.quantizeFixed(patch, 25), 26), array, 1)
+        for incremental in (False, True):
+            numpy.testing.assert_allclose(features.glcm(array, features.glcm_stat_contrast, radius=1, binwidth=25,
+                                                        dx=1, incremental=incremental), expected)
+        # QMODE_STAT: the patches of the quantized volume are padded with level 0
+        quantized = quantization.quantizeStat(array, 8, 2, 1)
+        expected = naive_iterator(lambda levels: contrast(levels, 8), quantized, 1)
+        numpy.testing.assert_allclose(features.glcm(array, features.glcm_stat_contrast, radius=1, gray_levels=8,
+                                                    dx=1), expected)
+
+    def test_glcm_multiple_stats(self):
+        array = numpy.random.RandomState(5).normal(0, 100, size=(3, 8, 8))
+        stats = ['contrast', features.glcm_stat_homogeneity, 'stat_glcm_entropy', features.glcm_stat_energy]
+        results = features.glcm(array, stats, radius=1, gray_levels=8, dy=1)
+        self.assertEqual(len(results), len(stats))
+        for stat, result in zip(stats, results):
+            numpy.testing.assert_allclose(result, features.glcm(array, stat, radius=1, gray_levels=8, dy=1))
+
+    def test_glcm_directions(self):
+        array = numpy.random.RandomState(6).normal(0, 100, size=(3, 8, 8))
+        stats = ['contrast', features.glcm_stat_homogeneity]
+        per_direction = features.glcm(array, stats, radius=1, gray_levels=8, directions='all', aggregate=None)
+        self.assertEqual([len(volumes) for volumes in per_direction], [13, 13])
+        for direction, (dx, dy, dz) in enumerate(features_glcm.DIRECTIONS_3D):
+            for volumes, result in zip(per_direction, features.glcm(array, stats, radius=1, gray_levels=8,
+                                                                     dx=dx, dy=dy, dz=dz)):
+                numpy.testing.assert_allclose(volumes[direction], result)
+        for aggregate, combine in (('mean', numpy.mean), ('max', numpy.max)):
+            results = features.glcm(array, stats, radius=1, gray_levels=8, directions='all', aggregate=aggregate)
+            for volumes, result in zip(per_direction, results):
+                numpy.testing.assert_allclose(result, combine(volumes, axis=0))
+        self.assertEqual(len(features.glcm(array[0], 'contrast', radius=1, directions='all', aggregate=None)), 4)
+
+    def test_glcm_incremental(self):
+        array = numpy.random.RandomState(7).normal(0, 100, size=(5, 11, 9))
+        stats = ['contrast', features.glcm_stat_homogeneity, 'stat_glcm_correlation']
+        for image in (array, array[0]):
+            for offsets in (dict(dx=1, dy=-1), dict(directions='all', aggregate=None)):
+                expected = features.glcm(image, stats, radius=2, gray_levels=8, **offsets)
+                result = features.glcm(image, stats, radius=2, gray_levels=8, incremental=True, **offsets)
+                numpy.testing.assert_allclose(numpy.array(result), numpy.array(expected), rtol=1e-12)
+        counts = next(features_glcm.glcm_scanlines(self.patches[0], 6, 1, 1, [(1, 0, 1)], boundaries=['mirror'],
+                                                   block_rows=3))[2][0]
+        patches = features._patch_view(self.patches[0], 1, 1)[0, :, 0].astype(numpy.int64)
+        numpy.testing.assert_array_equal(counts[0, 0], features_glcm.glcm_matrix_batch(patches, 6, 1, 0, 1))
+
+    def test_sparse_triplets(self):
+        directions = [(1, 0, 0), (0, -1, 1)]
+        matrices = features_glcm.glcm_matrix_directions(self.patches, 6, directions, symmetric=True,
+                                                        boundary='clamp', double_diagonal=True).reshape((-1, 6, 6))
+        triplets = features_glcm.glcm_triplets(self.patches, 6, directions, symmetric=True, boundary='clamp',
+                                               double_diagonal=True)
+        self.assertLessEqual(len(triplets[0]), 2*self.patches[0].size*len(matrices))
+        names = features_glcm.GLCMStatistics.available()
+        numpy.testing.assert_allclose(features_glcm.SparseGLCMStatistics(triplets, len(matrices), 6).evaluate(names),
+                                      features_glcm.glcm_stats(matrices, names), rtol=1e-9, atol=1e-12)
+        array = numpy.random.RandomState(8).normal(0, 100, size=(3, 8, 8))
+        stats = ['contrast', 'stat_glcm_sumvariance', 'stat_glcm_imc1', features.glcm_stat_energy]
+        numpy.testing.assert_allclose(
+            numpy.array(features.glcm(array, stats, radius=1, binwidth=5, triplets=True)),
+            numpy.array(features.glcm(array, stats, radius=1, binwidth=5, triplets=False)), rtol=1e-9, atol=1e-12)
+
+
+if __name__ == "__main__":
+    unittest.main()
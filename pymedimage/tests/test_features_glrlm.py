@@ -0,0 +1,72 @@
+# coding: utf-8
+
+# test_features_glrlm.py
+# -*- coding: utf-8 -*-
+"""unittest tests for pymedimage.features_glrlm module"""
+
+import unittest
+import numpy
+import pymedimage.features as features
+from pymedimage import features_glrlm
+
+
+def naive_glrlm(patch, nlevels, dx, dy, dz, maxrunlength):
+    """reference run-length matrix, transcribed from glrlm_matrix of local_features.cuh"""
+    pz, py, px = patch.shape
+    array = patch.astype(numpy.float64).ravel()
+    matrix = numpy.zeros((nlevels, maxrunlength))
+    for i in range(array.size):
+        z, y, x = numpy.unravel_index(i, patch.shape)
+        intensity = array[i]
+        if intensity < 0:
+            continue
+        rl = 1
+        for j in range(maxrunlength-2):
+            z, y, x = z+dz, y+dy, x+dx
+            if not (0 <= z < pz and 0 <= y < py and 0 <= x < px):
+                break
+            q = numpy.ravel_multi_index((z, y, x), patch.shape)
+            if array[q] != intensity:
+                break
+            rl += 1
+            array[q] = -1
+        matrix[int(intensity), rl] += 1
+    return matrix
+
+
+class GLRLMTests(unittest.TestCase):
+    def setUp(self):
+        rng = numpy.random.RandomState(6)
+        self.patches = rng.randint(0, 3, size=(10, 3, 5, 5))
+
+    def test_batch_matches_kernel(self):
+        maxrunlength = features_glrlm.max_run_length(2, 1)
+        for (dx, dy, dz) in [(1, 0, 0), (0, 1, 1), (-1, 0, 0), (1, -1, 0), (0, 0, 0)]:
+            for rl in (maxrunlength, 3):
+                matrices = features_glrlm.glrlm_matrix_batch(self.patches, 3, dx, dy, dz, rl)
+                for patch, matrix in zip(self.patches, matrices):
+                    numpy.testing.assert_array_equal(matrix, naive_glrlm(patch, 3, dx, dy, dz, rl))
+
+    def test_named_stats(self):
+        counts = features_glrlm.glrlm_matrix_batch(self.patches, 3, 1, 0, 0)
+        stats = features_glrlm.GLRLMStatistics(counts, patch_size=75)
+        results = stats.evaluate(['sre', 'stat_glrlm_lre', 'gln', 'rp'])
+        for m, row in zip(counts, results):
+            rl = numpy.arange(m.shape[1]) + 1
+            self.assertAlmostEqual(row[0], numpy.sum(m / rl**2) / m.sum())
+            self.assertAlmostEqual(row[1], numpy.sum(m * rl**2) / m.sum())
+            self.assertAlmostEqual(row[2], numpy.sum(m.sum(axis=1)**2) / m.sum())
+            self.assertAlmostEqual(row[3], m.sum() / 75)
+        self.assertEqual(len(stats.available()), 16)
+
+    def test_glrlm(self):
+        array = numpy.random.RandomState(7).normal(0, 100, size=(3, 8, 8))
+        results = features.glrlm(array, ['sre', 'stat_glrlm_re'], radius=1, binwidth=50)
+        self.assertEqual(len(results), 2)
+        numpy.testing.assert_allclose(results[1], features.glrlm(array, 're', radius=1, binwidth=50))
+        with self.assertRaises(ValueError):
+            features.glrlm(array, 'contrast', radius=1, binwidth=50)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,28 @@
+# coding: utf-8
+
+# test_features_gpu.py
+# -*- coding: utf-8 -*-
+"""unittest tests for pymedimage.features_gpu module"""
+
+import unittest
+import numpy
+try:
+    import pymedimage.features_gpu as features_gpu
+except ImportError:
+    features_gpu = None
+
+
+@unittest.skipUnless(features_gpu, "pycuda is required for the gpu features")
+class GPUTests(unittest.TestCase):
+    def setUp(self):
+        self.array = numpy.random.RandomState(12).normal(0, 200, size=(3, 11, 13))
+
+    def test_binwidth_keeps_raw_intensities(self):
+        # only the quantizing kernels (features_gpu.QUANTIZING_KERNELS) are given the pre-quantized volume
+        raw = features_gpu.image_iterator_gpu(self.array, radius=1, feature_kernel='kernel_fo_mean')
+        binned = features_gpu.image_iterator_gpu(self.array, radius=1, binwidth=25, feature_kernel='kernel_fo_mean')
+        numpy.testing.assert_allclose(binned, raw, rtol=1e-5)
+
+
+if __name__ == "__main__":
+    unittest.main()
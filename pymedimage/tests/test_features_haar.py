@@ -0,0 +1,63 @@
+# coding: utf-8
+
+# test_features_haar.py
+# -*- coding: utf-8 -*-
+"""unittest tests for pymedimage.features_haar module"""
+
+import unittest
+import numpy
+import pymedimage.features as features
+from pymedimage.rttypes import MaskableVolume, FrameOfReference
+
+
+def naive_block_mean(array, center, side):
+    """reference mean of the zero-padded block of the given side length centered at center=(x, y, z)"""
+    margin = 2*side + max(abs(c) for c in center)
+    padded = numpy.pad(array.astype(numpy.float64), margin)
+    side_z, center_z = (1, 0) if array.shape[0] == 1 else (side, center[2])
+    result = numpy.zeros(array.shape)
+    for z, y, x in numpy.ndindex(*array.shape):
+        z0 = z + center_z - side_z//2 + margin
+        y0 = y + center[1] - side//2 + margin
+        x0 = x + center[0] - side//2 + margin
+        result[z, y, x] = numpy.mean(padded[z0:z0+side_z, y0:y0+side, x0:x0+side])
+    return result
+
+
+class HaarTests(unittest.TestCase):
+    def setUp(self):
+        self.array = numpy.random.RandomState(10).randint(-500, 500, size=(5, 9, 12))
+        self.bank = [((0, 0, 0), 3, None, None),
+                     ((1, -2, 1), 2, (0, 0, 0), 4),
+                     ((-3, 0, 2), 5, (2, 2, -1), 1)]
+
+    def test_bank_matches_naive(self):
+        for array in (self.array, self.array[:1].astype(numpy.float64)):
+            results = features.haar_features(array, self.bank)
+            for (cadd, sadd, csub, ssub), result in zip(self.bank, results):
+                expected = naive_block_mean(array, cadd, sadd)
+                if ssub:
+                    expected -= naive_block_mean(array, csub, ssub)
+                numpy.testing.assert_allclose(result, expected, atol=1e-9)
+
+    def test_table_is_memoized(self):
+        volume = MaskableVolume.fromArray(self.array.astype(numpy.float64),
+                                          FrameOfReference((0, 0, 0), (1, 1, 1), (12, 9, 5)))
+        features.image_haar(volume, None, cadd=(1, 0, 0), sadd=3)
+        table = volume.getDerivedData(('summed_volume_table',), None)
+        result = features.image_haar(volume, None, cadd=(1, -2, 1), sadd=2, csub=(0, 0, 0), ssub=4)
+        self.assertIs(volume.getDerivedData(('summed_volume_table',), None), table)
+        expected = naive_block_mean(self.array, (1, -2, 1), 2) - naive_block_mean(self.array, (0, 0, 0), 4)
+        numpy.testing.assert_allclose(result.data.reshape(self.array.shape), expected, atol=1e-9)
+
+    def test_block_size_sweep(self):
+        volume = MaskableVolume.fromArray(self.array.astype(numpy.float64),
+                                          FrameOfReference((0, 0, 0), (1, 1, 1), (12, 9, 5)))
+        sweep = features.image_haar(volume, None, cadd=(1, 0, -1), sadd=[1, 3, 5])
+        for sadd, result in zip([1, 3, 5], sweep):
+            numpy.testing.assert_allclose(result.data.reshape(self.array.shape),
+                                          naive_block_mean(self.array, (1, 0, -1), sadd), atol=1e-9)
+
+
+if __name__ == "__main__":
+    unittest.main()
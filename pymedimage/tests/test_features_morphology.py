@@ -0,0 +1,116 @@
+# coding: utf-8
+
+# test_features_morphology.py
+# -*- coding: utf-8 -*-
+"""unittest tests for pymedimage.features_morphology module"""
+
+import unittest
+import numpy
+import pymedimage.features as features
+from pymedimage import features_morphology
+from pymedimage.rttypes import MaskableVolume, FrameOfReference
+from pymedimage.tests.helpers import naive_iterator
+
+
+class MorphologyTests(unittest.TestCase):
+    def setUp(self):
+        self.array = numpy.random.RandomState(9).randint(-500, 500, size=(5, 9, 12)).astype(numpy.int16)
+
+    def test_matches_naive(self):
+        reference = [(features.image_min, numpy.min),
+                     (features.image_max, numpy.max),
+                     (features.image_range, numpy.ptp),
+                     (features.image_median, numpy.median),
+                     (features.image_meanabsdev, lambda p: numpy.sqrt(numpy.mean(numpy.abs(p-p.mean()))))]
+        for radius in (1, 3):
+            for function, reference_function in reference:
+                # called as LocalFeatureDefinition.calculation_function(vol, roi, **args)
+                result = function(self.array, None, radius=radius)
+                numpy.testing.assert_allclose(result, naive_iterator(reference_function, self.array, radius))
+
+    def test_bounded_region(self):
+        full = features_morphology.local_range(self.array, 2, 2)
+        bounded = features_morphology.local_range(self.array, 2, 2, (1, 2, 3), (4, 9, 7))
+        numpy.testing.assert_array_equal(bounded, full[1:4, 2:9, 3:7])
+
+    def test_body_mask(self):
+        array = numpy.full((4, 20, 24), -1000.0)
+        array[:, 4:13, 5:17] = 40 + self.array[:4] // 10
+        array[1:3, 7:10, 8:12] = -900   # enclosed air
+        array[:, 17:19, 2:22] = 100     # couch
+        body = numpy.zeros(array.shape, dtype=bool)
+        body[:, 4:13, 5:17] = True
+        volume = MaskableVolume.fromArray(array, FrameOfReference((0, 0, 0), (1, 1, 1), (24, 20, 4)))
+        mask = features_morphology.body_mask(volume)
+        numpy.testing.assert_array_equal(mask, body)
+        self.assertIs(features_morphology.body_mask(volume), mask)
+
+        dense = features.image_iterator(numpy.median, array, radius=1)
+        result = features.image_iterator(numpy.median, volume, radius=1, body_threshold=-500, fill_value=-1)
+        numpy.testing.assert_array_equal(result.array, numpy.where(body, dense, -1))
+        values, indices = features.image_iterator(numpy.median, array, radius=1, sparse='indices',
+                                                  body_threshold=-500)
+        numpy.testing.assert_array_equal(indices, numpy.flatnonzero(body))
+        numpy.testing.assert_array_equal(values, dense[body])
+        dense = features.glcm(array, stat_name='stat_glcm_contrast', radius=1, binwidth=50)
+        result = features.glcm(array, stat_name='stat_glcm_contrast', radius=1, binwidth=50, body_threshold=-500)
+        numpy.testing.assert_array_equal(result, numpy.where(body, dense, -1))
+
+        # CT volumes are masked at BODY_THRESHOLD HU by default
+        volume.modality = 'CT'
+        result = features.glcm(volume, stat_name='stat_glcm_contrast', radius=1, binwidth=50)
+        numpy.testing.assert_array_equal(result.array, numpy.where(body, dense, -1))
+        result = features.glcm(volume, stat_name='stat_glcm_contrast', radius=1, binwidth=50, body_threshold=None)
+        numpy.testing.assert_array_equal(result.array, dense)
+
+    def test_body_mask_options(self):
+        array = numpy.full((4, 20, 24), -1000.0)
+        array[:, 4:13, 6:18] = 40 + self.array[:4] // 10
+        array[:, 17:19, 2:22] = 100     # couch
+        body = numpy.zeros(array.shape, dtype=bool)
+        body[:, 4:13, 6:18] = True
+        volume = MaskableVolume.fromArray(array, FrameOfReference((0, 0, 0), (1, 1, 1), (24, 20, 4)))
+        volume.modality = 'CT'
+
+        # every local feature masks CT volumes the same way
+        for function, kwargs in ((features.image_entropy, {'radius': 1}),
+                                 (features.image_energy, {'radius': 1}),
+                                 (features.image_firstorder, {'radius': 1, 'stat_name': 'stddev'}),
+                                 (features.image_min, {'radius': 1}),
+                                 (features.image_max, {'radius': 1}),
+                                 (features.image_range, {'radius': 1}),
+                                 (features.image_median, {'radius': 1}),
+                                 (features.image_meanabsdev, {'radius': 1}),
+                                 (features.image_haar, {'cadd': (1, 0, 0), 'sadd': 3})):
+            result = function(volume, **kwargs)
+            numpy.testing.assert_allclose(result.data.reshape(array.shape),
+                                          numpy.where(body, function(array, **kwargs), -1))
+        result = features.haar_features(volume, [((1, 0, 0), 3, (-1, 0, 0), 3)])[0]
+        numpy.testing.assert_allclose(result.data.reshape(array.shape), numpy.where(
+            body, features.haar_features(array, [((1, 0, 0), 3, (-1, 0, 0), 3)])[0], -1))
+
+        # stride, incremental glcm and processes still apply to the bounding box of the mask
+        dense = features.image_iterator(numpy.median, array, radius=1, stride=2)
+        result = features.image_iterator(numpy.median, volume, radius=1, stride=2).data.reshape(array.shape)
+        lattice = body & (numpy.indices(array.shape) % 2 == 0).all(axis=0)
+        numpy.testing.assert_array_equal(result[lattice], dense[lattice])
+        numpy.testing.assert_array_equal(result[~body], -1)
+        result = features.glcm(volume, stat_name='stat_glcm_contrast', radius=1, binwidth=50, incremental=True)
+        dense = features.glcm(array, stat_name='stat_glcm_contrast', radius=1, binwidth=50, incremental=True)
+        numpy.testing.assert_allclose(result.data.reshape(array.shape), numpy.where(body, dense, -1))
+        for function, kwargs in ((features.image_iterator, {'processing_function': numpy.median}),
+                                 (features.image_firstorder, {'stat_name': 'mean'})):
+            result = function(image_volume=volume, radius=1, processes=2, **kwargs)
+            numpy.testing.assert_allclose(result.data.reshape(array.shape),
+                                          numpy.where(body, function(image_volume=array, radius=1, **kwargs), -1))
+        # the coarse lattice isn't masked
+        result = features.image_iterator(numpy.median, volume, radius=1, stride=2, coarse=True)
+        numpy.testing.assert_array_equal(result.data.reshape(result.frameofreference.size[::-1]),
+                                         features.image_iterator(numpy.median, array, radius=1, stride=2,
+                                                                 coarse=True))
+        with self.assertRaises(ValueError):
+            features.image_iterator(numpy.median, volume, radius=1, stride=2, coarse=True, body_threshold=-500)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,72 @@
+# coding: utf-8
+
+# test_features_tiled.py
+# -*- coding: utf-8 -*-
+"""unittest tests for pymedimage.features_tiled module"""
+
+import os
+import tempfile
+import unittest
+import numpy
+import pymedimage.features as features
+from pymedimage import features_tiled
+from pymedimage.rttypes import MaskableVolume, FrameOfReference
+
+
+class TiledTests(unittest.TestCase):
+    def setUp(self):
+        self.array = numpy.random.RandomState(11).normal(0, 100, size=(7, 23, 19))
+        self.tempdir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tempdir.cleanup()
+
+    def test_memmap_tiles_match_full_volume(self):
+        source = os.path.join(self.tempdir.name, 'source.npy')
+        numpy.save(source, self.array)
+        output = features_tiled.tiled_feature(features.image_entropy, source,
+                                              os.path.join(self.tempdir.name, 'entropy.npy'),
+                                              radius=2, tile_shape=(3, 8, 5))
+        numpy.testing.assert_allclose(numpy.load(output), features.image_entropy(self.array, radius=2), rtol=1e-6)
+
+    def test_hdf5_round_trip(self):
+        volume = MaskableVolume.fromArray(self.array, FrameOfReference((1, 2, 3), (1, 1, 2), (19, 23, 7)))
+        source = os.path.join(self.tempdir.name, 'source.h5')
+        volume.toHDF5(source)
+        output = features_tiled.tiled_feature(features.glcm, source, os.path.join(self.tempdir.name, 'glcm.h5'),
+                                              radius=1, halo=2, tile_shape=(4, 9, 9), dtype=numpy.float64,
+                                              glcm_stat_function='contrast', gray_levels=8)
+        result = MaskableVolume.fromHDF5(output)
+        self.assertTupleEqual(tuple(result.frameofreference.start), (1, 2, 3))
+        numpy.testing.assert_allclose(result.data.reshape(self.array.shape),
+                                      features.glcm(self.array, 'contrast', radius=1, gray_levels=8))
+
+    def test_tiled_mode(self):
+        source = os.path.join(self.tempdir.name, 'source.npy')
+        numpy.save(source, self.array)
+        output = numpy.zeros(self.array.shape)
+        features.image_iterator(numpy.median, source, radius=1, output=output, tiles=(3, 8, 5))
+        numpy.testing.assert_array_equal(output, features.image_iterator(numpy.median, self.array, radius=1))
+        # only the voxels of each tile are evaluated, not those of its halo
+        evaluated = []
+        features.image_iterator(lambda patch: evaluated.append(patch) or 0, source, radius=1,
+                                output=numpy.zeros(self.array.shape), tiles=(3, 8, 5), workers=1)
+        self.assertEqual(len(evaluated), self.array.size)
+        # QMODE_STAT quantization reads a halo of 2*radius by default
+        self.assertEqual(features_tiled.feature_halo(features.glcm, 2, {'gray_levels': 8}), 4)
+        self.assertEqual(features_tiled.feature_halo(features.glcm, 2, {'binwidth': 25}), 2)
+        for feature_function, kwargs in ((features.glcm, {'stat_name': 'stat_glcm_contrast', 'gray_levels': 8}),
+                                         (features.glrlm, {'stat_name': 'sre', 'gray_levels': 8})):
+            output = feature_function(source, radius=2, output=numpy.zeros(self.array.shape), tiles=(3, 8, 5),
+                                      **kwargs)
+            numpy.testing.assert_allclose(output, feature_function(self.array, radius=2, **kwargs))
+            with self.assertRaises(ValueError):
+                features_tiled.tiled_feature(feature_function, source, numpy.zeros(self.array.shape), radius=2,
+                                             halo=2, **kwargs)
+        with self.assertRaises(ValueError):
+            features.glcm(self.array, stat_name='stat_glcm_contrast', roi=self.array > 0, sparse='volume',
+                          output=numpy.zeros(self.array.shape))
+
+
+if __name__ == "__main__":
+    unittest.main()
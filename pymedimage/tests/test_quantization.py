@@ -0,0 +1,44 @@
+# coding: utf-8
+
+# test_quantization.py
+# -*- coding: utf-8 -*-
+"""unittest tests for pymedimage.quantization module"""
+
+import unittest
+import numpy
+from pymedimage import quantization
+from pymedimage.rttypes import MaskableVolume, FrameOfReference
+from pymedimage.tests.helpers import naive_patch
+
+
+class QuantizationTests(unittest.TestCase):
+    def setUp(self):
+        rng = numpy.random.RandomState(2)
+        self.array = rng.normal(0, 200, size=(3, 6, 7))
+        self.volume = MaskableVolume.fromArray(self.array, FrameOfReference((0, 0, 0), (1, 1, 1), (7, 6, 3)))
+
+    def test_fixed_quantization(self):
+        quantized = quantization.quantize_volume(self.array, binwidth=25)
+        nbins = quantization.getFixedNBins(25)
+        for val, q in zip(self.array.flat, quantized.flat):
+            self.assertEqual(q, min(nbins-1, max(0, numpy.floor((val+250)/25)+1)))
+
+    def test_stat_quantization_uses_local_stats(self):
+        quantized = quantization.quantize_volume(self.array, gray_levels=8, ndev=2, radius=1)
+        for z, y, x in numpy.ndindex(*self.array.shape):
+            patch = naive_patch(self.array, z, y, x, 1, 1)
+            mean, std = numpy.mean(patch), numpy.std(patch, ddof=1)
+            binwidth = 4*std/6
+            expected = min(7, max(0, numpy.floor((self.array[z, y, x]-mean+2*std)/(binwidth+1e-9))+1))
+            self.assertEqual(quantized[z, y, x], expected)
+
+    def test_quantized_volume_is_memoized(self):
+        first = quantization.quantize_volume(self.volume, binwidth=25)
+        self.assertIs(quantization.quantize_volume(self.volume, binwidth=25), first)
+        self.assertIsNot(quantization.quantize_volume(self.volume, binwidth=50), first)
+        self.volume.data = self.array + 1
+        self.assertIsNot(quantization.quantize_volume(self.volume, binwidth=25), first)
+
+
+if __name__ == "__main__":
+    unittest.main()